@@ -1,10 +1,13 @@
+from array import array
 from dataclasses import dataclass
 from functools import reduce
-from typing import Optional
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
 
-from pysam import CSOFT_CLIP, AlignedSegment
+import numpy as np
+from pysam import CSOFT_CLIP, AlignedSegment, AlignmentFile
 
-from delfies import Orientation
+from delfies import ID_DELIM, Orientation
 
 
 @dataclass
@@ -40,14 +43,68 @@ DEFAULT_READ_FILTER_FLAG = reduce(
     lambda x1, x2: x1 | x2, map(lambda el: FLAGS[el], DEFAULT_READ_FILTER_NAMES)
 )
 DEFAULT_MIN_MAPQ = 20
+INDEX_EXTENSIONS = [".bai", ".csi", ".crai"]
+
+
+def open_alignment_file(
+    alignment_fname: str, reference_fname: Optional[str] = None, threads: int = 1
+) -> AlignmentFile:
+    """
+    Opens a BAM or CRAM file. `reference_fname` is needed to decode CRAM files;
+    `threads`: number of htslib threads decompressing the alignments.
+    """
+    return AlignmentFile(
+        alignment_fname, reference_filename=reference_fname, threads=threads
+    )
+
+
+def get_alignment_file_identity(alignment_fname: str) -> str:
+    """
+    Identifies a BAM or CRAM file, and its index, by path, size and modification time
+    """
+    alignment_path = Path(alignment_fname).resolve()
+    index_paths = [
+        Path(f"{alignment_path}{extension}") for extension in INDEX_EXTENSIONS
+    ] + [alignment_path.with_suffix(extension) for extension in INDEX_EXTENSIONS]
+    result = list()
+    for path in [alignment_path] + index_paths:
+        if path.exists():
+            path_stat = path.stat()
+            result.extend([path, path_stat.st_size, path_stat.st_mtime_ns])
+    return ID_DELIM.join(map(str, result))
 
 
 def read_flag_matches(read: AlignedSegment, filtering_SAM_flag: int) -> bool:
     return (read.flag & filtering_SAM_flag) != 0
 
 
+def get_softclip_length_at_extremity(
+    cigartuples: List[Tuple[int, int]], orientation: Orientation
+) -> int:
+    if orientation is Orientation.forward:
+        operation, length = cigartuples[-1]
+    else:
+        operation, length = cigartuples[0]
+    return length if operation == CSOFT_CLIP else 0
+
+
+def has_softclip_of_min_length(read: AlignedSegment, min_softclip_length: int) -> bool:
+    """
+    Cheap gate, looking at the read's CIGAR only: most reads have no softclips, or only
+    short ones, and can be discarded without decoding their sequence.
+    """
+    cigartuples = read.cigartuples
+    if not cigartuples:
+        return False
+    return any(
+        get_softclip_length_at_extremity(cigartuples, orientation)
+        >= min_softclip_length
+        for orientation in Orientation
+    )
+
+
 def find_softclip_at_extremity(
-    read: AlignedSegment, orientation: Orientation
+    read: AlignedSegment, orientation: Orientation, min_softclip_length: int = 1
 ) -> Optional[SoftclippedRead]:
     """
     In pysam (version 0.20.0), attributes `(reference|query_alignment)_start` and
@@ -59,19 +116,50 @@ def find_softclip_at_extremity(
     In the returned object, we return the position of the first softclipped position in
     both reference and read (query). If in forward orientation in the read,
     no adjustment is needed, and if in reverse orientation, we subtract one.
+
+    Softclips shorter than `min_softclip_length` are not returned; this is checked
+    before the read's sequence is decoded.
     """
+    sc_length = get_softclip_length_at_extremity(read.cigartuples, orientation)
+    if sc_length == 0 or sc_length < min_softclip_length:
+        return None
     result = SoftclippedRead(read.query_sequence, read.query_name, None, None, None)
     if orientation is Orientation.forward:
-        if read.cigartuples[-1][0] == CSOFT_CLIP:
-            result.sc_ref = read.reference_end
-            result.sc_query = read.query_alignment_end
-            result.sc_length = len(result.sequence) - result.sc_query
+        result.sc_ref = read.reference_end
+        result.sc_query = read.query_alignment_end
+        result.sc_length = len(result.sequence) - result.sc_query
     else:
-        if read.cigartuples[0][0] == CSOFT_CLIP:
-            result.sc_ref = read.reference_start - 1
-            result.sc_query = read.query_alignment_start - 1
-            result.sc_length = result.sc_query + 1
-    if result.sc_ref is None:
-        return None
-    else:
-        return result
+        result.sc_ref = read.reference_start - 1
+        result.sc_query = read.query_alignment_start - 1
+        result.sc_length = result.sc_query + 1
+    return result
+
+
+class ReadCoverage:
+    """
+    Accumulates the reference spans of reads, from which read depth can then be computed
+    at any positions. Like in a pileup, a read covers all reference positions from its
+    alignment start to its alignment end, including deletions and reference skips.
+    """
+
+    def __init__(self):
+        self._starts = array("q")
+        self._ends = array("q")
+
+    def add(self, read: AlignedSegment) -> None:
+        reference_end = read.reference_end
+        if reference_end is not None:
+            self._starts.append(read.reference_start)
+            self._ends.append(reference_end)
+
+    def get_read_depths(self, positions: Iterable[int]) -> np.ndarray:
+        """
+        Read depth at a position: the number of reads starting at or before it,
+        minus the number of reads ending at or before it (alignment ends are exclusive)
+        """
+        positions = np.fromiter(positions, dtype=np.int64)
+        starts = np.sort(np.frombuffer(self._starts, dtype=np.int64))
+        ends = np.sort(np.frombuffer(self._ends, dtype=np.int64))
+        return np.searchsorted(starts, positions, side="right") - np.searchsorted(
+            ends, positions, side="right"
+        )
@@ -1,9 +1,10 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from importlib import metadata
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
-from datasci import Tent
+if TYPE_CHECKING:
+    from delfies.interval_utils import IntervalLookup
 
 __version__ = metadata.version("delfies")
 
@@ -42,8 +43,18 @@ class BreakpointDetectionParams:
     read_filter_flag: int
     min_supporting_reads: int
     keep_telomeric_breakpoints: bool
-    breakpoint_type: str = ""
+    min_softclip_length: int = None
+    breakpoint_types: List[BreakpointType] = field(
+        default_factory=lambda: list(all_breakpoint_types)
+    )
+    target_regions: Dict[BreakpointType, "IntervalLookup"] = field(default_factory=dict)
     ofname_base: str = None
+    foci_shards_dirname: str = None
+    # Reference to decode CRAM alignments with
+    reference_fname: str = None
+    decode_threads: int = 1
+    # Directory in which to cache raw softclip counts, if any
+    softclip_cache_dirname: str = None
 
 
 class Orientation(Enum):
@@ -54,6 +65,25 @@ class Orientation(Enum):
 READ_SUPPORT_PREFIX = "num_supporting_reads"
 
 
+@dataclass
+class BreakpointFocus:
+    """
+    A single breakpoint focus; see `delfies.foci_table.FociTable` for storing many.
+    Read support fields are named f"{READ_SUPPORT_PREFIX}{ID_DELIM}{orientation.name}".
+    """
+
+    contig: str
+    start: int
+    end: int
+    read_depth: int = 0
+    breakpoint_type: str = ""
+    num_supporting_reads__forward: int = 0
+    num_supporting_reads__reverse: int = 0
+
+    def __getitem__(self, field_name: str) -> int:
+        return getattr(self, field_name)
+
+
 @dataclass
 class PutativeBreakpoint:
     orientation: Orientation
@@ -61,13 +91,13 @@ class PutativeBreakpoint:
     next_max_value: int
     max_value_other_orientation: int
     interval: Tuple[int, int]
-    focus: Tent
+    focus: BreakpointFocus
     breakpoint_type: str = ""
 
-    def update(self, query_focus: Tent):
-        query_focus_value = int(
-            query_focus[f"{READ_SUPPORT_PREFIX}{ID_DELIM}{self.orientation.name}"]
-        )
+    def update(self, query_focus: BreakpointFocus):
+        query_focus_value = query_focus[
+            f"{READ_SUPPORT_PREFIX}{ID_DELIM}{self.orientation.name}"
+        ]
         if query_focus_value > self.max_value:
             self.next_max_value = self.max_value
             self.max_value = query_focus_value
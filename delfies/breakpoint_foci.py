@@ -3,234 +3,836 @@ Functions to find breakpoint foci. Definition: I call a breakpoint focus (plural
 location at which 1+ reads are found bearing softclips compatible with a PDE breakpoint.
 """
 
+import hashlib
+import os
 from collections import defaultdict
-from itertools import chain as it_chain
-from typing import Dict, List
+from dataclasses import dataclass
+from operator import attrgetter, itemgetter
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
-from datasci import Tent, Tents
+import numpy as np
 from pysam import AlignedSegment, AlignmentFile
 
 from delfies import (
     ID_DELIM,
-    READ_SUPPORT_PREFIX,
     BreakpointDetectionParams,
+    BreakpointFocus,
     BreakpointType,
     Orientation,
     PutativeBreakpoint,
+    PutativeBreakpoints,
 )
-from delfies.interval_utils import Interval, get_contiguous_ranges
-from delfies.SAM_utils import find_softclip_at_extremity, read_flag_matches
-from delfies.telomere_utils import has_softclipped_telo_array
-
-READ_SUPPORTS = [
-    f"{READ_SUPPORT_PREFIX}{ID_DELIM}{o}" for o in map(lambda e: e.name, Orientation)
-]
-
+from delfies.foci_table import (
+    FOCI_COLUMN_DTYPES,
+    READ_SUPPORTS,
+    FociTable,
+    SoftclipPositions,
+)
+from delfies.interval_utils import (
+    Interval,
+    Intervals,
+    Tile,
+    Tiles,
+    get_contiguous_ranges,
+)
+from delfies.SAM_utils import (
+    ReadCoverage,
+    SoftclippedRead,
+    find_softclip_at_extremity,
+    get_alignment_file_identity,
+    has_softclip_of_min_length,
+    open_alignment_file,
+    read_flag_matches,
+)
+from delfies.telomere_utils import TelomereMatcher
 
-def setup_breakpoint_tents() -> Tents:
-    tents_header = [
-        "contig",
-        "start",
-        "end",
-        "read_depth",
-        "breakpoint_type",
-    ] + READ_SUPPORTS
-    tents = Tents(header=tents_header, required_header=tents_header[:5], unset_value=0)
-    return tents
+BreakpointFoci = Dict[BreakpointType, FociTable]
+READ_BATCH_SIZE = 10_000
+G2S_MIN_TELO_ARRAY_SIZE = 3
 
 
 ####################
 ## Foci detection ##
 ####################
-def focus_has_enough_support(focus_tent, min_support: int) -> bool:
+def focus_has_enough_support(focus: BreakpointFocus, min_support: int) -> bool:
     result = False
     for read_support in READ_SUPPORTS:
-        result |= int(focus_tent[read_support]) >= min_support
+        result |= focus[read_support] >= min_support
     return result
 
 
-def record_softclips(
+def read_passes_filters(
+    aligned_read: AlignedSegment, detection_params: BreakpointDetectionParams
+) -> bool:
+    return aligned_read.mapping_quality >= detection_params.min_mapq and (
+        not read_flag_matches(aligned_read, detection_params.read_filter_flag)
+    )
+
+
+def get_min_softclip_length(
+    detection_params: BreakpointDetectionParams, breakpoint_type: BreakpointType
+) -> int:
+    """
+    If not set by the user, defaults to the shortest softclip that can contain a
+    telomere array of size `telo_array_size`, for S2G breakpoints; G2S breakpoints
+    are supported by softclips of any length.
+    """
+    if detection_params.min_softclip_length is not None:
+        return max(detection_params.min_softclip_length, 1)
+    if breakpoint_type is BreakpointType.G2S:
+        return 1
+    telo_array_length = (
+        len(detection_params.telomere_seqs[Orientation.forward])
+        * detection_params.telo_array_size
+    )
+    return max(telo_array_length - detection_params.max_edit_distance, 1)
+
+
+def softclip_is_in_target_regions(
     aligned_read: AlignedSegment,
-    breakpoint_foci: Tents,
-    breakpoint_foci_positions,
+    softclipped_read: SoftclippedRead,
+    breakpoint_type: BreakpointType,
+    detection_params: BreakpointDetectionParams,
+) -> bool:
+    """
+    S2G breakpoints are looked for in reads overlapping the S2G target regions;
+    G2S breakpoints require the softclips to start inside a G2S target region
+    (i.e. close to a telomere array in the genome).
+    Breakpoint types without target regions are looked for everywhere.
+    """
+    target_regions = detection_params.target_regions.get(breakpoint_type)
+    if target_regions is None:
+        return True
+    ref_name = aligned_read.reference_name
+    if breakpoint_type is BreakpointType.G2S:
+        return target_regions.spans(ref_name, softclipped_read.sc_ref)
+    else:
+        return target_regions.overlaps(
+            ref_name, aligned_read.reference_start, aligned_read.reference_end
+        )
+
+
+def softclips_support_breakpoint(
+    softclipped_reads: List[SoftclippedRead],
+    orientations: List[Orientation],
+    breakpoint_type: BreakpointType,
+    detection_params: BreakpointDetectionParams,
+) -> List[bool]:
+    """
+    Telomere arrays are searched for in all of `softclipped_reads` at once, so that
+    most non-telomeric softclips get rejected by a single vectorized k-mer screen.
+    """
+    if breakpoint_type is BreakpointType.G2S:
+        if detection_params.keep_telomeric_breakpoints:
+            return [True] * len(softclipped_reads)
+        # In G2S mode, we reject softclipped telomeres occurring in any orientation
+        telomere_matcher = TelomereMatcher.from_detection_params(
+            detection_params, min_telo_array_size=G2S_MIN_TELO_ARRAY_SIZE
+        )
+        found_telo_arrays = telomere_matcher.find_softclipped_telo_arrays(
+            softclipped_reads, orientations
+        )
+        return [
+            not (found_forward or found_reverse)
+            for found_forward, found_reverse in zip(
+                found_telo_arrays[Orientation.forward],
+                found_telo_arrays[Orientation.reverse],
+            )
+        ]
+    else:
+        telomere_matcher = TelomereMatcher.from_detection_params(detection_params)
+        result = [False] * len(softclipped_reads)
+        for orientation in Orientation:
+            read_indices = [
+                i for i, elem in enumerate(orientations) if elem is orientation
+            ]
+            found_telo_arrays = telomere_matcher.find_softclipped_telo_arrays(
+                [softclipped_reads[i] for i in read_indices],
+                [orientation] * len(read_indices),
+                searched_orientations=[orientation],
+            )
+            for i, found in zip(read_indices, found_telo_arrays[orientation]):
+                result[i] = found
+        return result
+
+
+def record_softclips(
+    aligned_reads: List[AlignedSegment],
+    softclip_positions: Dict[BreakpointType, SoftclipPositions],
     detection_params: BreakpointDetectionParams,
-    seq_region: Interval,
 ) -> None:
-    for read_support in READ_SUPPORTS:
-        orientation = Orientation[read_support.split(ID_DELIM)[1]]
-        softclipped_read = find_softclip_at_extremity(aligned_read, orientation)
-        if softclipped_read is None:
-            continue
-        if detection_params.breakpoint_type is BreakpointType.G2S:
-            softclips_start_inside_target_region = seq_region.spans(
-                softclipped_read.sc_ref
+    """
+    Evaluates a batch of reads for each of the breakpoint types in `detection_params`,
+    so that all breakpoint types are detected in a single pass over the reads.
+    """
+    min_softclip_lengths = {
+        breakpoint_type: get_min_softclip_length(detection_params, breakpoint_type)
+        for breakpoint_type in detection_params.breakpoint_types
+    }
+    candidates = {
+        breakpoint_type: list() for breakpoint_type in detection_params.breakpoint_types
+    }
+    for aligned_read in aligned_reads:
+        for orientation in Orientation:
+            softclipped_read = find_softclip_at_extremity(
+                aligned_read, orientation, min(min_softclip_lengths.values())
             )
-            reject_softclipped_telo_array = False
-            if not detection_params.keep_telomeric_breakpoints:
-                # In G2S mode, we reject softclipped telomeres occurring in any orientation
-                for G2S_tested_orientation in Orientation:
-                    reject_softclipped_telo_array |= has_softclipped_telo_array(
-                        softclipped_read,
-                        G2S_tested_orientation,
-                        detection_params.telomere_seqs,
-                        min_telo_array_size=3,
-                        max_edit_distance=detection_params.max_edit_distance,
+            if softclipped_read is None:
+                continue
+            for breakpoint_type in detection_params.breakpoint_types:
+                if softclipped_read.sc_length < min_softclip_lengths[breakpoint_type]:
+                    continue
+                if softclip_is_in_target_regions(
+                    aligned_read, softclipped_read, breakpoint_type, detection_params
+                ):
+                    candidates[breakpoint_type].append(
+                        (aligned_read.reference_id, softclipped_read, orientation)
                     )
-            keep_read = (
-                softclips_start_inside_target_region
-                and not reject_softclipped_telo_array
+    for breakpoint_type, type_candidates in candidates.items():
+        keep_reads = softclips_support_breakpoint(
+            [softclipped_read for _, softclipped_read, _ in type_candidates],
+            [orientation for _, _, orientation in type_candidates],
+            breakpoint_type,
+            detection_params,
+        )
+        for (reference_id, softclipped_read, orientation), keep_read in zip(
+            type_candidates, keep_reads
+        ):
+            if keep_read:
+                softclip_positions[breakpoint_type].add(
+                    reference_id, softclipped_read.sc_ref, orientation
+                )
+
+
+@dataclass
+class RawBreakpointFoci:
+    """
+    The breakpoint foci of a region before filtering for read support: all foci with
+    at least `min_supporting_reads` supporting reads (of each breakpoint type), and
+    the read depth around each of them.
+
+    Filtering for any higher read support (`filter_by_support`) needs no further
+    pass over the reads.
+    """
+
+    contig: str
+    min_supporting_reads: int
+    foci: BreakpointFoci
+    depth_positions: np.ndarray
+    read_depths: np.ndarray
+
+    def filter_by_support(self, min_supporting_reads: int) -> BreakpointFoci:
+        if min_supporting_reads < self.min_supporting_reads:
+            raise ValueError(
+                f"Foci were only recorded with >= {self.min_supporting_reads} supporting reads"
             )
-        else:
-            softclipped_telo_array_found = has_softclipped_telo_array(
-                softclipped_read,
-                orientation,
-                detection_params.telomere_seqs,
-                detection_params.telo_array_size,
-                max_edit_distance=detection_params.max_edit_distance,
+        result = dict()
+        for breakpoint_type, type_foci in self.foci.items():
+            supported_foci = type_foci.filter(
+                type_foci.has_support(min_supporting_reads)
             )
-            keep_read = softclipped_telo_array_found
-        if not keep_read:
-            continue
-        pos_to_commit = softclipped_read.sc_ref
-        ref_name = aligned_read.reference_name
-        match_tent_key = f"{ref_name}{ID_DELIM}{pos_to_commit}"
-        if match_tent_key in breakpoint_foci_positions:
-            breakpoint_foci_positions[match_tent_key][read_support] += 1
-        else:
-            new_tent = breakpoint_foci.new()
-            new_tent.update(
-                contig=ref_name,
-                start=pos_to_commit,
-                end=pos_to_commit + 1,
-                breakpoint_type=str(detection_params.breakpoint_type),
+            positions_to_commit = get_positions_to_commit(supported_foci)
+            result[breakpoint_type] = record_read_depth_at_breakpoint_foci(
+                positions_to_commit,
+                supported_foci,
+                self.contig,
+                self.read_depths[
+                    np.searchsorted(self.depth_positions, positions_to_commit)
+                ],
             )
-            new_tent[read_support] += 1
-            breakpoint_foci_positions[match_tent_key] = new_tent
+        return result
+
+    def save(self, fname: str) -> None:
+        """
+        Stored compressed, with positions and counts in the dtypes of foci tables
+        """
+        type_columns = dict()
+        for breakpoint_type, type_foci in self.foci.items():
+            for name in ["start"] + READ_SUPPORTS:
+                type_columns[f"{breakpoint_type}{ID_DELIM}{name}"] = type_foci.columns[
+                    name
+                ]
+        with open(fname, "wb") as ofstream:
+            np.savez_compressed(
+                ofstream,
+                contig=np.array(self.contig),
+                min_supporting_reads=np.array(self.min_supporting_reads),
+                breakpoint_types=np.array(list(map(str, self.foci)), dtype=str),
+                depth_positions=self.depth_positions.astype(
+                    FOCI_COLUMN_DTYPES["start"]
+                ),
+                read_depths=self.read_depths.astype(FOCI_COLUMN_DTYPES["read_depth"]),
+                **type_columns,
+            )
+
+    @classmethod
+    def load(cls, fname: str) -> "RawBreakpointFoci":
+        with np.load(fname) as npz_data:
+            contig = str(npz_data["contig"])
+            foci = dict()
+            for breakpoint_type in npz_data["breakpoint_types"].tolist():
+                breakpoint_type = BreakpointType(breakpoint_type)
+                foci[breakpoint_type] = FociTable(
+                    breakpoint_type,
+                    [contig],
+                    {
+                        name: npz_data[f"{breakpoint_type}{ID_DELIM}{name}"]
+                        for name in ["start"] + READ_SUPPORTS
+                    },
+                )
+            return cls(
+                contig,
+                int(npz_data["min_supporting_reads"]),
+                foci,
+                npz_data["depth_positions"],
+                npz_data["read_depths"],
+            )
+
+
+# Number of positions either side of a breakpoint focus at which read depth is recorded
+FOCUS_FLANK_SIZE = 2
+
+
+def get_positions_to_commit(supported_foci: FociTable) -> np.ndarray:
+    """
+    Expand to a few positions before and after putative breakpoints: allows users to
+    assess changes in coverage around breakpoints (using the corresponding output tsv)
+    """
+    return np.unique(
+        np.add.outer(
+            supported_foci.starts.astype(np.int64),
+            np.arange(-FOCUS_FLANK_SIZE, FOCUS_FLANK_SIZE + 1),
+        )
+    )
+
+
+def filter_foci_by_support(foci: FociTable, min_supporting_reads: int) -> FociTable:
+    """
+    The foci that detection with `min_supporting_reads` would record, from foci recorded
+    with a lower `min_supporting_reads` (e.g. loaded from a foci tsv): the read support of
+    foci with too little support is zeroed, and only positions around foci with enough
+    support (see `get_positions_to_commit`) are kept.
+    """
+    is_supported = foci.has_support(min_supporting_reads)
+    position_keys = foci.get_position_keys()
+    positions_to_keep = np.unique(
+        np.add.outer(
+            position_keys[is_supported],
+            np.arange(-FOCUS_FLANK_SIZE, FOCUS_FLANK_SIZE + 1),
+        )
+    )
+    # Positions before the contig start are only recorded for breakpoints
+    is_kept = np.isin(position_keys, positions_to_keep) & (
+        (foci.starts >= 0) | is_supported
+    )
+    result = foci.filter(is_kept)
+    for read_support in READ_SUPPORTS:
+        result.columns[read_support][~is_supported[is_kept]] = 0
+    return result
 
 
 def find_breakpoint_foci(
     detection_params: BreakpointDetectionParams,
     seq_region: Interval,
-) -> Tents:
-    breakpoint_foci = setup_breakpoint_tents()
-    breakpoint_foci_positions = {}
+    bam_fstream: Optional[AlignmentFile] = None,
+) -> BreakpointFoci:
+    """
+    `bam_fstream`: an open handle to `detection_params.bam_fname`, to avoid reopening
+    the BAM and reloading its index for each region. Opened here if not provided.
+    """
+    return scan_breakpoint_foci(
+        detection_params, seq_region, bam_fstream
+    ).filter_by_support(detection_params.min_supporting_reads)
+
+
+def scan_breakpoint_foci(
+    detection_params: BreakpointDetectionParams,
+    seq_region: Interval,
+    bam_fstream: Optional[AlignmentFile] = None,
+    min_supporting_reads: Optional[int] = None,
+) -> RawBreakpointFoci:
+    """
+    Finds the foci of `seq_region` with at least `min_supporting_reads` supporting reads
+    (by default, `detection_params.min_supporting_reads`), in a single pass over its reads.
+    See `find_breakpoint_foci` for `bam_fstream`.
+    """
+    if min_supporting_reads is None:
+        min_supporting_reads = detection_params.min_supporting_reads
+    breakpoint_types = detection_params.breakpoint_types
+    softclip_positions = {
+        breakpoint_type: SoftclipPositions() for breakpoint_type in breakpoint_types
+    }
     contig_name = seq_region.name
-    if seq_region.has_coordinates():
+    if isinstance(seq_region, Tile):
+        fetch_region = seq_region.to_fetch_interval()
+    else:
+        fetch_region = seq_region
+    if fetch_region.has_coordinates():
         fetch_args = dict(
-            contig=contig_name, start=seq_region.start, stop=seq_region.end
+            contig=contig_name, start=fetch_region.start, stop=fetch_region.end
         )
     else:
         fetch_args = dict(contig=contig_name)
-    bam_fstream = AlignmentFile(detection_params.bam_fname)
+    if bam_fstream is None:
+        bam_fstream = open_detection_alignment_file(detection_params)
+    min_softclip_length = min(
+        get_min_softclip_length(detection_params, breakpoint_type)
+        for breakpoint_type in breakpoint_types
+    )
+    # Softclipped reads are evaluated in batches, see `record_softclips`
+    read_batch = list()
+    # Read depth at breakpoint foci is computed from the same pass over the reads
+    read_coverage = ReadCoverage()
     for aligned_read in bam_fstream.fetch(**fetch_args):
-        if aligned_read.mapping_quality < detection_params.min_mapq:
+        if not read_passes_filters(aligned_read, detection_params):
             continue
-        if read_flag_matches(aligned_read, detection_params.read_filter_flag):
+        read_coverage.add(aligned_read)
+        if not has_softclip_of_min_length(aligned_read, min_softclip_length):
             continue
-        record_softclips(
-            aligned_read,
-            breakpoint_foci,
-            breakpoint_foci_positions,
-            detection_params,
-            seq_region,
+        read_batch.append(aligned_read)
+        if len(read_batch) == READ_BATCH_SIZE:
+            record_softclips(read_batch, softclip_positions, detection_params)
+            read_batch = list()
+    record_softclips(read_batch, softclip_positions, detection_params)
+    supported_foci = dict()
+    positions_to_commit = [np.zeros(0, dtype=np.int64)]
+    for breakpoint_type in breakpoint_types:
+        # Filter for minimum support, and for breakpoints owned by the tile if tiling
+        type_foci = softclip_positions[breakpoint_type].to_foci_table(
+            breakpoint_type, bam_fstream.references
         )
-    # Filter for minimum support
-    breakpoint_foci_positions = {
-        key: val
-        for key, val in breakpoint_foci_positions.items()
-        if focus_has_enough_support(val, detection_params.min_supporting_reads)
-    }
-    # Expand to a few positions before and after putative breakpoints: allows users to
-    # assess changes in coverage around breakpoints (using the corresponding output tsv)
-    positions_to_commit = set()
-    for match_key, focus_tent in breakpoint_foci_positions.items():
-        committed_position = focus_tent["start"]
-        positions_to_commit.update(
-            range(committed_position - 2, committed_position + 3)
+        type_foci = type_foci.filter(type_foci.has_support(min_supporting_reads))
+        if isinstance(seq_region, Tile):
+            type_foci = type_foci.filter(
+                np.fromiter(
+                    map(seq_region.owns, type_foci.starts.tolist()),
+                    dtype=bool,
+                    count=len(type_foci),
+                )
+            )
+        supported_foci[breakpoint_type] = FociTable(
+            breakpoint_type,
+            [contig_name],
+            {name: type_foci.columns[name] for name in ["start"] + READ_SUPPORTS},
         )
-    record_read_depth_at_breakpoint_foci(
-        positions_to_commit,
-        breakpoint_foci_positions,
-        contig_name,
-        breakpoint_foci,
+        positions_to_commit.append(get_positions_to_commit(type_foci))
+    all_positions_to_commit = np.unique(np.concatenate(positions_to_commit))
+    all_read_depths = get_read_depths(
+        all_positions_to_commit,
+        read_coverage,
+        fetch_region,
         bam_fstream,
         detection_params,
     )
-    return breakpoint_foci
+    return RawBreakpointFoci(
+        contig_name,
+        min_supporting_reads,
+        supported_foci,
+        all_positions_to_commit,
+        all_read_depths,
+    )
+
+
+def open_detection_alignment_file(
+    detection_params: BreakpointDetectionParams,
+) -> AlignmentFile:
+    return open_alignment_file(
+        detection_params.bam_fname,
+        detection_params.reference_fname,
+        detection_params.decode_threads,
+    )
+
+
+# Per-process state of pool workers, set once by `init_breakpoint_detection_worker`
+_worker_detection_params: List[BreakpointDetectionParams] = list()
+_worker_bam_fstreams: Dict[int, AlignmentFile] = dict()
+
+
+def init_breakpoint_detection_worker(
+    sample_detection_params: List[BreakpointDetectionParams],
+) -> None:
+    """
+    Pool initializer: each worker process receives the detection parameters of each
+    sample analysed, and opens the BAM of a sample (and loads its index) the first time
+    it analyses one of its tiles, reusing it for all later tiles of the sample.
+    CRAM references are read from the genome's cache of sequences, shared by all workers
+    (see `delfies.genome_utils.Genome.get_reference_fname`).
+    """
+    global _worker_detection_params, _worker_bam_fstreams
+    _worker_detection_params = list(sample_detection_params)
+    _worker_bam_fstreams = dict()
+
+
+def get_worker_bam_fstream(sample_idx: int) -> AlignmentFile:
+    if sample_idx not in _worker_bam_fstreams:
+        _worker_bam_fstreams[sample_idx] = open_detection_alignment_file(
+            _worker_detection_params[sample_idx]
+        )
+    return _worker_bam_fstreams[sample_idx]
+
+
+def find_breakpoint_foci_in_worker(
+    task: Tuple[int, int, Interval],
+) -> Tuple[int, int, Dict[BreakpointType, "TileClusters"]]:
+    """
+    A task is the analysis of a tile of a sample: (sample index, task index, tile).
+
+    Foci are streamed to shards in the sample's `detection_params.foci_shards_dirname`
+    as soon as a task is finished, rather than returned to the parent process.
+    Only the clustering of the foci with read support is returned (see `cluster_tile_foci`).
+
+    If `detection_params.softclip_cache_dirname` is set, the raw foci of the task
+    (see `RawBreakpointFoci`) are also cached there.
+    """
+    sample_idx, task_idx, seq_region = task
+    detection_params = _worker_detection_params[sample_idx]
+    bam_fstream = get_worker_bam_fstream(sample_idx)
+    softclip_cache_dirname = detection_params.softclip_cache_dirname
+    if softclip_cache_dirname is None:
+        breakpoint_foci = find_breakpoint_foci(
+            detection_params, seq_region, bam_fstream
+        )
+    else:
+        raw_foci = scan_breakpoint_foci(
+            detection_params,
+            seq_region,
+            bam_fstream,
+            min_supporting_reads=1,
+        )
+        raw_foci_fname = get_raw_foci_fname(softclip_cache_dirname, task_idx)
+        with NamedTemporaryFile(
+            dir=softclip_cache_dirname, suffix=".npz", delete=False
+        ) as ofstream:
+            raw_foci.save(ofstream.name)
+        os.replace(ofstream.name, raw_foci_fname)
+        breakpoint_foci = raw_foci.filter_by_support(
+            detection_params.min_supporting_reads
+        )
+    return (
+        sample_idx,
+        task_idx,
+        finish_tile(breakpoint_foci, seq_region, task_idx, detection_params),
+    )
+
+
+def finish_tile(
+    breakpoint_foci: BreakpointFoci,
+    seq_region: Interval,
+    task_idx: int,
+    detection_params: BreakpointDetectionParams,
+) -> Dict[BreakpointType, "TileClusters"]:
+    """
+    Writes the foci of a tile to shards, and clusters them
+    """
+    write_foci_shards(breakpoint_foci, detection_params.foci_shards_dirname, task_idx)
+    return {
+        breakpoint_type: cluster_tile_foci(
+            foci.filter(foci.has_support()),
+            seq_region,
+            detection_params.clustering_threshold,
+        )
+        for breakpoint_type, foci in breakpoint_foci.items()
+    }
+
+
+######################
+## Softclip caching ##
+######################
+SOFTCLIP_CACHE_COMPLETE_FNAME = "complete"
+
+
+def get_softclip_cache_dirname(
+    cache_dir: str, detection_params: BreakpointDetectionParams, tiles: Tiles
+) -> Path:
+    """
+    The raw foci of a run (see `RawBreakpointFoci`) only depend on the alignments,
+    on the parameters selecting reads and softclips (all those read by
+    `read_passes_filters` and `record_softclips`), and on the tiles analysed: runs
+    changing only later parameters (e.g. `min_supporting_reads`, `clustering_threshold`)
+    share a cache directory.
+    """
+    key_fields = [
+        get_alignment_file_identity(detection_params.bam_fname),
+        *(detection_params.telomere_seqs[orientation] for orientation in Orientation),
+        detection_params.telo_array_size,
+        detection_params.max_edit_distance,
+        detection_params.min_mapq,
+        detection_params.read_filter_flag,
+        detection_params.min_softclip_length,
+        # Keeps all G2S softclips, telomeric ones included (see
+        # `softclips_support_breakpoint`)
+        detection_params.keep_telomeric_breakpoints,
+    ]
+    for breakpoint_type in detection_params.breakpoint_types:
+        key_fields.append(breakpoint_type)
+        target_regions = detection_params.target_regions.get(breakpoint_type)
+        if target_regions is not None:
+            key_fields.extend(
+                interval.to_region_string()
+                for interval in target_regions.to_intervals()
+            )
+    key_fields.extend(
+        ID_DELIM.join(map(str, [tile.to_region_string(), tile.first, tile.last]))
+        for tile in tiles
+    )
+    cache_key = hashlib.sha256("\n".join(map(str, key_fields)).encode()).hexdigest()
+    return Path(cache_dir) / f"softclips{ID_DELIM}{cache_key}"
+
+
+def get_raw_foci_fname(softclip_cache_dirname: str, task_idx: int) -> Path:
+    return Path(softclip_cache_dirname) / f"{task_idx}.npz"
+
+
+def softclip_cache_is_complete(softclip_cache_dirname: Path) -> bool:
+    return (softclip_cache_dirname / SOFTCLIP_CACHE_COMPLETE_FNAME).exists()
+
+
+def mark_softclip_cache_complete(softclip_cache_dirname: Path) -> None:
+    (softclip_cache_dirname / SOFTCLIP_CACHE_COMPLETE_FNAME).touch()
+
+
+def find_breakpoint_foci_from_cache(
+    detection_params: BreakpointDetectionParams,
+    tiles: Tiles,
+    softclip_cache_dirname: Path,
+) -> List[Dict[BreakpointType, "TileClusters"]]:
+    """
+    Same as running `find_breakpoint_foci_in_worker` on each of `tiles`, from
+    their cached raw foci.
+    """
+    result = list()
+    for tile_idx, tile in enumerate(tiles):
+        raw_foci = RawBreakpointFoci.load(
+            get_raw_foci_fname(softclip_cache_dirname, tile_idx)
+        )
+        breakpoint_foci = raw_foci.filter_by_support(
+            detection_params.min_supporting_reads
+        )
+        result.append(finish_tile(breakpoint_foci, tile, tile_idx, detection_params))
+    return result
+
+
+def get_read_depths(
+    positions: np.ndarray,
+    read_coverage: ReadCoverage,
+    fetch_region: Interval,
+    bam_fstream: AlignmentFile,
+    detection_params: BreakpointDetectionParams,
+) -> np.ndarray:
+    """
+    Read depth at each of `positions`, with reads filtered as when finding foci.
+
+    `read_coverage` holds all the (filtered) reads overlapping `fetch_region`, so gives
+    the read depth at all positions inside it. Positions outside it (close to region
+    edges) are rare: the reads covering them are fetched separately.
+    """
+    if fetch_region.has_coordinates():
+        is_inside = (positions >= fetch_region.start) & (positions < fetch_region.end)
+    else:
+        is_inside = np.ones(len(positions), dtype=bool)
+    result = np.zeros(len(positions), dtype=np.int64)
+    result[is_inside] = read_coverage.get_read_depths(positions[is_inside])
+    contig_length = bam_fstream.get_reference_length(fetch_region.name)
+    for start, end in get_contiguous_ranges(positions[~is_inside].tolist()):
+        start, end = max(start, 0), min(end + 1, contig_length)
+        if start >= end:
+            continue
+        outside_read_coverage = ReadCoverage()
+        for aligned_read in bam_fstream.fetch(fetch_region.name, start, end):
+            if read_passes_filters(aligned_read, detection_params):
+                outside_read_coverage.add(aligned_read)
+        is_in_range = (positions >= start) & (positions < end)
+        result[is_in_range] = outside_read_coverage.get_read_depths(
+            positions[is_in_range]
+        )
+    return result
 
 
 def record_read_depth_at_breakpoint_foci(
-    positions_to_commit,
-    breakpoint_foci_positions,
-    contig_name,
-    breakpoint_foci,
-    bam_fstream,
-    detection_params,
-):
-    """
-    Adds read depth at each position in positions_to_commit,
-    using pysam 'pileup'.
+    positions_to_commit: np.ndarray,
+    supported_foci: FociTable,
+    contig_name: str,
+    read_depths: np.ndarray,
+) -> FociTable:
+    """
+    Records the read depth at each position in positions_to_commit (sorted), taken from
+    `read_depths`, along with the read support of `supported_foci` at these positions.
+    As in a pileup, positions covered by no reads are not recorded.
     Special cases:
-        - When a breakpoint occurs at first position of a contig, 'pileup' will not
-          record any read depth as the breakpoint position is set to -1.
-          So we manually commit that position to :breakpoint_foci: to ensure it is output.
+        - When a breakpoint occurs at first position of a contig, the breakpoint
+          position is set to -1, which has no read depth.
+          So we manually commit that position to ensure it is output.
         - [TODO] When a breakpoint occurs at last position of a contig
     """
-    for start, end in get_contiguous_ranges(positions_to_commit):
-        if start < 0:
-            negative_tent_key = f"{contig_name}{ID_DELIM}-1"
-            if negative_tent_key in breakpoint_foci_positions:
-                breakpoint_foci.add(breakpoint_foci_positions[negative_tent_key])
-        # +1 for `end` because `end` needs to be exclusive in pysam `pileup`
-        pileup_args = dict(
-            contig=contig_name,
-            start=max(start, 0),
-            end=max(end + 1, 0),
-            flag_filter=detection_params.read_filter_flag,
-            min_mapping_quality=detection_params.min_mapq,
-            ignore_orphans=False,
-            truncate=True,
+    focus_idx = np.searchsorted(supported_foci.starts, positions_to_commit)
+    is_focus = focus_idx < len(supported_foci)
+    is_focus[is_focus] = (
+        supported_foci.starts[focus_idx[is_focus]] == positions_to_commit[is_focus]
+    )
+    is_committed = (read_depths > 0) | (is_focus & (positions_to_commit < 0))
+    columns = {
+        "contig_id": np.zeros(is_committed.sum(), dtype=np.int32),
+        "start": positions_to_commit[is_committed],
+        "read_depth": read_depths[is_committed],
+    }
+    for read_support in READ_SUPPORTS:
+        read_support_column = np.zeros(len(positions_to_commit), dtype=np.uint32)
+        read_support_column[is_focus] = supported_foci.columns[read_support][
+            focus_idx[is_focus]
+        ]
+        columns[read_support] = read_support_column[is_committed]
+    return FociTable(supported_foci.breakpoint_type, [contig_name], columns)
+
+
+###################
+## Foci sharding ##
+###################
+def get_foci_shard_fname(
+    shards_dirname: str, breakpoint_type: BreakpointType, task_idx: int
+) -> Path:
+    return Path(shards_dirname) / f"{breakpoint_type}{ID_DELIM}{task_idx}.npz"
+
+
+def write_foci_shards(
+    breakpoint_foci: BreakpointFoci, shards_dirname: str, task_idx: int
+) -> None:
+    """
+    Writes the foci of each breakpoint type to its own (binary) shard
+    """
+    for breakpoint_type, foci in breakpoint_foci.items():
+        foci.save(get_foci_shard_fname(shards_dirname, breakpoint_type, task_idx))
+
+
+def iter_merged_foci_shards(
+    tiles: Tiles, shard_fnames: List[str]
+) -> Iterator[FociTable]:
+    """
+    Merges the foci shards of `tiles` (which must be sorted by region) one tile at a
+    time, yielding the foci of each tile sorted by position, with a single focus per
+    position.
+
+    Each breakpoint focus is found in a single tile, but read depth around a focus (up
+    to `FOCUS_FLANK_SIZE` positions away) can be recorded by the adjacent tile too.
+    The foci close to the end of a tile are held back and merged with those of the
+    next tile of the region, so that the foci of at most two tiles are held at once.
+    """
+    held_back_foci = None
+    for tile_idx, (tile, shard_fname) in enumerate(zip(tiles, shard_fnames)):
+        tile_foci = FociTable.load(shard_fname)
+        if held_back_foci is not None:
+            tile_foci = FociTable.concatenate([held_back_foci, tile_foci])
+        tile_foci = tile_foci.deduplicate_positions()
+        is_last_region_tile = (
+            tile_idx + 1 == len(tiles)
+            or tiles[tile_idx + 1].region_idx != tile.region_idx
         )
-        for pileup_column in bam_fstream.pileup(**pileup_args):
-            read_depth = pileup_column.nsegments
-            ref_pos = pileup_column.reference_pos
-            tent_key = f"{contig_name}{ID_DELIM}{ref_pos}"
-            if tent_key in breakpoint_foci_positions:
-                breakpoint_foci_positions[tent_key]["read_depth"] = read_depth
-                breakpoint_foci.add(breakpoint_foci_positions[tent_key])
-            else:
-                new_tent = breakpoint_foci.new()
-                new_tent.update(
-                    contig=contig_name,
-                    start=ref_pos,
-                    end=ref_pos + 1,
-                    read_depth=read_depth,
+        if is_last_region_tile:
+            held_back_foci = None
+            yield tile_foci
+        else:
+            is_held_back = tile_foci.starts >= tile.end - FOCUS_FLANK_SIZE
+            held_back_foci = tile_foci.filter(is_held_back)
+            yield tile_foci.filter(~is_held_back)
+
+
+def merge_foci_shards(
+    tiles: Tiles,
+    shard_fnames: List[str],
+    ofstream: TextIO,
+    stitching_regions: Intervals = (),
+) -> FociTable:
+    """
+    Merges the foci shards of `tiles` into `ofstream` (see `iter_merged_foci_shards`),
+    and returns the foci with read support inside `stitching_regions`: the only ones
+    stitching tile clusters needs (see `get_stitching_regions`), so that the foci of
+    the whole genome are never held at once.
+    """
+    return merge_sample_foci_shards(
+        tiles, [shard_fnames], [ofstream], sample_stitching_regions=[stitching_regions]
+    )[0]
+
+
+def merge_sample_foci_shards(
+    tiles: Tiles,
+    sample_shard_fnames: List[List[str]],
+    sample_ofstreams: List[TextIO],
+    sample_names: Optional[List[str]] = None,
+    joint_ofstream: Optional[TextIO] = None,
+    sample_stitching_regions: Optional[List[Intervals]] = None,
+) -> List[FociTable]:
+    """
+    `merge_foci_shards` for several samples sharing `tiles`. If `joint_ofstream` is
+    provided, the foci of all samples are also merged into it, one tile at a time
+    (see `FociTable.write_joint_tsv`).
+    """
+    if sample_stitching_regions is None:
+        sample_stitching_regions = [list() for _ in sample_shard_fnames]
+    for ofstream in sample_ofstreams:
+        FociTable.write_tsv_header(ofstream)
+    if joint_ofstream is not None:
+        FociTable.write_joint_tsv_header(sample_names, joint_ofstream)
+    sample_supported_foci = [list() for _ in sample_shard_fnames]
+    # Samples sharing tiles have the same foci held back at each tile's end, so their
+    # merged foci cover the same positions, tile by tile
+    for sample_tile_foci in zip(
+        *(
+            iter_merged_foci_shards(tiles, shard_fnames)
+            for shard_fnames in sample_shard_fnames
+        )
+    ):
+        for tile_foci, ofstream, stitching_regions, supported_foci in zip(
+            sample_tile_foci,
+            sample_ofstreams,
+            sample_stitching_regions,
+            sample_supported_foci,
+        ):
+            tile_foci.write_tsv(ofstream)
+            if len(stitching_regions) > 0:
+                supported_foci.append(
+                    get_foci_in_regions(
+                        tile_foci.filter(tile_foci.has_support()), stitching_regions
+                    )
                 )
-                breakpoint_foci.add(new_tent)
+        if joint_ofstream is not None:
+            FociTable.write_joint_tsv(list(sample_tile_foci), joint_ofstream)
+    return list(map(FociTable.concatenate, sample_supported_foci))
+
+
+def get_foci_in_regions(foci: FociTable, seq_regions: Intervals) -> FociTable:
+    is_inside = np.zeros(len(foci), dtype=bool)
+    for seq_region in seq_regions:
+        if seq_region.name not in foci.contigs:
+            continue
+        is_inside |= (
+            (foci.contig_ids == foci.contigs.index(seq_region.name))
+            & (foci.starts >= seq_region.start)
+            & (foci.starts < seq_region.end)
+        )
+    return foci.filter(is_inside)
 
 
 #####################
 ## Foci clustering ##
 #####################
 class FociWindow:
-    def __init__(self, focus):
+    def __init__(self, focus: BreakpointFocus):
         self.foci = [focus]
-        self.Min = int(focus.start)
-        self.Max = int(focus.end)
+        self.Min = focus.start
+        self.Max = focus.end
 
-    def includes(self, focus: Tent, tolerance: int):
-        focus_start_past_end = int(focus.start) > self.Max + tolerance
-        focus_end_before_start = int(focus.end) < self.Min - tolerance
+    def includes(self, focus: BreakpointFocus, tolerance: int):
+        focus_start_past_end = focus.start > self.Max + tolerance
+        focus_end_before_start = focus.end < self.Min - tolerance
         return not focus_start_past_end and not focus_end_before_start
 
-    def add(self, focus):
+    def add(self, focus: BreakpointFocus):
         self.foci.append(focus)
-        start = int(focus.start)
-        end = int(focus.end)
-        if end > self.Max:
-            self.Max = end
-        if start < self.Min:
-            self.Min = start
+        if focus.end > self.Max:
+            self.Max = focus.end
+        if focus.start < self.Min:
+            self.Min = focus.start
 
     def find_peak_softclip_focus(self) -> PutativeBreakpoint:
         forward_maximum = PutativeBreakpoint(
@@ -254,23 +856,173 @@ class FociWindow:
         return f"[{self.Min},{self.Max}]"
 
 
-def cluster_breakpoint_foci(foci: Tents, tolerance: int) -> List[FociWindow]:
+def cluster_breakpoint_foci(
+    foci: Iterable[BreakpointFocus], tolerance: int
+) -> List[FociWindow]:
     """
+    Foci are sorted by position and swept once per contig: each focus joins the current
+    window if it is within `tolerance` of it, and opens a new window otherwise.
+    Foci bridging two windows thus merge them into one.
+
     Developer note:
         foci without any softclipped-reads are ignored for the purpose of clustering,
         as they are only present in the output tsv to assess coverage changes near breakpoints.
     """
-    result: Dict[str, List[FociWindow]] = defaultdict(list)
+    contig_foci: Dict[str, List[BreakpointFocus]] = defaultdict(list)
     for focus in foci:
-        if not focus_has_enough_support(focus, 1):
-            continue
-        contig_windows = result[focus.contig]
-        found_window = False
-        for elem in contig_windows:
-            if elem.includes(focus, tolerance=tolerance):
-                elem.add(focus)
-                found_window = True
-                break
-        if not found_window:
-            contig_windows.append(FociWindow(focus))
-    return list(it_chain(*result.values()))
+        if focus_has_enough_support(focus, 1):
+            contig_foci[focus.contig].append(focus)
+    result = list()
+    for foci_to_cluster in contig_foci.values():
+        foci_to_cluster.sort(key=attrgetter("start"))
+        current_window = None
+        for focus in foci_to_cluster:
+            if current_window is not None and current_window.includes(
+                focus, tolerance=tolerance
+            ):
+                current_window.add(focus)
+            else:
+                current_window = FociWindow(focus)
+                result.append(current_window)
+    return result
+
+
+@dataclass
+class TileClusters:
+    """
+    The clustering of the foci found in a single tile.
+    Windows lying more than the clustering tolerance away from the tile's edges cannot
+    include foci found in other tiles, so are resolved into `putative_breakpoints`.
+    The foci of the other windows (`edge_foci`) are clustered across tiles.
+    """
+
+    putative_breakpoints: PutativeBreakpoints
+    edge_foci: List[BreakpointFocus]
+
+
+def call_breakpoints_from_foci(
+    foci: FociTable, min_supporting_reads: int, clustering_threshold: int
+) -> PutativeBreakpoints:
+    """
+    The putative breakpoints that detection with `min_supporting_reads` and
+    `clustering_threshold` would give, from all the foci of a breakpoint type (e.g.
+    loaded from a foci tsv), in the same order.
+    """
+    windows = cluster_breakpoint_foci(
+        foci.filter(foci.has_support(min_supporting_reads)), clustering_threshold
+    )
+    result = sorted(
+        (window.find_peak_softclip_focus() for window in windows),
+        key=attrgetter("max_value"),
+        reverse=True,
+    )
+    for putative_breakpoint in result:
+        putative_breakpoint.breakpoint_type = foci.breakpoint_type
+    return result
+
+
+def cluster_tile_foci(
+    foci: Iterable[BreakpointFocus], tile: Interval, tolerance: int
+) -> TileClusters:
+    result = TileClusters(list(), list())
+    for window in cluster_breakpoint_foci(foci, tolerance):
+        is_inside_tile = (
+            tile.has_coordinates()
+            and window.Min - tolerance > tile.start
+            and window.Max + tolerance < tile.end
+        )
+        if is_inside_tile:
+            result.putative_breakpoints.append(window.find_peak_softclip_focus())
+        else:
+            result.edge_foci.extend(window.foci)
+    return result
+
+
+def group_tile_clusters(
+    tile_clusters: Iterable[TileClusters], tolerance: int
+) -> Dict[str, list]:
+    """
+    Sweeps the windows resolved in tiles and the edge foci of `tile_clusters` once per
+    contig, as in `cluster_breakpoint_foci`: groups are [start, end, items] of items
+    lying within `tolerance` of each other.
+    """
+    contig_items: Dict[str, list] = defaultdict(list)
+    for clusters in tile_clusters:
+        for putative_breakpoint in clusters.putative_breakpoints:
+            contig_items[putative_breakpoint.focus.contig].append(
+                (*putative_breakpoint.interval, putative_breakpoint)
+            )
+        for focus in clusters.edge_foci:
+            contig_items[focus.contig].append((focus.start, focus.end, focus))
+    result = dict()
+    for contig, items in contig_items.items():
+        items.sort(key=itemgetter(0))
+        groups = list()
+        for item in items:
+            if len(groups) > 0 and item[0] <= groups[-1][1] + tolerance:
+                groups[-1][1] = max(groups[-1][1], item[1])
+                groups[-1][2].append(item[2])
+            else:
+                groups.append([item[0], item[1], [item[2]]])
+        result[contig] = groups
+    return result
+
+
+def group_needs_reclustering(group_items: list) -> bool:
+    num_resolved = sum(isinstance(item, PutativeBreakpoint) for item in group_items)
+    return num_resolved > 0 and len(group_items) > 1
+
+
+def get_stitching_regions(
+    tile_clusters: Iterable[TileClusters], tolerance: int
+) -> Intervals:
+    """
+    The regions whose foci with read support `stitch_tile_clusters` needs: those
+    of the (rare) windows resolved in a tile but close to foci of other tiles.
+    """
+    return [
+        Interval(contig, group_start, group_end)
+        for contig, groups in group_tile_clusters(tile_clusters, tolerance).items()
+        for group_start, group_end, group_items in groups
+        if group_needs_reclustering(group_items)
+    ]
+
+
+def stitch_tile_clusters(
+    tile_clusters: Iterable[TileClusters],
+    supported_foci: FociTable,
+    tolerance: int,
+) -> PutativeBreakpoints:
+    """
+    Combines the clusterings of all tiles (in tile order) into the putative breakpoints
+    that clustering all foci at once would give, in the same order.
+
+    Windows resolved in tiles and edge foci are grouped (see `group_tile_clusters`).
+    A window resolved in a tile is kept as is if nothing else is within `tolerance` of
+    it; edge foci are clustered together. Windows resolved in a tile but close to foci
+    of other tiles (e.g. when regions overlap) are rare: their foci are taken back from
+    `supported_foci`, which only needs to hold the foci inside the regions given by
+    `get_stitching_regions`, and clustered again.
+    """
+    result = list()
+    for contig, groups in group_tile_clusters(tile_clusters, tolerance).items():
+        for group_start, group_end, group_items in groups:
+            if group_needs_reclustering(group_items):
+                contig_id = supported_foci.contigs.index(contig)
+                foci_to_cluster = supported_foci.filter(
+                    (supported_foci.contig_ids == contig_id)
+                    & (supported_foci.starts >= group_start)
+                    & (supported_foci.starts < group_end)
+                )
+            elif len(group_items) == 1 and isinstance(
+                group_items[0], PutativeBreakpoint
+            ):
+                result.append(group_items[0])
+                continue
+            else:
+                foci_to_cluster = group_items
+            result.extend(
+                window.find_peak_softclip_focus()
+                for window in cluster_breakpoint_foci(foci_to_cluster, tolerance)
+            )
+    return result
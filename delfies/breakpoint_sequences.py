@@ -1,46 +1,109 @@
-from typing import List
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator, List
 
-from pyfastx import Fasta
+from pysam import faidx as pysam_faidx
+from pysam.libcbgzf import BGZFile
 
-from delfies import Orientation, PutativeBreakpoints
-from delfies.breakpoint_foci import READ_SUPPORT_PREFIX
-from delfies.seq_utils import FastaRecord, rev_comp
+from delfies import READ_SUPPORT_PREFIX, Orientation, PutativeBreakpoints
+from delfies.genome_utils import Genome
+from delfies.seq_kernels import batch_rev_comp
+from delfies.seq_utils import FastaRecord
+
+SEQUENCE_BATCH_SIZE = 10_000
 
 
 def extract_breakpoint_sequences(
-    maximal_foci: PutativeBreakpoints, genome: Fasta, seq_window_size: int
+    maximal_foci: PutativeBreakpoints,
+    genome: Genome,
+    seq_window_size: int,
+    unique_ids: bool = False,
+) -> Iterator[FastaRecord]:
+    """
+    Yields the sequences of `maximal_foci`, in order. Sequences are extracted in
+    batches of `SEQUENCE_BATCH_SIZE` breakpoints, so that only one batch of sequences
+    is held in memory at once.
+
+    `unique_ids`: whether to add the breakpoint position to sequence IDs, so that
+    each sequence can be accessed by ID (e.g. through a faidx index)
+    """
+    for batch_start in range(0, len(maximal_foci), SEQUENCE_BATCH_SIZE):
+        yield from extract_breakpoint_sequence_batch(
+            maximal_foci[batch_start : batch_start + SEQUENCE_BATCH_SIZE],
+            genome,
+            seq_window_size,
+            unique_ids,
+        )
+
+
+def extract_breakpoint_sequence_batch(
+    maximal_foci: PutativeBreakpoints,
+    genome: Genome,
+    seq_window_size: int,
+    unique_ids: bool,
 ) -> List[FastaRecord]:
-    result = list()
-    for max_focus in maximal_foci:
-        focus = max_focus.focus
-        breakpoint_pos = max(int(focus.start), 0)
-        windowed_start = max(breakpoint_pos - seq_window_size + 1, 0)
-        windowed_end = breakpoint_pos + seq_window_size
-        breakpoint_sequence = (
-            genome.fetch(focus.contig, (windowed_start, breakpoint_pos))
-            + "N"
-            + genome.fetch(focus.contig, (breakpoint_pos + 1, windowed_end))
+    """
+    Sequences are extracted one contig at a time, in order of position, and returned
+    in the order of `maximal_foci`.
+    """
+    result = [None] * len(maximal_foci)
+    contig_breakpoints = defaultdict(list)
+    for breakpoint_idx, max_focus in enumerate(maximal_foci):
+        breakpoint_pos = max(max_focus.focus.start, 0)
+        contig_breakpoints[max_focus.focus.contig].append(
+            (breakpoint_pos, breakpoint_idx)
         )
-        strand_name = "3prime"
-        if max_focus.orientation is Orientation.reverse:
-            breakpoint_sequence = rev_comp(breakpoint_sequence)
-            strand_name = "5prime"
-        breakpoint_name = f"{max_focus.breakpoint_type}_{strand_name}_{focus.contig} breakpoint_pos:{breakpoint_pos} {READ_SUPPORT_PREFIX}:{max_focus.max_value} next_best_value_on_same_strand:{max_focus.next_max_value} best_value_on_other_strand:{max_focus.max_value_other_orientation}"
-        result.append(FastaRecord(breakpoint_name, breakpoint_sequence))
+    for contig, breakpoints in contig_breakpoints.items():
+        for breakpoint_pos, breakpoint_idx in sorted(breakpoints):
+            max_focus = maximal_foci[breakpoint_idx]
+            breakpoint_sequence = (
+                genome.fetch(contig, breakpoint_pos - seq_window_size, breakpoint_pos)
+                + "N"
+                + genome.fetch(contig, breakpoint_pos, breakpoint_pos + seq_window_size)
+            )
+            strand_name = "3prime"
+            if max_focus.orientation is Orientation.reverse:
+                strand_name = "5prime"
+            breakpoint_id = f"{max_focus.breakpoint_type}_{strand_name}_{contig}"
+            if unique_ids:
+                breakpoint_id += f"_{breakpoint_pos}"
+            breakpoint_name = f"{breakpoint_id} breakpoint_pos:{breakpoint_pos} {READ_SUPPORT_PREFIX}:{max_focus.max_value} next_best_value_on_same_strand:{max_focus.next_max_value} best_value_on_other_strand:{max_focus.max_value_other_orientation}"
+            result[breakpoint_idx] = FastaRecord(breakpoint_name, breakpoint_sequence)
+    reverse_records = [
+        record
+        for record, max_focus in zip(result, maximal_foci)
+        if max_focus.orientation is Orientation.reverse
+    ]
+    reverse_sequences = batch_rev_comp([record.sequence for record in reverse_records])
+    for record, sequence in zip(reverse_records, reverse_sequences):
+        record.sequence = sequence
     return result
 
 
 def write_breakpoint_sequences(
-    genome_fname: str,
+    genome: Genome,
     maximal_foci: PutativeBreakpoints,
-    odirname: str,
+    odirname: Path,
     seq_window_size: int,
+    bgzip: bool = False,
 ) -> None:
-    genome = Fasta(genome_fname)
+    """
+    Sequences are written as they are extracted (see `extract_breakpoint_sequences`).
+
+    `bgzip`: write the sequences bgzipped, and index them (faidx). Sequence IDs then
+    include breakpoint positions, as indexed sequences need unique IDs.
+    """
     breakpoint_sequences = extract_breakpoint_sequences(
-        maximal_foci, genome, seq_window_size
+        maximal_foci, genome, seq_window_size, unique_ids=bgzip
     )
     breakpoint_fasta = odirname / "breakpoint_sequences.fasta"
-    with breakpoint_fasta.open("w") as ofstream:
-        for breakpoint_sequence in breakpoint_sequences:
-            ofstream.write(str(breakpoint_sequence))
+    if bgzip:
+        breakpoint_fasta = breakpoint_fasta.with_suffix(".fasta.gz")
+        with BGZFile(str(breakpoint_fasta), "wb") as ofstream:
+            for breakpoint_sequence in breakpoint_sequences:
+                ofstream.write(str(breakpoint_sequence).encode("ascii"))
+        pysam_faidx(str(breakpoint_fasta))
+    else:
+        with breakpoint_fasta.open("w") as ofstream:
+            for breakpoint_sequence in breakpoint_sequences:
+                ofstream.write(str(breakpoint_sequence))
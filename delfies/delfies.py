@@ -1,7 +1,12 @@
-import itertools as it
 import multiprocessing as mp
+from contextlib import ExitStack
+from dataclasses import replace
+from itertools import product
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Optional
 
+import numpy as np
 import rich_click as click
 from pybedtools import BedTool
 from pysam import AlignmentFile
@@ -17,25 +22,80 @@ from delfies import (
 )
 from delfies.breakpoint_foci import (
     BreakpointDetectionParams,
-    cluster_breakpoint_foci,
-    find_breakpoint_foci,
-    setup_breakpoint_tents,
+    call_breakpoints_from_foci,
+    filter_foci_by_support,
+    find_breakpoint_foci_from_cache,
+    find_breakpoint_foci_in_worker,
+    get_foci_shard_fname,
+    get_softclip_cache_dirname,
+    get_stitching_regions,
+    init_breakpoint_detection_worker,
+    mark_softclip_cache_complete,
+    merge_sample_foci_shards,
+    softclip_cache_is_complete,
+    stitch_tile_clusters,
 )
 from delfies.breakpoint_sequences import write_breakpoint_sequences
-from delfies.interval_utils import Interval, Intervals
+from delfies.foci_table import FociTable
+from delfies.genome_utils import Genome, open_genome
+from delfies.interval_utils import (
+    Interval,
+    IntervalLookup,
+    Intervals,
+    Tiles,
+    extend_to_overlapping,
+    merge_intervals,
+    tile_intervals,
+)
+from delfies.parallel_utils import (
+    ParallelismPlan,
+    estimate_tile_loads,
+    get_mapped_read_counts,
+    get_num_cores,
+    plan_parallelism_from_loads,
+)
 from delfies.SAM_utils import (
     DEFAULT_MIN_MAPQ,
     DEFAULT_READ_FILTER_FLAG,
     DEFAULT_READ_FILTER_NAMES,
 )
-from delfies.seq_utils import find_all_occurrences_in_genome, rev_comp
-from delfies.telomere_utils import TELOMERE_SEQS, remove_breakpoints_in_telomere_arrays
+from delfies.seq_utils import GenomeOccurrences, rev_comp
+from delfies.telomere_utils import (
+    TELOMERE_SEQS,
+    TelomereMatcher,
+    remove_breakpoints_in_telomere_arrays,
+)
+
+DEFAULT_TILE_SIZE = 1_000_000
+AUTO_THREADS = "auto"
+
+
+class ThreadsParamType(click.ParamType):
+    name = f"INTEGER|{AUTO_THREADS}"
+
+    def convert(self, value, param, ctx):
+        if value == AUTO_THREADS or isinstance(value, int):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            self.fail(
+                f"{value!r} is neither an integer nor '{AUTO_THREADS}'", param, ctx
+            )
+
 
 click.rich_click.OPTION_GROUPS = {
-    "delfies": [
+    "delfies detect": [
         {
             "name": "Generic",
-            "options": ["--help", "--version", "--threads"],
+            "options": [
+                "--help",
+                "--version",
+                "--threads",
+                "--decode_threads",
+                "--cache_dir",
+                "--genome_index_dir",
+            ],
         },
         {
             "name": "Region selection",
@@ -48,52 +108,334 @@ click.rich_click.OPTION_GROUPS = {
                 "--telo_forward_seq",
                 "--telo_array_size",
                 "--telo_max_edit_distance",
+                "--min_softclip_length",
                 "--min_mapq",
                 "--read_filter_flag",
                 "--keep_telomeric_breakpoints",
+                "--approximate_genome_search",
             ],
         },
         {
             "name": "Output breakpoints",
             "options": [
                 "--seq_window_size",
+                "--bgzip_sequences",
                 "--min_supporting_reads",
                 "--clustering_threshold",
             ],
         },
-    ]
+    ],
+    "delfies recluster": [
+        {
+            "name": "Generic",
+            "options": [
+                "--help",
+                "--threads",
+                "--cache_dir",
+                "--genome_index_dir",
+            ],
+        },
+        {
+            "name": "Telomere-array filtering",
+            "options": [
+                "--telo_forward_seq",
+                "--telo_array_size",
+                "--telo_max_edit_distance",
+                "--keep_telomeric_breakpoints",
+                "--approximate_genome_search",
+            ],
+        },
+        {
+            "name": "Output breakpoints",
+            "options": [
+                "--seq_window_size",
+                "--bgzip_sequences",
+                "--min_supporting_reads",
+                "--clustering_threshold",
+            ],
+        },
+    ],
 }
 
 
+def get_detection_tiles(
+    seq_regions: Intervals, tile_size: int, contig_lengths: Dict[str, int]
+) -> Tiles:
+    # Overlapping regions would fetch the same reads, and record their softclips, twice
+    return tile_intervals(merge_intervals(seq_regions), tile_size, contig_lengths)
+
+
+def get_contig_lengths(bam_fname: str) -> Dict[str, int]:
+    with AlignmentFile(bam_fname) as bam_fstream:
+        return dict(zip(bam_fstream.references, bam_fstream.lengths))
+
+
+def plan_breakpoint_detection(
+    bam_fnames: List[str],
+    seq_regions: Intervals,
+    num_cores: int,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> ParallelismPlan:
+    """
+    Plans the analysis of the tiles of all the BAMs in `bam_fnames` (aligned to the
+    same genome), run in a single pool
+    """
+    contig_lengths = get_contig_lengths(bam_fnames[0])
+    tiles = get_detection_tiles(seq_regions, tile_size, contig_lengths)
+    sample_read_counts = list(map(get_mapped_read_counts, bam_fnames))
+    # Tile loads are only comparable across BAMs if all are estimated from read counts
+    if any(len(read_counts) == 0 for read_counts in sample_read_counts):
+        sample_read_counts = [dict() for _ in bam_fnames]
+    tile_loads = [
+        estimate_tile_loads(tiles, contig_lengths, read_counts)
+        for read_counts in sample_read_counts
+    ]
+    return plan_parallelism_from_loads(
+        np.concatenate(tile_loads),
+        num_cores,
+        load_unit="reads" if len(sample_read_counts[0]) > 0 else "bp",
+    )
+
+
 def run_breakpoint_detection(
-    detection_params: BreakpointDetectionParams, seq_regions: Intervals, threads
-) -> PutativeBreakpoints:
-    with mp.Pool(processes=threads) as pool:
-        pooled_results = pool.starmap(
-            find_breakpoint_foci,
-            zip(
-                it.repeat(detection_params),
-                seq_regions,
-            ),
-        )
-    all_foci = setup_breakpoint_tents()
-    for result in pooled_results:
-        all_foci.extend(result)
-    foci_tsv = f"{detection_params.ofname_base}.tsv"
-    with open(foci_tsv, "w") as ofstream:
-        print(all_foci, file=ofstream)
-    clustered_foci = cluster_breakpoint_foci(
-        all_foci, tolerance=detection_params.clustering_threshold
+    sample_detection_params: List[BreakpointDetectionParams],
+    seq_regions: Intervals,
+    threads: int,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    cache_dir: Optional[str] = None,
+    sample_names: Optional[List[str]] = None,
+    joint_ofname_base: Optional[Path] = None,
+) -> List[Dict[BreakpointType, PutativeBreakpoints]]:
+    """
+    Detects the putative breakpoints of each sample (one BAM, aligned to the same
+    genome, and `detection_params` per sample), analysing the tiles of all samples
+    in a single pool.
+
+    `cache_dir`: if provided, the raw softclip counts of each sample are cached in it, and
+    reused by later runs that only change parameters applied after reading the BAM
+    (see `get_softclip_cache_dirname`)
+
+    `joint_ofname_base`: if provided, the foci of all samples (named `sample_names`)
+    are also written to joint foci tsvs (see `FociTable.write_joint_tsv`)
+    """
+    # Samples are aligned to the same genome, so share their tiles
+    tiles = get_detection_tiles(
+        seq_regions, tile_size, get_contig_lengths(sample_detection_params[0].bam_fname)
     )
-    putative_breakpoints = map(
-        lambda cluster: cluster.find_peak_softclip_focus(), clustered_foci
+    tile_clusters = [[None] * len(tiles) for _ in sample_detection_params]
+    softclip_cache_dirnames = dict()
+    tasks = list()
+    with ExitStack() as foci_shards_dirnames:
+        for sample_idx, detection_params in enumerate(sample_detection_params):
+            detection_params.foci_shards_dirname = foci_shards_dirnames.enter_context(
+                TemporaryDirectory(
+                    dir=Path(detection_params.ofname_base).parent,
+                    prefix="breakpoint_foci_shards_",
+                )
+            )
+            if cache_dir is not None:
+                softclip_cache_dirname = get_softclip_cache_dirname(
+                    cache_dir, detection_params, tiles
+                )
+                if softclip_cache_is_complete(softclip_cache_dirname):
+                    tile_clusters[sample_idx] = find_breakpoint_foci_from_cache(
+                        detection_params, tiles, softclip_cache_dirname
+                    )
+                    continue
+                softclip_cache_dirname.mkdir(parents=True, exist_ok=True)
+                detection_params.softclip_cache_dirname = str(softclip_cache_dirname)
+                softclip_cache_dirnames[sample_idx] = softclip_cache_dirname
+            tasks.extend(
+                (sample_idx, tile_idx, tile) for tile_idx, tile in enumerate(tiles)
+            )
+        if len(tasks) > 0:
+            # Largest tiles, across all samples, are dispatched first, so that they
+            # do not end up as the long pole
+            tasks.sort(key=lambda task: len(task[2]), reverse=True)
+            # Foci are clustered inside workers: only windows close to tile edges
+            # are left for the parent process to stitch together
+            with mp.Pool(
+                processes=threads,
+                initializer=init_breakpoint_detection_worker,
+                initargs=(sample_detection_params,),
+            ) as pool:
+                for sample_idx, tile_idx, clusters in pool.imap_unordered(
+                    find_breakpoint_foci_in_worker, tasks
+                ):
+                    tile_clusters[sample_idx][tile_idx] = clusters
+        for sample_idx, softclip_cache_dirname in softclip_cache_dirnames.items():
+            mark_softclip_cache_complete(softclip_cache_dirname)
+            sample_detection_params[sample_idx].softclip_cache_dirname = None
+        result = [dict() for _ in sample_detection_params]
+        for breakpoint_type in sample_detection_params[0].breakpoint_types:
+            sample_type_clusters = [
+                [clusters[breakpoint_type] for clusters in sample_tile_clusters]
+                for sample_tile_clusters in tile_clusters
+            ]
+            # Only the foci that stitching needs are kept while merging shards
+            sample_stitching_regions = [
+                get_stitching_regions(
+                    type_clusters, detection_params.clustering_threshold
+                )
+                for type_clusters, detection_params in zip(
+                    sample_type_clusters, sample_detection_params
+                )
+            ]
+            sample_supported_foci = write_foci_tsvs(
+                sample_detection_params,
+                tiles,
+                breakpoint_type,
+                sample_stitching_regions,
+                sample_names,
+                joint_ofname_base,
+            )
+            for detection_params, type_clusters, supported_foci, sample_result in zip(
+                sample_detection_params,
+                sample_type_clusters,
+                sample_supported_foci,
+                result,
+            ):
+                putative_breakpoints = stitch_tile_clusters(
+                    type_clusters,
+                    supported_foci,
+                    tolerance=detection_params.clustering_threshold,
+                )
+                putative_breakpoints = sorted(
+                    putative_breakpoints, key=lambda e: e.max_value, reverse=True
+                )
+                for m_f in putative_breakpoints:
+                    m_f.breakpoint_type = breakpoint_type
+                sample_result[breakpoint_type] = putative_breakpoints
+    for detection_params in sample_detection_params:
+        detection_params.foci_shards_dirname = None
+    return result
+
+
+def write_foci_tsvs(
+    sample_detection_params: List[BreakpointDetectionParams],
+    tiles: Tiles,
+    breakpoint_type: BreakpointType,
+    sample_stitching_regions: List[Intervals],
+    sample_names: Optional[List[str]] = None,
+    joint_ofname_base: Optional[Path] = None,
+) -> List[FociTable]:
+    """
+    Merges the foci shards of `breakpoint_type` of each sample into its foci tsv, and
+    into the joint foci tsv if `joint_ofname_base` is provided. Returns the foci with
+    read support of each sample inside its stitching regions (see
+    `merge_sample_foci_shards`).
+    """
+    with ExitStack() as ofstreams:
+        sample_ofstreams = [
+            ofstreams.enter_context(
+                open(
+                    f"{detection_params.ofname_base}{ID_DELIM}{breakpoint_type}.tsv",
+                    "w",
+                )
+            )
+            for detection_params in sample_detection_params
+        ]
+        joint_ofstream = None
+        if joint_ofname_base is not None:
+            joint_ofstream = ofstreams.enter_context(
+                open(f"{joint_ofname_base}{ID_DELIM}{breakpoint_type}.tsv", "w")
+            )
+        return merge_sample_foci_shards(
+            tiles,
+            [
+                [
+                    get_foci_shard_fname(
+                        detection_params.foci_shards_dirname, breakpoint_type, tile_idx
+                    )
+                    for tile_idx in range(len(tiles))
+                ]
+                for detection_params in sample_detection_params
+            ],
+            sample_ofstreams,
+            sample_names,
+            joint_ofstream,
+            sample_stitching_regions,
+        )
+
+
+def remove_telomeric_breakpoints(
+    genome_occurrences: GenomeOccurrences,
+    telomere_matcher: TelomereMatcher,
+    candidate_breakpoints: List[Dict[BreakpointType, PutativeBreakpoints]],
+    keep_telomeric_breakpoints: bool,
+) -> List[PutativeBreakpoints]:
+    """
+    The breakpoints identified in each of `candidate_breakpoints` (e.g. of each sample):
+    S2G breakpoints inside genomic telomere arrays (`genome_occurrences`) are removed,
+    unless `keep_telomeric_breakpoints`. The genome's telomere arrays are searched
+    once, for all of `candidate_breakpoints`.
+    """
+    kept_breakpoint_ids = None
+    S2G_analysed = any(
+        BreakpointType.S2G in type_breakpoints
+        for type_breakpoints in candidate_breakpoints
     )
-    putative_breakpoints = sorted(
-        putative_breakpoints, key=lambda e: e.max_value, reverse=True
+    if S2G_analysed and not keep_telomeric_breakpoints:
+        S2G_breakpoints = [
+            putative_breakpoint
+            for type_breakpoints in candidate_breakpoints
+            for putative_breakpoint in type_breakpoints.get(BreakpointType.S2G, [])
+        ]
+        # Excludes (read-based) telomere extensions in existing (genomic) telomere arrays
+        kept_breakpoint_ids = set(
+            map(
+                id,
+                remove_breakpoints_in_telomere_arrays(
+                    genome_occurrences, telomere_matcher, S2G_breakpoints
+                ),
+            )
+        )
+    result = list()
+    for type_breakpoints in candidate_breakpoints:
+        identified_breakpoints = list()
+        for breakpoint_type, putative_breakpoints in type_breakpoints.items():
+            if (
+                breakpoint_type is BreakpointType.S2G
+                and kept_breakpoint_ids is not None
+            ):
+                putative_breakpoints = [
+                    putative_breakpoint
+                    for putative_breakpoint in putative_breakpoints
+                    if id(putative_breakpoint) in kept_breakpoint_ids
+                ]
+            identified_breakpoints += putative_breakpoints
+        result.append(identified_breakpoints)
+    return result
+
+
+def get_sample_names(bam_fnames: List[str]) -> List[str]:
+    """
+    Samples are named after their BAM, without its extension
+    """
+    result = [Path(bam_fname).stem for bam_fname in bam_fnames]
+    if len(set(result)) < len(result):
+        raise click.BadParameter(
+            f"BAM names must be distinct without their extension, got {result}",
+            param_hint="bam_fnames",
+        )
+    return result
+
+
+def write_breakpoints(
+    genome: Genome,
+    putative_breakpoints: PutativeBreakpoints,
+    odirname: Path,
+    seq_window_size: int,
+    bgzip_sequences: bool = False,
+) -> None:
+    write_breakpoint_bed(putative_breakpoints, odirname)
+    write_breakpoint_sequences(
+        genome,
+        putative_breakpoints,
+        odirname,
+        max(seq_window_size, 1),
+        bgzip=bgzip_sequences,
     )
-    for m_f in putative_breakpoints:
-        m_f.breakpoint_type = detection_params.breakpoint_type
-    return putative_breakpoints
 
 
 def write_breakpoint_bed(
@@ -115,37 +457,128 @@ def write_breakpoint_bed(
             ofstream.write("\t".join(map(str, out_line)) + "\n")
 
 
-@click.command()
-@click.argument("genome_fname", type=click.Path(exists=True))
-@click.argument("bam_fname", type=click.Path(exists=True))
-@click.argument("odirname")
-@click.option("--seq_region", type=str, help=REGION_CLICK_HELP)
-@click.option(
-    "--bed",
-    type=click.Path(exists=True),
-    help="Path to bed of regions to analyse. Overrides 'seq_region'",
-)
-@click.option(
+# Options shared by subcommands
+telo_forward_seq_option = click.option(
     "--telo_forward_seq",
     type=str,
     default=TELOMERE_SEQS["Nematoda"][Orientation.forward],
     help="The telomere sequence used by your organism. Please make sure this is provided in 'forward' orientation (i.e. 5'->3')",
     show_default=True,
 )
-@click.option(
+telo_array_size_option = click.option(
     "--telo_array_size",
     type=int,
     default=10,
     help="Minimum number of telomeric repeats for a read to be recorded",
     show_default=True,
 )
-@click.option(
+telo_max_edit_distance_option = click.option(
     "--telo_max_edit_distance",
     type=int,
     default=3,
     help="Maximum number of mutations allowed in the searched telomere array",
     show_default=True,
 )
+seq_window_size_option = click.option(
+    "--seq_window_size",
+    type=int,
+    default=350,
+    help="Number of nucleotides to extract either side of each identified breakpoint",
+    show_default=True,
+)
+bgzip_sequences_option = click.option(
+    "--bgzip_sequences",
+    is_flag=True,
+    help="Write breakpoint sequences bgzipped and faidx-indexed ('breakpoint_sequences.fasta.gz'). "
+    "Sequence IDs then end with the breakpoint position, so that each is unique.",
+)
+keep_telomeric_breakpoints_option = click.option(
+    "--keep_telomeric_breakpoints",
+    is_flag=True,
+    help="Forces delfies to keep breakpoints occurring inside telomeric arrays. As these are often false positives, they are discarded by default.",
+    show_default=True,
+)
+approximate_genome_search_option = click.option(
+    "--approximate_genome_search",
+    is_flag=True,
+    help="Search the genome for telomere arrays as in reads (i.e. up to '--telo_max_edit_distance' mutations), "
+    "rather than for exact copies of the telomere array. Finds degenerate genomic telomere arrays, "
+    "both for G2S breakpoint detection and for discarding breakpoints inside telomere arrays",
+)
+threads_option = click.option(
+    "--threads",
+    type=ThreadsParamType(),
+    default=1,
+    help=f"Number of processes to run. '{AUTO_THREADS}': use all available cores, sizing the number of "
+    "processes and of '--decode_threads' from the regions to analyse and the reads they contain (per the BAM index)",
+    show_default=True,
+)
+cache_dir_option = click.option(
+    "--cache_dir",
+    type=click.Path(file_okay=False),
+    help="Directory in which to cache the telomere arrays found in the genome, "
+    "so that later runs against the same genome (e.g. with other BAMs) reuse them. "
+    "Softclip counts are cached too: later runs on the same BAM that only change "
+    "'--min_supporting_reads', '--clustering_threshold' or output options do not read the BAM again",
+)
+genome_index_dir_option = click.option(
+    "--genome_index_dir",
+    type=click.Path(file_okay=False),
+    help="Directory in which to store the cache of the genome's sequences, "
+    "built on the first run and shared by all later runs. The cache is an uncompressed copy "
+    "of the genome (one byte per nucleotide, i.e. about the size of the uncompressed FASTA). "
+    "[default: the genome's directory, or a temporary directory if it is not writable]",
+)
+
+
+class DefaultCommandGroup(click.RichGroup):
+    """
+    Runs the `default_command` subcommand when not given a subcommand, so that
+    `delfies <genome> <bam> <odir>` runs breakpoint detection
+    """
+
+    default_command = "detect"
+    group_options = ["--help", "-h", "--version", "-V"]
+
+    def parse_args(self, ctx, args):
+        if len(args) == 0 or (
+            args[0] not in self.commands and args[0] not in self.group_options
+        ):
+            args = [self.default_command] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+@click.help_option("--help", "-h")
+@click.version_option(__version__, "--version", "-V")
+def main():
+    """
+    Looks for DNA Elimination breakpoints from a BAM (or CRAM) of reads aligned to a genome.
+
+    Runs 'detect' unless another command is given.
+    """
+
+
+@main.command()
+@click.argument("genome_fname", type=click.Path(exists=True))
+@click.argument("bam_fnames", nargs=-1, required=True, type=click.Path(exists=True))
+@click.argument("odirname")
+@click.option("--seq_region", type=str, help=REGION_CLICK_HELP)
+@click.option(
+    "--bed",
+    type=click.Path(exists=True),
+    help="Path to bed of regions to analyse. Overrides 'seq_region'",
+)
+@telo_forward_seq_option
+@telo_array_size_option
+@telo_max_edit_distance_option
+@click.option(
+    "--min_softclip_length",
+    type=int,
+    help="Minimum length of a read's softclip for it to be considered. "
+    "[default: the length of the searched telomere array, minus '--telo_max_edit_distance' (S2G breakpoints), "
+    "and 1 (G2S breakpoints)]",
+)
 @click.option(
     "--clustering_threshold",
     type=int,
@@ -175,13 +608,8 @@ def write_breakpoint_bed(
     help="Minimum number of reads supporting a breakpoint",
     show_default=True,
 )
-@click.option(
-    "--seq_window_size",
-    type=int,
-    default=350,
-    help="Number of nucleotides to extract either side of each identified breakpoint",
-    show_default=True,
-)
+@seq_window_size_option
+@bgzip_sequences_option
 @click.option(
     "--breakpoint_type",
     "-b",
@@ -189,42 +617,67 @@ def write_breakpoint_bed(
     help="The type of breakpoint to look for. By default, looks for all",
     default="all",
 )
+@keep_telomeric_breakpoints_option
+@approximate_genome_search_option
+@threads_option
 @click.option(
-    "--keep_telomeric_breakpoints",
-    is_flag=True,
-    help="Forces delfies to keep breakpoints occurring inside telomeric arrays. As these are often false positives, they are discarded by default.",
+    "--decode_threads",
+    type=int,
+    default=1,
+    help="Number of htslib threads decompressing the BAM/CRAM, in each of '--threads' processes. "
+    f"Ignored with '--threads {AUTO_THREADS}'",
     show_default=True,
 )
-@click.option("--threads", type=int, default=1)
+@cache_dir_option
+@genome_index_dir_option
 @click.help_option("--help", "-h")
-@click.version_option(__version__, "--version", "-V")
-def main(
+def detect(
     genome_fname,
-    bam_fname,
+    bam_fnames,
     odirname,
     seq_region,
     bed,
     telo_forward_seq,
     telo_array_size,
     telo_max_edit_distance,
+    min_softclip_length,
     clustering_threshold,
     min_mapq,
     read_filter_flag,
     min_supporting_reads,
     seq_window_size,
+    bgzip_sequences,
     breakpoint_type,
     keep_telomeric_breakpoints,
+    approximate_genome_search,
     threads,
+    decode_threads,
+    cache_dir,
+    genome_index_dir,
 ):
     """
-    Looks for DNA Elimination breakpoints from a bam of reads aligned to a genome.
+    Looks for DNA Elimination breakpoints from a BAM (or CRAM) of reads aligned to a genome.
+
+    Several BAMs (samples) aligned to the same genome can be analysed jointly, sharing the
+    analysis of the genome: each sample's outputs are then stored in a subdirectory of
+    odirname named after its BAM, and odirname gets 'joint_breakpoint_foci' tsv files
+    with the read support of all samples.
 
     odirname is the directory to store outputs in.
     """
+    sample_names = get_sample_names(bam_fnames)
+    contig_lengths = get_contig_lengths(bam_fnames[0])
+    if any(get_contig_lengths(bam_fname) != contig_lengths for bam_fname in bam_fnames):
+        raise click.BadParameter(
+            "BAMs must all be aligned to the same genome (same contigs and lengths)",
+            param_hint="bam_fnames",
+        )
     odirname = Path(odirname)
     odirname.mkdir(parents=True, exist_ok=True)
-    ofname_base = odirname / "breakpoint_foci"
-    bam_fstream = AlignmentFile(bam_fname)
+    auto_threads = threads == AUTO_THREADS
+    if auto_threads:
+        threads = get_num_cores()
+    genome = open_genome(genome_fname, genome_index_dir)
 
     seq_regions: Intervals = list()
     if bed is not None:
@@ -233,11 +686,12 @@ def main(
             seq_regions.append(Interval.from_pybedtools_interval(interval))
     elif seq_region is not None:
         seq_regions.append(Interval.from_region_string(seq_region))
-        threads = 1
     else:
         # Analyse the entire genome
-        for contig in bam_fstream.references:
-            seq_regions.append(Interval(contig))
+        with AlignmentFile(bam_fnames[0]) as bam_fstream:
+            for contig in bam_fstream.references:
+                seq_regions.append(Interval(contig))
+    seq_regions = merge_intervals(seq_regions)
 
     telomere_seqs = {
         Orientation.forward: telo_forward_seq,
@@ -246,7 +700,7 @@ def main(
 
     clustering_threshold = max(clustering_threshold, 0)
     detection_params = BreakpointDetectionParams(
-        bam_fname=bam_fname,
+        bam_fname=bam_fnames[0],
         telomere_seqs=telomere_seqs,
         telo_array_size=telo_array_size,
         max_edit_distance=telo_max_edit_distance,
@@ -255,53 +709,222 @@ def main(
         read_filter_flag=read_filter_flag,
         min_supporting_reads=min_supporting_reads,
         keep_telomeric_breakpoints=keep_telomeric_breakpoints,
+        min_softclip_length=min_softclip_length,
+        decode_threads=decode_threads,
     )
 
     try:
-        breakpoint_types_to_analyse = [BreakpointType(breakpoint_type)]
+        detection_params.breakpoint_types = [BreakpointType(breakpoint_type)]
     except ValueError:
-        breakpoint_types_to_analyse = all_breakpoint_types
-
-    identified_breakpoints = []
-    searched_telo_unit = detection_params.telomere_seqs[Orientation.forward]
-    searched_telo_array = searched_telo_unit * detection_params.telo_array_size
-    interval_window_size = len(searched_telo_array)
-    for breakpoint_type_to_analyse in breakpoint_types_to_analyse:
-        detection_params.breakpoint_type = breakpoint_type_to_analyse
-        detection_params.ofname_base = (
-            f"{ofname_base}{ID_DELIM}{breakpoint_type_to_analyse}"
+        detection_params.breakpoint_types = all_breakpoint_types
+
+    telomere_matcher = TelomereMatcher.from_detection_params(detection_params)
+    # The genome's telomere arrays are searched once, for both G2S regions and S2G
+    # breakpoint removal
+    genome_occurrences = telomere_matcher.get_genome_occurrences(
+        genome, cache_dir, threads, approximate_genome_search
+    )
+    # All breakpoint types are detected in a single pass over the reads of each region
+    regions_to_analyse = seq_regions
+    if BreakpointType.S2G in detection_params.breakpoint_types:
+        detection_params.target_regions[BreakpointType.S2G] = IntervalLookup(
+            seq_regions
         )
-        if breakpoint_type_to_analyse is BreakpointType.G2S:
-            # Restrict regions to analyse to those containing telomere arrays
-            seq_regions = find_all_occurrences_in_genome(
-                searched_telo_array,
-                genome_fname,
-                seq_regions,
-                interval_window_size,
-            )
-        candidate_breakpoints = run_breakpoint_detection(
-            detection_params, seq_regions, threads
+    if BreakpointType.G2S in detection_params.breakpoint_types:
+        # Restrict G2S analysis to regions containing telomere arrays
+        G2S_regions = telomere_matcher.find_in_genome(genome_occurrences, seq_regions)
+        G2S_target_regions = IntervalLookup(G2S_regions)
+        detection_params.target_regions[BreakpointType.G2S] = G2S_target_regions
+        if BreakpointType.S2G in detection_params.breakpoint_types:
+            regions_to_analyse = [
+                extend_to_overlapping(seq_region, G2S_target_regions)
+                for seq_region in seq_regions
+            ]
+        else:
+            regions_to_analyse = G2S_regions
+    if auto_threads:
+        parallelism_plan = plan_breakpoint_detection(
+            bam_fnames, regions_to_analyse, threads
         )
+        click.echo(parallelism_plan.describe(), err=True)
+        detection_threads = parallelism_plan.num_workers
+        detection_params.decode_threads = parallelism_plan.decode_threads
+    else:
+        detection_threads = threads
 
-        if (
-            breakpoint_type_to_analyse is BreakpointType.S2G
-            and not detection_params.keep_telomeric_breakpoints
-        ):
-            # Excludes (read-based) telomere extensions in existing (genomic) telomere arrays
-            identified_breakpoints += remove_breakpoints_in_telomere_arrays(
-                genome_fname,
-                searched_telo_array,
-                interval_window_size,
-                candidate_breakpoints,
+    # Samples share the genome's analysis (target regions, telomere arrays)
+    sample_odirnames = [odirname]
+    if len(bam_fnames) > 1:
+        sample_odirnames = [odirname / sample_name for sample_name in sample_names]
+    sample_detection_params = list()
+    for bam_fname, sample_odirname in zip(bam_fnames, sample_odirnames):
+        sample_odirname.mkdir(parents=True, exist_ok=True)
+        with AlignmentFile(bam_fname) as bam_fstream:
+            # CRAM files are decoded using the genome as reference
+            is_cram = bam_fstream.is_cram
+        sample_detection_params.append(
+            replace(
+                detection_params,
+                bam_fname=bam_fname,
+                ofname_base=sample_odirname / "breakpoint_foci",
+                reference_fname=genome.get_reference_fname() if is_cram else None,
             )
-        else:
-            identified_breakpoints += candidate_breakpoints
+        )
+    candidate_breakpoints = run_breakpoint_detection(
+        sample_detection_params,
+        regions_to_analyse,
+        detection_threads,
+        cache_dir=cache_dir,
+        sample_names=sample_names,
+        joint_ofname_base=(
+            odirname / "joint_breakpoint_foci" if len(bam_fnames) > 1 else None
+        ),
+    )
+    identified_breakpoints = remove_telomeric_breakpoints(
+        genome_occurrences,
+        telomere_matcher,
+        candidate_breakpoints,
+        keep_telomeric_breakpoints,
+    )
+    for sample_breakpoints, sample_odirname in zip(
+        identified_breakpoints, sample_odirnames
+    ):
+        write_breakpoints(
+            genome,
+            sample_breakpoints,
+            sample_odirname,
+            seq_window_size,
+            bgzip_sequences,
+        )
 
-    write_breakpoint_bed(identified_breakpoints, odirname)
-    seq_window_size = max(seq_window_size, 1)
-    write_breakpoint_sequences(
-        genome_fname, identified_breakpoints, odirname, seq_window_size
+
+@main.command()
+@click.argument("genome_fname", type=click.Path(exists=True))
+@click.argument("foci_dirname", type=click.Path(exists=True, file_okay=False))
+@click.argument("odirname")
+@click.option(
+    "--min_supporting_reads",
+    type=int,
+    multiple=True,
+    default=[10],
+    help="Minimum number of reads supporting a breakpoint. Can be given several times. "
+    "Values below the one used to produce the foci have no effect",
+    show_default=True,
+)
+@click.option(
+    "--clustering_threshold",
+    type=int,
+    multiple=True,
+    default=[5],
+    help="Any identified breakpoints within this value (in bp) of each other will be merged. "
+    "Can be given several times",
+    show_default=True,
+)
+@telo_forward_seq_option
+@telo_array_size_option
+@telo_max_edit_distance_option
+@seq_window_size_option
+@bgzip_sequences_option
+@keep_telomeric_breakpoints_option
+@approximate_genome_search_option
+@threads_option
+@cache_dir_option
+@genome_index_dir_option
+@click.help_option("--help", "-h")
+def recluster(
+    genome_fname,
+    foci_dirname,
+    odirname,
+    min_supporting_reads,
+    clustering_threshold,
+    telo_forward_seq,
+    telo_array_size,
+    telo_max_edit_distance,
+    seq_window_size,
+    bgzip_sequences,
+    keep_telomeric_breakpoints,
+    approximate_genome_search,
+    threads,
+    cache_dir,
+    genome_index_dir,
+):
+    """
+    Calls breakpoints again from the foci found by a previous run, without reading the BAM.
+
+    foci_dirname is the output directory of the previous run: its 'breakpoint_foci' tsv files
+    are re-filtered and re-clustered with each combination of '--min_supporting_reads' and
+    '--clustering_threshold'. The outputs of each combination are stored in their own
+    subdirectory of odirname.
+    """
+    odirname = Path(odirname)
+    if threads == AUTO_THREADS:
+        threads = get_num_cores()
+    genome = open_genome(genome_fname, genome_index_dir)
+    telomere_matcher = TelomereMatcher(
+        {
+            Orientation.forward: telo_forward_seq,
+            Orientation.reverse: rev_comp(telo_forward_seq),
+        },
+        telo_array_size,
+        telo_max_edit_distance,
+    )
+    type_foci = dict()
+    for breakpoint_type in all_breakpoint_types:
+        foci_tsv = (
+            Path(foci_dirname) / f"breakpoint_foci{ID_DELIM}{breakpoint_type}.tsv"
+        )
+        if foci_tsv.exists():
+            type_foci[breakpoint_type] = FociTable.from_tsv(foci_tsv, breakpoint_type)
+    if len(type_foci) == 0:
+        raise click.BadParameter(
+            f"no 'breakpoint_foci' tsv files in {foci_dirname}",
+            param_hint="foci_dirname",
+        )
+
+    parameter_combinations = list(
+        product(sorted(set(min_supporting_reads)), sorted(set(clustering_threshold)))
     )
+    combination_breakpoints = dict()
+    for min_reads, threshold in parameter_combinations:
+        combination_breakpoints[(min_reads, threshold)] = {
+            breakpoint_type: call_breakpoints_from_foci(
+                foci, min_reads, max(threshold, 0)
+            )
+            for breakpoint_type, foci in type_foci.items()
+        }
+    # The genome's telomere arrays are searched once, for all combinations
+    combination_identified_breakpoints = remove_telomeric_breakpoints(
+        telomere_matcher.get_genome_occurrences(
+            genome, cache_dir, threads, approximate_genome_search
+        ),
+        telomere_matcher,
+        list(combination_breakpoints.values()),
+        keep_telomeric_breakpoints,
+    )
+
+    for (min_reads, threshold), identified_breakpoints in zip(
+        combination_breakpoints, combination_identified_breakpoints
+    ):
+        combination_dirname = (
+            odirname
+            / f"min_supporting_reads_{min_reads}{ID_DELIM}clustering_threshold_{threshold}"
+        )
+        combination_dirname.mkdir(parents=True, exist_ok=True)
+        for breakpoint_type, foci in type_foci.items():
+            foci_tsv = (
+                combination_dirname / f"breakpoint_foci{ID_DELIM}{breakpoint_type}.tsv"
+            )
+            with foci_tsv.open("w") as ofstream:
+                filter_foci_by_support(foci, min_reads).write_tsv(
+                    ofstream, with_header=True
+                )
+        write_breakpoints(
+            genome,
+            identified_breakpoints,
+            combination_dirname,
+            seq_window_size,
+            bgzip_sequences,
+        )
 
 
 if __name__ == "__main__":
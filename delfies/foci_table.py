@@ -0,0 +1,337 @@
+"""
+Columnar storage of breakpoint foci. Foci are kept in numpy arrays from the moment
+softclips are counted, and only turned into text (TSV) or into objects
+(`BreakpointFocus`) at the output boundary.
+"""
+
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, TextIO
+
+import numpy as np
+
+from delfies import (
+    ID_DELIM,
+    READ_SUPPORT_PREFIX,
+    BreakpointFocus,
+    BreakpointType,
+    Orientation,
+)
+
+READ_SUPPORTS = [
+    f"{READ_SUPPORT_PREFIX}{ID_DELIM}{o}" for o in map(lambda e: e.name, Orientation)
+]
+FOCI_TSV_HEADER = [
+    "contig",
+    "start",
+    "end",
+    "read_depth",
+    "breakpoint_type",
+] + READ_SUPPORTS
+FOCI_COLUMN_DTYPES = {
+    "contig_id": np.int32,
+    "start": np.int32,
+    "read_depth": np.uint32,
+    **{read_support: np.uint32 for read_support in READ_SUPPORTS},
+}
+UNSUPPORTED_FOCUS_TYPE = "0"
+# Per-sample columns of joint foci tsvs (see `FociTable.write_joint_tsv`)
+JOINT_TSV_SAMPLE_COLUMNS = ["read_depth"] + READ_SUPPORTS
+JOINT_TSV_MISSING_VALUE = "NA"
+
+
+def get_read_support_name(orientation: Orientation) -> str:
+    return f"{READ_SUPPORT_PREFIX}{ID_DELIM}{orientation.name}"
+
+
+class FociTable:
+    """
+    Breakpoint foci of a single breakpoint type, stored one numpy array per column:
+    contig ids (indexing `contigs`), start positions, read depth, and the number of
+    reads supporting the focus in each orientation.
+
+    Focus ends are always start + 1, so are not stored. Foci without read support
+    (only recorded for their read depth) get breakpoint type
+    `UNSUPPORTED_FOCUS_TYPE` in the output.
+    """
+
+    def __init__(
+        self,
+        breakpoint_type: Optional[BreakpointType],
+        contigs: Optional[List[str]] = None,
+        columns: Optional[Dict[str, Iterable[int]]] = None,
+    ):
+        self.breakpoint_type = breakpoint_type
+        self.contigs = list(contigs) if contigs is not None else list()
+        if columns is None:
+            columns = dict()
+        num_foci = len(columns.get("start", ()))
+        # Missing columns are zero-filled
+        self.columns = {
+            name: (
+                np.asarray(columns[name], dtype=dtype)
+                if name in columns
+                else np.zeros(num_foci, dtype=dtype)
+            )
+            for name, dtype in FOCI_COLUMN_DTYPES.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def contig_ids(self) -> np.ndarray:
+        return self.columns["contig_id"]
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.columns["start"]
+
+    def get_position_keys(self) -> np.ndarray:
+        """
+        A single integer per focus encoding its contig id and position, increasing with
+        both. Positions are >= -1, so keys are distinct across contigs.
+        """
+        return self.contig_ids.astype(np.int64) * (1 << 33) + self.starts + 8
+
+    def has_support(self, min_supporting_reads: int = 1) -> np.ndarray:
+        result = np.zeros(len(self), dtype=bool)
+        for read_support in READ_SUPPORTS:
+            result |= self.columns[read_support] >= min_supporting_reads
+        return result
+
+    def filter(self, selection: np.ndarray) -> "FociTable":
+        """
+        `selection`: a boolean mask, or an array of row indices
+        """
+        return FociTable(
+            self.breakpoint_type,
+            self.contigs,
+            {name: column[selection] for name, column in self.columns.items()},
+        )
+
+    @classmethod
+    def concatenate(
+        cls,
+        tables: List["FociTable"],
+        breakpoint_type: Optional[BreakpointType] = None,
+    ) -> "FociTable":
+        if breakpoint_type is None and len(tables) > 0:
+            breakpoint_type = tables[0].breakpoint_type
+        contig_ids: Dict[str, int] = dict()
+        columns = {name: list() for name in FOCI_COLUMN_DTYPES}
+        for table in tables:
+            new_contig_ids = np.array(
+                [
+                    contig_ids.setdefault(contig, len(contig_ids))
+                    for contig in table.contigs
+                ],
+                dtype=np.int32,
+            )
+            for name, column in table.columns.items():
+                if name == "contig_id" and len(column) > 0:
+                    column = new_contig_ids[column]
+                columns[name].append(column)
+        return cls(
+            breakpoint_type,
+            list(contig_ids),
+            {
+                name: np.concatenate(column_parts) if column_parts else ()
+                for name, column_parts in columns.items()
+            },
+        )
+
+    def deduplicate_positions(self) -> "FociTable":
+        """
+        Sorts foci by contig id and position, keeping a single focus per position:
+        one with read support if there is any.
+        """
+        order = np.lexsort((~self.has_support(), self.starts, self.contig_ids))
+        result = self.filter(order)
+        is_first_at_position = np.ones(len(result), dtype=bool)
+        is_first_at_position[1:] = (np.diff(result.contig_ids) != 0) | (
+            np.diff(result.starts) != 0
+        )
+        return result.filter(is_first_at_position)
+
+    ##########################
+    ## Conversion to output ##
+    ##########################
+    def _get_output_columns(self) -> List[list]:
+        breakpoint_types = np.where(
+            self.has_support(), str(self.breakpoint_type), UNSUPPORTED_FOCUS_TYPE
+        )
+        return [
+            [self.contigs[contig_id] for contig_id in self.contig_ids.tolist()],
+            self.starts.tolist(),
+            (self.starts + 1).tolist(),
+            self.columns["read_depth"].tolist(),
+            breakpoint_types.tolist(),
+        ] + [self.columns[read_support].tolist() for read_support in READ_SUPPORTS]
+
+    def __iter__(self) -> Iterator[BreakpointFocus]:
+        for row in zip(*self._get_output_columns()):
+            yield BreakpointFocus(**dict(zip(FOCI_TSV_HEADER, row)))
+
+    @staticmethod
+    def write_tsv_header(ofstream: TextIO) -> None:
+        ofstream.write("\t".join(FOCI_TSV_HEADER) + "\n")
+
+    def write_tsv(self, ofstream: TextIO, with_header: bool = False) -> None:
+        if with_header:
+            self.write_tsv_header(ofstream)
+        for row in zip(*self._get_output_columns()):
+            ofstream.write("\t".join(map(str, row)) + "\n")
+
+    @classmethod
+    def from_tsv(cls, foci_tsv: str, breakpoint_type: BreakpointType) -> "FociTable":
+        contig_ids: Dict[str, int] = dict()
+        columns = {name: array("q") for name in FOCI_COLUMN_DTYPES}
+        with open(foci_tsv) as ifstream:
+            header = next(ifstream).rstrip("\n").split("\t")
+            for focus_line in ifstream:
+                fields = dict(zip(header, focus_line.rstrip("\n").split("\t")))
+                columns["contig_id"].append(
+                    contig_ids.setdefault(fields["contig"], len(contig_ids))
+                )
+                for name in FOCI_COLUMN_DTYPES:
+                    if name != "contig_id":
+                        columns[name].append(int(fields[name]))
+        return cls(breakpoint_type, list(contig_ids), columns)
+
+    @staticmethod
+    def write_joint_tsv_header(sample_names: List[str], ofstream: TextIO) -> None:
+        header = FOCI_TSV_HEADER[:3] + ["breakpoint_type"]
+        for sample_name in sample_names:
+            header.extend(
+                f"{sample_name}{ID_DELIM}{name}" for name in JOINT_TSV_SAMPLE_COLUMNS
+            )
+        ofstream.write("\t".join(header) + "\n")
+
+    @staticmethod
+    def write_joint_tsv(sample_foci: List["FociTable"], ofstream: TextIO) -> None:
+        """
+        Writes the foci of several samples (of the same breakpoint type) as rows of a
+        single tsv (see `write_joint_tsv_header`): one row per position recorded in
+        any sample, sorted by contig and position, with the read depth and read support
+        of each sample in its own columns.
+
+        Samples only record positions around their own foci, so the read depth and
+        read support of a sample not recording a position are unknown: they are
+        written as `JOINT_TSV_MISSING_VALUE`.
+        """
+        joint_foci = FociTable.concatenate(sample_foci)
+        sample_indices = np.repeat(
+            np.arange(len(sample_foci)), [len(foci) for foci in sample_foci]
+        )
+        _, first_row_idx, position_idx = np.unique(
+            joint_foci.get_position_keys(), return_index=True, return_inverse=True
+        )
+        is_supported = np.zeros(len(first_row_idx), dtype=bool)
+        sample_columns = list()
+        for sample_idx in range(len(sample_foci)):
+            is_sample = sample_indices == sample_idx
+            for name in JOINT_TSV_SAMPLE_COLUMNS:
+                sample_column = joint_foci.columns[name][is_sample]
+                if name in READ_SUPPORTS:
+                    is_supported[position_idx[is_sample]] |= sample_column > 0
+                column = np.full(
+                    len(first_row_idx), JOINT_TSV_MISSING_VALUE, dtype=object
+                )
+                column[position_idx[is_sample]] = sample_column.tolist()
+                sample_columns.append(column.tolist())
+        starts = joint_foci.starts[first_row_idx]
+        breakpoint_types = np.where(
+            is_supported, str(joint_foci.breakpoint_type), UNSUPPORTED_FOCUS_TYPE
+        )
+        output_columns = [
+            [
+                joint_foci.contigs[contig_id]
+                for contig_id in joint_foci.contig_ids[first_row_idx].tolist()
+            ],
+            starts.tolist(),
+            (starts + 1).tolist(),
+            breakpoint_types.tolist(),
+        ] + sample_columns
+        for row in zip(*output_columns):
+            ofstream.write("\t".join(map(str, row)) + "\n")
+
+    ###########################
+    ## Binary (shard) format ##
+    ###########################
+    def save(self, fname: str) -> None:
+        with open(fname, "wb") as ofstream:
+            np.savez(
+                ofstream,
+                breakpoint_type=np.array(str(self.breakpoint_type)),
+                contigs=np.array(self.contigs, dtype=str),
+                **self.columns,
+            )
+
+    @classmethod
+    def load(cls, fname: str) -> "FociTable":
+        with np.load(fname) as npz_data:
+            return cls(
+                BreakpointType(str(npz_data["breakpoint_type"])),
+                npz_data["contigs"].tolist(),
+                {name: npz_data[name] for name in FOCI_COLUMN_DTYPES},
+            )
+
+
+ORIENTATION_INDICES = {orientation: i for i, orientation in enumerate(Orientation)}
+
+
+class SoftclipPositions:
+    """
+    Accumulates the positions of softclips supporting a breakpoint, one softclip at a
+    time, and counts them in bulk into a `FociTable`.
+
+    Softclips are indexed per contig (by reference id), by a single integer encoding
+    their position and orientation index; contig names are only looked up when
+    building the `FociTable`.
+    """
+
+    def __init__(self):
+        self._softclip_keys: Dict[int, array] = defaultdict(lambda: array("q"))
+
+    def __len__(self) -> int:
+        return sum(map(len, self._softclip_keys.values()))
+
+    def add(self, reference_id: int, position: int, orientation: Orientation) -> None:
+        """
+        Positions are >= -1 (see `SAM_utils.find_softclip_at_extremity`)
+        """
+        self._softclip_keys[reference_id].append(
+            (position + 1) * len(Orientation) + ORIENTATION_INDICES[orientation]
+        )
+
+    def to_foci_table(
+        self, breakpoint_type: BreakpointType, reference_names: Sequence[str]
+    ) -> FociTable:
+        """
+        One focus per distinct softclip position, sorted by reference id and position.
+        `reference_names`: contig names, indexed by reference id (e.g. as in
+        `pysam.AlignmentFile.references`).
+        """
+        contig_foci = list()
+        for reference_id in sorted(self._softclip_keys):
+            softclip_keys, num_softclips = np.unique(
+                np.array(self._softclip_keys[reference_id], dtype=np.int64),
+                return_counts=True,
+            )
+            focus_starts, focus_idx = np.unique(
+                softclip_keys // len(Orientation) - 1, return_inverse=True
+            )
+            orientation_indices = softclip_keys % len(Orientation)
+            columns = {"start": focus_starts}
+            for orientation, orientation_idx in ORIENTATION_INDICES.items():
+                is_orientation = orientation_indices == orientation_idx
+                columns[get_read_support_name(orientation)] = np.bincount(
+                    focus_idx[is_orientation],
+                    weights=num_softclips[is_orientation],
+                    minlength=len(focus_starts),
+                )
+            contig_foci.append(
+                FociTable(breakpoint_type, [reference_names[reference_id]], columns)
+            )
+        return FociTable.concatenate(contig_foci, breakpoint_type)
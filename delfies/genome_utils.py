@@ -0,0 +1,226 @@
+"""
+Shared, read-only access to the sequences of a genome
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile, gettempdir
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pyfastx import Fastx
+
+from delfies import ID_DELIM
+
+logger = logging.getLogger(__name__)
+
+# Where genome caches go when they cannot be written next to the genome
+FALLBACK_INDEX_DIR = Path(gettempdir()) / "delfies_genome_cache"
+
+
+def get_genome_identity(genome_fname: str) -> str:
+    """
+    Identifies the genome file by a hash of its path, size and modification time,
+    rather than of its contents: it is cheap to compute, and a modified genome gets a
+    new identity. A copied or re-touched genome also gets a new identity, so does not
+    reuse the caches of the original. Keys all the caches built from a genome.
+    """
+    genome_path = Path(genome_fname).resolve()
+    genome_stat = genome_path.stat()
+    genome_key = ID_DELIM.join(
+        map(str, [genome_path, genome_stat.st_size, genome_stat.st_mtime_ns])
+    )
+    return hashlib.sha256(genome_key.encode()).hexdigest()[:16]
+
+
+def get_genome_cache_fnames(
+    genome_fname: str, index_dir: Optional[str] = None
+) -> Tuple[Path, Path]:
+    """
+    The cache of a genome is named after the genome's identity (see
+    `get_genome_identity`), so that a modified genome gets a new cache.
+    """
+    genome_path = Path(genome_fname).resolve()
+    cache_name = f"{genome_path.name}{ID_DELIM}{get_genome_identity(genome_path)}"
+    cache_dir = genome_path.parent if index_dir is None else Path(index_dir)
+    return cache_dir / f"{cache_name}.seq", cache_dir / f"{cache_name}.index.npz"
+
+
+class Genome:
+    """
+    Read-only access to the sequences of a (possibly gzipped) FASTA genome, through a
+    memory-mapped cache file of its sequences: one byte per nucleotide, contigs
+    concatenated, nucleotide case preserved.
+
+    The cache is built the first time the genome is opened, in `index_dir` (by default,
+    the genome's directory, or `FALLBACK_INDEX_DIR` if that is not writable), and is
+    then only read: processes using the same cache (e.g. pool workers, or concurrent
+    runs) share it through the OS page cache rather than each parsing the FASTA.
+
+    Use `open_genome` to open each genome only once per process.
+    """
+
+    def __init__(self, genome_fname: str, index_dir: Optional[str] = None):
+        self.genome_fname = str(genome_fname)
+        self.index_dir = index_dir
+        self._open()
+
+    def _open(self) -> None:
+        seq_fname, index_fname = get_genome_cache_fnames(
+            self.genome_fname, self.index_dir
+        )
+        if not index_fname.exists():
+            try:
+                self._build_cache(seq_fname, index_fname)
+            except OSError as error:
+                # E.g. the genome lies in a read-only directory
+                if self.index_dir is not None:
+                    raise
+                logger.warning(
+                    f"Could not cache the genome's sequences next to it ({error}); "
+                    f"caching them in {FALLBACK_INDEX_DIR} instead. "
+                    "Use '--genome_index_dir' to choose where the cache goes."
+                )
+                self.index_dir = str(FALLBACK_INDEX_DIR)
+                seq_fname, index_fname = get_genome_cache_fnames(
+                    self.genome_fname, self.index_dir
+                )
+                if not index_fname.exists():
+                    self._build_cache(seq_fname, index_fname)
+        self._seq_fname = seq_fname
+        with np.load(index_fname) as index_data:
+            self.contigs: List[str] = index_data["contigs"].tolist()
+            offsets = index_data["offsets"].tolist()
+        self._offsets: Dict[str, int] = dict(zip(self.contigs, offsets[:-1]))
+        self._lengths: Dict[str, int] = {
+            contig: end - start
+            for contig, start, end in zip(self.contigs, offsets[:-1], offsets[1:])
+        }
+        if offsets[-1] > 0:
+            self._sequences = np.memmap(seq_fname, dtype=np.uint8, mode="r")
+        else:
+            self._sequences = np.zeros(0, dtype=np.uint8)
+
+    def _build_cache(self, seq_fname: Path, index_fname: Path) -> None:
+        """
+        Both cache files are written to temporary files first, and the index is moved
+        in place last: a cache with an index is always complete.
+        """
+        seq_fname.parent.mkdir(parents=True, exist_ok=True)
+        contigs = list()
+        offsets = [0]
+        with NamedTemporaryFile(dir=seq_fname.parent, delete=False) as ofstream:
+            try:
+                for contig, sequence in Fastx(self.genome_fname):
+                    ofstream.write(sequence.encode("ascii"))
+                    contigs.append(contig)
+                    offsets.append(offsets[-1] + len(sequence))
+            except OSError:
+                # E.g. a full disk: no partial cache is left behind
+                os.remove(ofstream.name)
+                raise
+        os.replace(ofstream.name, seq_fname)
+        with NamedTemporaryFile(
+            dir=index_fname.parent, suffix=".npz", delete=False
+        ) as ofstream:
+            np.savez(
+                ofstream,
+                contigs=np.array(contigs, dtype=str),
+                offsets=np.array(offsets, dtype=np.int64),
+            )
+        os.replace(ofstream.name, index_fname)
+
+    def get_reference_fname(self) -> str:
+        """
+        The cache's sequences, faidx-indexed as a FASTA file with each contig on a single
+        line (and no headers), make a reference htslib can read, e.g. to decode CRAM
+        files. The faidx index is written the first time it is needed.
+        """
+        try:
+            self._write_fai(self._seq_fname)
+        except OSError as error:
+            # E.g. a cache shared in a read-only directory: the reference is then a
+            # link to the cache's sequences, indexed in `FALLBACK_INDEX_DIR`
+            logger.warning(
+                f"Could not index the genome's cache ({error}); "
+                f"indexing it in {FALLBACK_INDEX_DIR} instead."
+            )
+            reference_fname = FALLBACK_INDEX_DIR / self._seq_fname.name
+            FALLBACK_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            try:
+                reference_fname.symlink_to(self._seq_fname.resolve())
+            except FileExistsError:
+                pass
+            self._write_fai(reference_fname)
+            return str(reference_fname)
+        return str(self._seq_fname)
+
+    def _write_fai(self, seq_fname: Path) -> None:
+        fai_fname = seq_fname.with_name(f"{seq_fname.name}.fai")
+        if fai_fname.exists():
+            return
+        with NamedTemporaryFile(
+            "w", dir=fai_fname.parent, suffix=".fai", delete=False
+        ) as ofstream:
+            for contig in self.contigs:
+                contig_length = self._lengths[contig]
+                line_length = max(contig_length, 1)
+                fai_fields = [
+                    contig,
+                    contig_length,
+                    self._offsets[contig],
+                    line_length,
+                    line_length,
+                ]
+                ofstream.write("\t".join(map(str, fai_fields)) + "\n")
+        os.replace(ofstream.name, fai_fname)
+
+    def get_length(self, contig: str) -> int:
+        return self._lengths[contig]
+
+    def fetch(
+        self,
+        contig: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        uppercase: bool = False,
+    ) -> str:
+        """
+        The sequence of `contig` in [start, end) (0-based), clipped to the contig
+        """
+        contig_length = self._lengths[contig]
+        end = contig_length if end is None else min(end, contig_length)
+        start = min(max(start, 0), contig_length)
+        end = max(end, start)
+        offset = self._offsets[contig]
+        result = (
+            self._sequences[offset + start : offset + end].tobytes().decode("ascii")
+        )
+        if uppercase:
+            result = result.upper()
+        return result
+
+    def __getstate__(self) -> dict:
+        """
+        Pickled genomes (e.g. sent to pool workers) map the cache again when unpickled
+        """
+        return {"genome_fname": self.genome_fname, "index_dir": self.index_dir}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._open()
+
+
+_open_genomes: Dict[Path, Genome] = dict()
+
+
+def open_genome(genome_fname: str, index_dir: Optional[str] = None) -> Genome:
+    """
+    Opens each genome (cache) only once per process
+    """
+    seq_fname, _ = get_genome_cache_fnames(genome_fname, index_dir)
+    if seq_fname not in _open_genomes:
+        _open_genomes[seq_fname] = Genome(genome_fname, index_dir)
+    return _open_genomes[seq_fname]
@@ -1,7 +1,11 @@
+from bisect import bisect_right
+from collections import defaultdict
 from dataclasses import dataclass
 from itertools import groupby
 from operator import itemgetter
-from typing import List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
 
 from delfies import REGION_DELIM1, REGION_DELIM2
 
@@ -46,6 +50,326 @@ class Interval:
 Intervals = List[Interval]
 
 
+@dataclass
+class Tile(Interval):
+    """
+    A fixed-size piece of a region to analyse, with coordinates [start, end).
+
+    The tiles of a region partition the breakpoint positions found in it: a tile owns
+    the positions inside it, and the first (resp. last) tile of a region also owns all
+    positions before (resp. after) it.
+    A read crossing a tile boundary is thus fetched by both tiles, but each of its
+    softclips is recorded by a single tile.
+    """
+
+    region_idx: int = 0
+    first: bool = True
+    last: bool = True
+
+    def owns(self, query_pos: int) -> bool:
+        return (self.first or query_pos >= self.start) and (
+            self.last or query_pos < self.end
+        )
+
+    def to_fetch_interval(self) -> Interval:
+        """
+        Softclips at a position owned by the tile can belong to a read ending
+        (resp. starting) one position before (resp. after) the tile.
+        """
+        return Interval(
+            self.name,
+            self.start if self.first else self.start - 1,
+            self.end if self.last else self.end + 1,
+        )
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+
+Tiles = List[Tile]
+
+
+class IntervalLookup:
+    """
+    Answers membership queries against a set of intervals, grouped by contig.
+    Intervals are sorted and overlapping intervals merged at construction, so each
+    query is a binary search.
+
+    Intervals without coordinates span their entire contig.
+    """
+
+    def __init__(self, intervals: Intervals):
+        self._whole_contigs = set()
+        self._starts: Dict[str, List[int]] = dict()
+        self._ends: Dict[str, List[int]] = dict()
+        by_contig: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for interval in intervals:
+            if interval.has_coordinates():
+                by_contig[interval.name].append((interval.start, interval.end))
+            else:
+                self._whole_contigs.add(interval.name)
+        for contig, coordinates in by_contig.items():
+            starts, ends = [], []
+            for start, end in sorted(coordinates):
+                if len(ends) > 0 and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[contig] = starts
+            self._ends[contig] = ends
+
+    def to_intervals(self) -> Intervals:
+        """
+        The (merged) intervals of the lookup, sorted by contig and position
+        """
+        result = [Interval(contig) for contig in sorted(self._whole_contigs)]
+        for contig in sorted(self._starts):
+            if contig not in self._whole_contigs:
+                result.extend(
+                    Interval(contig, start, end)
+                    for start, end in zip(self._starts[contig], self._ends[contig])
+                )
+        return result
+
+    def _rightmost_index(self, contig: str, query_pos: int) -> int:
+        """
+        Index of the last interval starting at or before `query_pos`, -1 if none
+        """
+        return bisect_right(self._starts.get(contig, []), query_pos) - 1
+
+    def spans(self, contig: str, query_pos: int) -> bool:
+        """
+        Same semantics as `Interval.spans`: interval ends are inclusive
+        """
+        if contig in self._whole_contigs:
+            return True
+        idx = self._rightmost_index(contig, query_pos)
+        return idx >= 0 and query_pos <= self._ends[contig][idx]
+
+    def overlaps(self, contig: str, start: int, end: int) -> bool:
+        """
+        Same semantics as fetching reads from a region: `end` is exclusive
+        """
+        if contig in self._whole_contigs:
+            return True
+        idx = self._rightmost_index(contig, end - 1)
+        return idx >= 0 and self._ends[contig][idx] > start
+
+    def find_overlapping(self, query_interval: Interval) -> Intervals:
+        if query_interval.name in self._whole_contigs:
+            return [Interval(query_interval.name)]
+        starts = self._starts.get(query_interval.name, [])
+        ends = self._ends.get(query_interval.name, [])
+        if not query_interval.has_coordinates():
+            return [Interval(query_interval.name, s, e) for s, e in zip(starts, ends)]
+        result = list()
+        idx = self._rightmost_index(query_interval.name, query_interval.end - 1)
+        while idx >= 0 and ends[idx] > query_interval.start:
+            result.append(Interval(query_interval.name, starts[idx], ends[idx]))
+            idx -= 1
+        return result[::-1]
+
+
+def extend_to_overlapping(
+    query_interval: Interval, interval_lookup: IntervalLookup
+) -> Interval:
+    """
+    Extends `query_interval` so that it fully contains all the intervals
+    in `interval_lookup` that it overlaps.
+    """
+    if not query_interval.has_coordinates():
+        return query_interval
+    start, end = query_interval.start, query_interval.end
+    for overlapping in interval_lookup.find_overlapping(query_interval):
+        if not overlapping.has_coordinates():
+            return Interval(query_interval.name)
+        start = min(start, overlapping.start)
+        end = max(end, overlapping.end)
+    return Interval(query_interval.name, start, end)
+
+
+###################################
+## Interval algebra on Intervals ##
+###################################
+# Intervals have coordinates [start, end); intervals without coordinates span their
+# entire contig, represented with an end at `WHOLE_CONTIG_END` when contig lengths
+# are not known.
+WHOLE_CONTIG_END = np.iinfo(np.int64).max
+ContigCoordinates = Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+def _to_sorted_arrays(
+    intervals: Intervals, contig_lengths: Optional[Dict[str, int]] = None
+) -> ContigCoordinates:
+    """
+    Coordinates of `intervals`, grouped by contig (in order of first appearance) and
+    sorted by start, as arrays of starts and ends.
+    """
+    by_contig: Dict[str, List[Tuple[int, int]]] = dict()
+    for interval in intervals:
+        if interval.has_coordinates():
+            coordinates = (interval.start, interval.end)
+        elif contig_lengths is not None:
+            coordinates = (0, contig_lengths[interval.name])
+        else:
+            coordinates = (0, WHOLE_CONTIG_END)
+        by_contig.setdefault(interval.name, list()).append(coordinates)
+    result = dict()
+    for contig, coordinates in by_contig.items():
+        coordinates = np.array(coordinates, dtype=np.int64).reshape(-1, 2)
+        order = np.lexsort((coordinates[:, 1], coordinates[:, 0]))
+        result[contig] = (coordinates[order, 0], coordinates[order, 1])
+    return result
+
+
+def _merge_sorted_arrays(
+    starts: np.ndarray, ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges overlapping or book-ended intervals, given sorted by start
+    """
+    if len(starts) == 0:
+        return starts, ends
+    max_previous_ends = np.maximum.accumulate(ends)[:-1]
+    group_starts = np.flatnonzero(
+        np.concatenate(([True], starts[1:] > max_previous_ends))
+    )
+    group_ends = np.concatenate((group_starts[1:], [len(starts)])) - 1
+    return starts[group_starts], np.maximum.accumulate(ends)[group_ends]
+
+
+def _from_arrays(contig_coordinates: ContigCoordinates) -> Intervals:
+    result = list()
+    for contig, (starts, ends) in contig_coordinates.items():
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if end == WHOLE_CONTIG_END:
+                result.append(Interval(contig))
+            elif end > start:
+                result.append(Interval(contig, start, end))
+    return result
+
+
+def sort_intervals(intervals: Intervals) -> Intervals:
+    """
+    Sorts `intervals` by position within each contig; contigs keep their order of
+    first appearance.
+    """
+    return _from_arrays(_to_sorted_arrays(intervals))
+
+
+def merge_intervals(
+    intervals: Intervals, contig_lengths: Optional[Dict[str, int]] = None
+) -> Intervals:
+    """
+    Sorts `intervals` (see `sort_intervals`) and merges overlapping or book-ended ones.
+    """
+    return _from_arrays(
+        {
+            contig: _merge_sorted_arrays(starts, ends)
+            for contig, (starts, ends) in _to_sorted_arrays(
+                intervals, contig_lengths
+            ).items()
+        }
+    )
+
+
+def intersect_intervals(
+    intervals: Intervals,
+    other_intervals: Intervals,
+    contig_lengths: Optional[Dict[str, int]] = None,
+) -> Intervals:
+    """
+    The (merged) positions found both in `intervals` and in `other_intervals`
+    """
+    other_coordinates = _to_sorted_arrays(other_intervals, contig_lengths)
+    result = dict()
+    for contig, (starts, ends) in _to_sorted_arrays(intervals, contig_lengths).items():
+        if contig not in other_coordinates:
+            continue
+        starts, ends = _merge_sorted_arrays(starts, ends)
+        other_starts, other_ends = _merge_sorted_arrays(*other_coordinates[contig])
+        # Each interval can only intersect the other intervals in index range [first, last)
+        first = np.searchsorted(other_ends, starts, side="right")
+        last = np.searchsorted(other_starts, ends, side="left")
+        num_intersected = np.maximum(last - first, 0)
+        idxs = np.repeat(np.arange(len(starts)), num_intersected)
+        offsets = np.cumsum(num_intersected) - num_intersected
+        other_idxs = (
+            np.arange(len(idxs))
+            - np.repeat(offsets, num_intersected)
+            + np.repeat(first, num_intersected)
+        )
+        result[contig] = (
+            np.maximum(starts[idxs], other_starts[other_idxs]),
+            np.minimum(ends[idxs], other_ends[other_idxs]),
+        )
+    return _from_arrays(result)
+
+
+def complement_intervals(
+    intervals: Intervals, contig_lengths: Dict[str, int]
+) -> Intervals:
+    """
+    The positions of the contigs in `contig_lengths` not found in `intervals`
+    """
+    coordinates = _to_sorted_arrays(intervals, contig_lengths)
+    result = dict()
+    for contig, contig_length in contig_lengths.items():
+        starts, ends = _merge_sorted_arrays(
+            *coordinates.get(contig, (np.zeros(0, np.int64), np.zeros(0, np.int64)))
+        )
+        result[contig] = (
+            np.concatenate(([0], np.minimum(ends, contig_length))),
+            np.concatenate((np.maximum(starts, 0), [contig_length])),
+        )
+    return _from_arrays(result)
+
+
+def slop_intervals(
+    intervals: Intervals, size: int, contig_lengths: Dict[str, int]
+) -> Intervals:
+    """
+    Extends `intervals` by `size` positions on both sides, within their contig, and
+    merges them.
+    """
+    result = dict()
+    for contig, (starts, ends) in _to_sorted_arrays(intervals, contig_lengths).items():
+        result[contig] = _merge_sorted_arrays(
+            np.maximum(starts - size, 0),
+            np.minimum(ends + size, contig_lengths[contig]),
+        )
+    return _from_arrays(result)
+
+
+def tile_intervals(
+    intervals: Intervals, tile_size: int, contig_lengths: Dict[str, int]
+) -> Tiles:
+    """
+    Splits each interval into tiles of size `tile_size` (the last tile of an interval
+    can be smaller). Intervals without coordinates span their entire contig.
+    """
+    result = list()
+    for region_idx, interval in enumerate(intervals):
+        if interval.has_coordinates():
+            start, end = interval.start, interval.end
+        else:
+            start, end = 0, contig_lengths[interval.name]
+        tile_starts = range(start, max(end, start + 1), tile_size)
+        for i, tile_start in enumerate(tile_starts):
+            result.append(
+                Tile(
+                    interval.name,
+                    tile_start,
+                    min(tile_start + tile_size, end),
+                    region_idx=region_idx,
+                    first=i == 0,
+                    last=i == len(tile_starts) - 1,
+                )
+            )
+    return result
+
+
 def parse_region_string(region_string: str) -> Tuple[str, int, int]:
     contig, regs = region_string.split(REGION_DELIM1)
     start, stop = map(lambda e: int(e.replace(",", "")), regs.split(REGION_DELIM2))
@@ -0,0 +1,127 @@
+import heapq
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+from pysam import AlignmentFile
+
+from delfies.interval_utils import Tiles
+
+
+def get_num_cores() -> int:
+    """
+    Number of cores this process can run on
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_mapped_read_counts(alignment_fname: str) -> Dict[str, int]:
+    """
+    Number of mapped reads per contig, from the index of `alignment_fname`.
+    Empty if the index does not record them (e.g. CRAM indices).
+    """
+    with AlignmentFile(alignment_fname) as alignment_fstream:
+        try:
+            index_statistics = alignment_fstream.get_index_statistics()
+        except (AttributeError, ValueError):
+            return dict()
+    result = {stats.contig: stats.mapped for stats in index_statistics}
+    if sum(result.values()) == 0:
+        return dict()
+    return result
+
+
+def estimate_tile_loads(
+    tiles: Tiles, contig_lengths: Dict[str, int], mapped_read_counts: Dict[str, int]
+) -> np.ndarray:
+    """
+    Estimated number of reads in each tile, assuming reads are spread evenly along
+    contigs. Without read counts, tile lengths are used instead.
+    """
+    if len(mapped_read_counts) == 0:
+        return np.array([len(tile) for tile in tiles], dtype=float)
+    return np.array(
+        [
+            mapped_read_counts.get(tile.name, 0)
+            * len(tile)
+            / max(contig_lengths[tile.name], 1)
+            for tile in tiles
+        ],
+        dtype=float,
+    )
+
+
+@dataclass
+class ParallelismPlan:
+    """
+    `num_workers` processes, each decompressing alignments with `decode_threads`
+    htslib threads. `worker_loads` (in `load_unit`s) and `worker_tiles` are the
+    estimated work and the number of tiles of each worker.
+    """
+
+    num_workers: int
+    decode_threads: int
+    load_unit: str
+    worker_loads: List[float] = field(default_factory=list)
+    worker_tiles: List[int] = field(default_factory=list)
+
+    def describe(self) -> str:
+        num_cores = self.num_workers * self.decode_threads
+        lines = [
+            f"Parallelism plan ({num_cores} cores): {self.num_workers} worker(s) x "
+            f"{self.decode_threads} htslib decode thread(s), "
+            f"{sum(self.worker_tiles)} tile(s) to analyse"
+        ]
+        for worker_idx, (load, num_tiles) in enumerate(
+            zip(self.worker_loads, self.worker_tiles)
+        ):
+            lines.append(
+                f"  worker {worker_idx + 1}: {num_tiles} tile(s), "
+                f"~{round(load):,} {self.load_unit}"
+            )
+        return "\n".join(lines)
+
+
+def plan_parallelism(
+    tiles: Tiles,
+    contig_lengths: Dict[str, int],
+    mapped_read_counts: Dict[str, int],
+    num_cores: int,
+) -> ParallelismPlan:
+    return plan_parallelism_from_loads(
+        estimate_tile_loads(tiles, contig_lengths, mapped_read_counts),
+        num_cores,
+        load_unit="reads" if len(mapped_read_counts) > 0 else "bp",
+    )
+
+
+def plan_parallelism_from_loads(
+    tile_loads: np.ndarray, num_cores: int, load_unit: str
+) -> ParallelismPlan:
+    """
+    Runs one worker per tile with work (`tile_loads`, see `estimate_tile_loads`), up to
+    `num_cores` workers; cores left over decompress alignments, as htslib threads spread
+    evenly across workers.
+
+    Work per worker is estimated by assigning the tiles, largest first, to the least
+    loaded worker.
+    """
+    num_tiles_with_work = int(np.count_nonzero(tile_loads))
+    num_workers = max(min(num_cores, num_tiles_with_work), 1)
+    plan = ParallelismPlan(
+        num_workers=num_workers,
+        decode_threads=max(num_cores // num_workers, 1),
+        load_unit=load_unit,
+        worker_loads=[0.0] * num_workers,
+        worker_tiles=[0] * num_workers,
+    )
+    worker_heap = [(0.0, worker_idx) for worker_idx in range(num_workers)]
+    for tile_load in sorted(tile_loads.tolist(), reverse=True):
+        worker_load, worker_idx = heapq.heappop(worker_heap)
+        plan.worker_loads[worker_idx] = worker_load + tile_load
+        plan.worker_tiles[worker_idx] += 1
+        heapq.heappush(worker_heap, (worker_load + tile_load, worker_idx))
+    return plan
@@ -0,0 +1,107 @@
+"""
+Vectorized kernels on nucleotide sequences.
+
+Sequences can be given as `str`, or as any bytes-like object (`bytes`, `memoryview`,
+uint8 `np.ndarray`, e.g. a slice of a memory-mapped genome), which is used without
+copies.
+"""
+
+from typing import List, Union
+
+import numpy as np
+
+SequenceLike = Union[str, bytes, bytearray, memoryview, np.ndarray]
+
+INVALID_NUCLEOTIDE_CODE = 4
+_DECODED_NUCLEOTIDES = np.frombuffer(b"ACGTN", dtype=np.uint8)
+NUCLEOTIDE_CODES = np.full(256, INVALID_NUCLEOTIDE_CODE, dtype=np.uint8)
+for _code, _nucleotides in enumerate(["Aa", "Cc", "Gg", "Tt"]):
+    for _nucleotide in _nucleotides:
+        NUCLEOTIDE_CODES[ord(_nucleotide)] = _code
+
+# Also complements IUPAC ambiguity codes
+_NUCLEOTIDES = "ACGTNRYKMSWBDHV"
+_COMPLEMENTS = "TGCANYRMKSWVHDB"
+_REVCOMP_TRANSLATION = str.maketrans(
+    _NUCLEOTIDES + _NUCLEOTIDES.lower(), _COMPLEMENTS + _COMPLEMENTS
+)
+_REVCOMP_BYTES = np.arange(256, dtype=np.uint8)
+for _nucleotide, _complement in zip(_NUCLEOTIDES, _COMPLEMENTS):
+    _REVCOMP_BYTES[ord(_nucleotide)] = ord(_complement)
+    _REVCOMP_BYTES[ord(_nucleotide.lower())] = ord(_complement)
+
+
+def as_byte_array(sequence: SequenceLike) -> np.ndarray:
+    """
+    A uint8 view of `sequence`; only `str` sequences get copied (ASCII-encoded)
+    """
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    if isinstance(sequence, str):
+        sequence = sequence.encode("ascii")
+    return np.frombuffer(sequence, dtype=np.uint8)
+
+
+###########################
+## Reverse complementing ##
+###########################
+def rev_comp(seq: str) -> str:
+    """
+    Upper-case reverse complement of `seq`
+    """
+    return seq[::-1].translate(_REVCOMP_TRANSLATION)
+
+
+def rev_comp_bytes(sequence: SequenceLike) -> np.ndarray:
+    """
+    Upper-case reverse complement of `sequence`, as ASCII bytes (uint8 array)
+    """
+    return _REVCOMP_BYTES[as_byte_array(sequence)[::-1]]
+
+
+def batch_rev_comp(sequences: List[str]) -> List[str]:
+    """
+    Reverse complements of all `sequences`, computed in a single pass
+    """
+    if len(sequences) == 0:
+        return list()
+    return rev_comp("\n".join(sequences)).split("\n")[::-1]
+
+
+####################
+## 2-bit encoding ##
+####################
+def encode(sequence: SequenceLike) -> np.ndarray:
+    """
+    2-bit codes of the nucleotides of `sequence` (A: 0, C: 1, G: 2, T: 3), in a uint8
+    array. Non-ACGT nucleotides get code `INVALID_NUCLEOTIDE_CODE`.
+    """
+    return NUCLEOTIDE_CODES[as_byte_array(sequence)]
+
+
+def decode(codes: np.ndarray) -> str:
+    """
+    Inverse of `encode`; `INVALID_NUCLEOTIDE_CODE`s are decoded as 'N'
+    """
+    return _DECODED_NUCLEOTIDES[codes].tobytes().decode("ascii")
+
+
+def encode_kmer(kmer: str) -> int:
+    result = 0
+    for code in encode(kmer).tolist():
+        result = result * 4 + code
+    return result
+
+
+def rolling_kmer_codes(codes: np.ndarray, kmer_size: int) -> np.ndarray:
+    """
+    Integer codes of all k-mers of 2-bit encoded `codes` (see `encode`), i.e. their
+    rolling base-4 hash. K-mers containing non-ACGT nucleotides get code 4**kmer_size.
+    """
+    num_kmers = max(len(codes) - kmer_size + 1, 0)
+    result = np.zeros(num_kmers, dtype=np.int64)
+    for i in range(kmer_size):
+        result = result * 4 + (codes[i : i + num_kmers] & 3)
+    num_invalid = np.concatenate(([0], np.cumsum(codes == INVALID_NUCLEOTIDE_CODE)))
+    result[num_invalid[kmer_size:] != num_invalid[:num_kmers]] = 4**kmer_size
+    return result
@@ -1,11 +1,20 @@
-import re
+import hashlib
+import multiprocessing as mp
+import os
 from dataclasses import dataclass
+from pathlib import Path
 from random import choice as random_choice
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from pyfastx import Fasta
+import numpy as np
 
-from delfies import Orientation
-from delfies.interval_utils import Interval, Intervals
+from delfies import ID_DELIM, Orientation
+from delfies.genome_utils import Genome, get_genome_identity
+from delfies.interval_utils import Interval, Intervals, merge_intervals
+from delfies.seq_kernels import rev_comp
+
+GENOME_SCAN_CHUNK_SIZE = 10_000_000
 
 
 @dataclass
@@ -21,86 +30,311 @@ REVCOMP_TABLE_DNA = dict(A="T", C="G", G="C", T="A", N="N")
 NUCLEOTIDES = set(REVCOMP_TABLE_DNA.keys())
 
 
-def rev_comp(seq: str) -> str:
-    result = "".join([REVCOMP_TABLE_DNA[elem] for elem in seq[::-1].upper()])
-    return result
-
-
 def randomly_substitute(seq: str, num_mutations: int = 1) -> str:
     if num_mutations > len(seq):
         raise ValueError(
             f"{num_mutations} is greater than the length of the input sequence"
         )
     index_choices = list(range(len(seq)))
-    mutated_seq = seq
+    mutated_seq = list(seq)
     while num_mutations != 0:
         index_choice = random_choice(index_choices)
-        index_choices = [el for el in index_choices if el != index_choice]
+        index_choices.remove(index_choice)
         chosen_nucleotide = seq[index_choice]
         if chosen_nucleotide not in NUCLEOTIDES:
-            raise ValueError("Not a nucleotide: {chosen_nucleotide}")
+            raise ValueError(f"Not a nucleotide: {chosen_nucleotide}")
         possible_mutations = [el for el in NUCLEOTIDES if el != chosen_nucleotide]
-        chosen_mutation = random_choice(possible_mutations)
-        mutated_seq = (
-            mutated_seq[:index_choice]
-            + chosen_mutation
-            + mutated_seq[index_choice + 1 :]
-        )
+        mutated_seq[index_choice] = random_choice(possible_mutations)
         num_mutations -= 1
-    return mutated_seq
+    return "".join(mutated_seq)
 
 
 def cyclic_shifts(input_str: str):
+    doubled_str = input_str + input_str
+    return [doubled_str[i : i + len(input_str)] for i in range(len(input_str))]
+
+
+def find_overlapping_occurrences(query_sequence: str, sequence: str) -> List[int]:
     result = list()
-    for i in range(len(input_str)):
-        result.append(input_str[i:] + input_str[:i])
+    position = sequence.find(query_sequence)
+    while position != -1:
+        result.append(position)
+        position = sequence.find(query_sequence, position + 1)
     return result
 
 
-def find_all_occurrences_in_genome(
-    query_sequence: str,
-    genome_fname: str,
-    seq_regions: Intervals,
-    interval_window_size: int,
+class ExactOccurrenceFinder:
+    """
+    Finds exact occurrences of `query_sequence` (forward orientation), and of its reverse
+    complement (reverse orientation).
+
+    Occurrence finders (see also `telomere_utils.TelomereMatcher`) report the start
+    positions of occurrences of length `query_length`, found by looking at no more than
+    `search_length` nucleotides from the start position, and have a `cache_key`
+    identifying what they search for.
+    """
+
+    def __init__(self, query_sequence: str):
+        self.query_sequences = {
+            Orientation.forward: query_sequence,
+            Orientation.reverse: rev_comp(query_sequence),
+        }
+        self.query_length = len(query_sequence)
+        self.search_length = self.query_length
+        self.cache_key = query_sequence
+
+    def find_occurrences(self, sequence: str, orientation: Orientation) -> List[int]:
+        return find_overlapping_occurrences(self.query_sequences[orientation], sequence)
+
+
+# Per-process state of genome scanning pool workers, set by `init_genome_scan_worker`
+_worker_genome: Optional[Genome] = None
+_worker_occurrence_finder = None
+
+
+def init_genome_scan_worker(genome: Genome, occurrence_finder) -> None:
+    global _worker_genome, _worker_occurrence_finder
+    _worker_genome = genome
+    _worker_occurrence_finder = occurrence_finder
+
+
+def find_occurrences_in_chunk(
+    chunk: Interval,
+) -> Tuple[Interval, Dict[Orientation, List[int]]]:
+    """
+    Occurrences starting inside `chunk`. The chunk's sequence is extended by the
+    search length of the occurrence finder minus one, so that occurrences spanning the
+    chunk's end are found too.
+    """
+    chunk_sequence = _worker_genome.fetch(
+        chunk.name,
+        chunk.start,
+        chunk.end + _worker_occurrence_finder.search_length - 1,
+        uppercase=True,
+    )
+    result = dict()
+    for orientation in Orientation:
+        result[orientation] = [
+            chunk.start + relative_start
+            for relative_start in _worker_occurrence_finder.find_occurrences(
+                chunk_sequence, orientation
+            )
+            if relative_start < chunk.end - chunk.start
+        ]
+    return chunk, result
+
+
+def get_genome_scan_chunks(
+    contigs: Iterable[str], contig_lengths: Dict[str, int], chunk_size: int
 ) -> Intervals:
-    genome_fasta = Fasta(genome_fname, build_index=True, uppercase=True)
     result = list()
-    patterns = {
-        Orientation.forward: re.compile(query_sequence),
-        Orientation.reverse: re.compile(rev_comp(query_sequence)),
-    }
-    for seq_region in seq_regions:
+    for contig in contigs:
+        for chunk_start in range(0, contig_lengths[contig], chunk_size):
+            result.append(
+                Interval(
+                    contig,
+                    chunk_start,
+                    min(chunk_start + chunk_size, contig_lengths[contig]),
+                )
+            )
+    return result
+
+
+class GenomeOccurrences:
+    """
+    Positions of all occurrences (overlapping ones included) found by
+    `occurrence_finder` (e.g. an `ExactOccurrenceFinder`), in both orientations, in the
+    contigs of a genome. Each contig is scanned once, the first time it is queried.
+
+    Contigs are scanned in chunks of `chunk_size` nucleotides, so whole contig sequences
+    are never held in memory, and chunks are spread over `threads` processes.
+
+    If `cache_dir` is provided, occurrences are also stored there, in a file keyed by
+    the identity of the genome file (see `delfies.genome_utils.get_genome_identity`)
+    and by the finder's cache key, and reused across runs (e.g. when analysing several
+    BAMs aligned to the same genome).
+    """
+
+    def __init__(
+        self,
+        occurrence_finder,
+        genome: Genome,
+        cache_dir: Optional[str] = None,
+        threads: int = 1,
+        chunk_size: int = GENOME_SCAN_CHUNK_SIZE,
+    ):
+        self.occurrence_finder = occurrence_finder
+        self.genome = genome
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self._occurrences: Dict[Tuple[str, Orientation], np.ndarray] = dict()
+        self._num_cached_contigs = 0
+        self.cache_fname = None
+        if cache_dir is not None:
+            query_checksum = hashlib.sha256(
+                occurrence_finder.cache_key.encode()
+            ).hexdigest()
+            self.cache_fname = (
+                Path(cache_dir)
+                / f"{get_genome_identity(genome.genome_fname)}{ID_DELIM}{query_checksum}.npz"
+            )
+            self._load()
+
+    @property
+    def contigs(self) -> List[str]:
+        return sorted({contig for contig, _ in self._occurrences})
+
+    def scan(self, contigs: Iterable[str]) -> None:
+        """
+        Finds the occurrences in all of `contigs` not scanned yet
+        """
+        contigs_to_scan = list()
+        for contig in contigs:
+            if (contig, Orientation.forward) not in self._occurrences and (
+                contig not in contigs_to_scan
+            ):
+                contigs_to_scan.append(contig)
+        contig_lengths = {
+            contig: self.genome.get_length(contig) for contig in contigs_to_scan
+        }
+        chunks = get_genome_scan_chunks(
+            contigs_to_scan, contig_lengths, self.chunk_size
+        )
+        initargs = (self.genome, self.occurrence_finder)
+        if self.threads > 1 and len(chunks) > 1:
+            with mp.Pool(
+                processes=min(self.threads, len(chunks)),
+                initializer=init_genome_scan_worker,
+                initargs=initargs,
+            ) as pool:
+                chunk_occurrences = pool.map(find_occurrences_in_chunk, chunks)
+        else:
+            init_genome_scan_worker(*initargs)
+            chunk_occurrences = list(map(find_occurrences_in_chunk, chunks))
+        # Chunks are in contig and position order, so occurrences come out sorted
+        contig_occurrences = {
+            (contig, orientation): list()
+            for contig in contigs_to_scan
+            for orientation in Orientation
+        }
+        for chunk, occurrences in chunk_occurrences:
+            for orientation, starts in occurrences.items():
+                contig_occurrences[(chunk.name, orientation)].extend(starts)
+        for key, starts in contig_occurrences.items():
+            self._occurrences[key] = np.array(starts, dtype=np.int64)
+
+    def get_occurrences(self, contig: str, orientation: Orientation) -> np.ndarray:
+        """
+        Sorted start positions of all occurrences in `contig`
+        """
+        self.scan([contig])
+        return self._occurrences[(contig, orientation)]
+
+    def find_matches(
+        self, seq_region: Interval, orientation: Orientation
+    ) -> List[Tuple[int, int]]:
+        """
+        Non-overlapping occurrences fully inside `seq_region`, chosen leftmost first
+        (for exact occurrences, as found by a regular expression scan of the region's
+        sequence).
+        """
+        query_length = self.occurrence_finder.query_length
+        contig_length = self.genome.get_length(seq_region.name)
         if seq_region.has_coordinates():
-            relative_to_absolute = seq_region.start
-            target_seq = genome_fasta[seq_region.name][
-                seq_region.start : seq_region.end
-            ]
+            start, end = seq_region.start, min(seq_region.end, contig_length)
         else:
-            relative_to_absolute = 0
-            target_seq = genome_fasta[seq_region.name]
-        chrom_length = len(genome_fasta[seq_region.name])
-        for orientation, pattern in patterns.items():
-            match = None
-            for match in pattern.finditer(str(target_seq)):
-                new_interval = Interval(
-                    name=seq_region.name,
-                    start=max(
-                        0, match.start() + relative_to_absolute - interval_window_size
-                    ),
-                    end=min(
-                        chrom_length - 1,
-                        match.end() + relative_to_absolute - 1 + interval_window_size,
-                    ),
-                )
-                if len(result) == 0:
-                    result.append(new_interval)
-                else:
-                    if new_interval.overlaps_or_touches(result[-1]):
+            start, end = 0, contig_length
+        occurrences = self.get_occurrences(seq_region.name, orientation)
+        candidates = occurrences[
+            np.searchsorted(occurrences, start) : np.searchsorted(
+                occurrences, end - query_length, side="right"
+            )
+        ]
+        result = list()
+        next_start = start
+        for match_start in candidates.tolist():
+            if match_start >= next_start:
+                result.append((match_start, match_start + query_length))
+                next_start = match_start + query_length
+        return result
+
+    def find_intervals(
+        self, seq_regions: Intervals, interval_window_size: int
+    ) -> Intervals:
+        self.scan(seq_region.name for seq_region in seq_regions)
+        result = list()
+        for seq_region in seq_regions:
+            chrom_length = self.genome.get_length(seq_region.name)
+            for orientation in Orientation:
+                for match_start, match_end in self.find_matches(
+                    seq_region, orientation
+                ):
+                    new_interval = Interval(
+                        name=seq_region.name,
+                        start=max(0, match_start - interval_window_size),
+                        end=min(chrom_length - 1, match_end - 1 + interval_window_size),
+                    )
+                    if len(result) > 0 and new_interval.overlaps_or_touches(result[-1]):
                         result[-1].end = new_interval.end
                     else:
                         result.append(new_interval)
-            if match is not None and (
-                len(result) == 0 or not new_interval.overlaps_or_touches(result[-1])
-            ):
-                result.append(new_interval)
-    return result
+        self.save()
+        # Intervals around matches in either orientation, or in overlapping regions,
+        # can overlap
+        return merge_intervals(result)
+
+    def _load(self) -> None:
+        if not self.cache_fname.exists():
+            return
+        with np.load(self.cache_fname) as npz_data:
+            contigs = npz_data["contigs"].tolist()
+            for orientation in Orientation:
+                offsets = npz_data[f"offsets{ID_DELIM}{orientation.name}"]
+                occurrences = npz_data[f"occurrences{ID_DELIM}{orientation.name}"]
+                for i, contig in enumerate(contigs):
+                    self._occurrences[(contig, orientation)] = occurrences[
+                        offsets[i] : offsets[i + 1]
+                    ]
+        self._num_cached_contigs = len(contigs)
+
+    def save(self) -> None:
+        """
+        Writes the occurrences to the cache (if any) when new contigs were scanned.
+        Writes to a temporary file first, so that concurrent runs never read a
+        partially written cache.
+        """
+        contigs = self.contigs
+        if self.cache_fname is None or len(contigs) == self._num_cached_contigs:
+            return
+        arrays = {"contigs": np.array(contigs, dtype=str)}
+        for orientation in Orientation:
+            contig_occurrences = [
+                self._occurrences[(contig, orientation)] for contig in contigs
+            ]
+            arrays[f"offsets{ID_DELIM}{orientation.name}"] = np.concatenate(
+                ([0], np.cumsum(list(map(len, contig_occurrences))))
+            )
+            arrays[f"occurrences{ID_DELIM}{orientation.name}"] = np.concatenate(
+                contig_occurrences
+            )
+        self.cache_fname.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(
+            dir=self.cache_fname.parent, suffix=".npz", delete=False
+        ) as ofstream:
+            np.savez(ofstream, **arrays)
+        os.replace(ofstream.name, self.cache_fname)
+        self._num_cached_contigs = len(contigs)
+
+
+def find_all_occurrences_in_genome(
+    query_sequence: str,
+    genome: Genome,
+    seq_regions: Intervals,
+    interval_window_size: int,
+    cache_dir: Optional[str] = None,
+    threads: int = 1,
+) -> Intervals:
+    genome_occurrences = GenomeOccurrences(
+        ExactOccurrenceFinder(query_sequence), genome, cache_dir, threads
+    )
+    return genome_occurrences.find_intervals(seq_regions, interval_window_size)
@@ -1,13 +1,46 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
 from edlib import align as edlib_align
 
-from delfies import Orientation, PutativeBreakpoints
-from delfies.interval_utils import Interval
+from delfies import (
+    ID_DELIM,
+    BreakpointDetectionParams,
+    Orientation,
+    PutativeBreakpoints,
+)
+from delfies.genome_utils import Genome
+from delfies.interval_utils import Interval, IntervalLookup, Intervals
 from delfies.SAM_utils import SoftclippedRead
-from delfies.seq_utils import find_all_occurrences_in_genome
+from delfies.seq_kernels import encode, encode_kmer, rolling_kmer_codes
+from delfies.seq_utils import (
+    ExactOccurrenceFinder,
+    GenomeOccurrences,
+    cyclic_shifts,
+    find_overlapping_occurrences,
+)
 
 TELOMERE_SEQS = {
     "Nematoda": {Orientation.forward: "TTAGGC", Orientation.reverse: "GCCTAA"}
 }
+MAX_TELOMERE_KMER_SIZE = 10
+
+
+def get_softclipped_subsequence(
+    read: SoftclippedRead, orientation: Orientation, searched_length: int
+) -> str:
+    """
+    Returns up to `searched_length` nucleotides of `read`, starting at its softclip
+    and extending in the direction of `orientation`.
+    """
+    if orientation is Orientation.forward:
+        end = read.sc_query + searched_length
+        return read.sequence[read.sc_query : end]
+    else:
+        start = max(read.sc_query + 1 - searched_length, 0)
+        return read.sequence[start : read.sc_query + 1]
 
 
 def has_softclipped_telo_array(
@@ -21,44 +54,373 @@ def has_softclipped_telo_array(
     Note: we allow for the softclipped telo array to start with any cyclic shift
     of the telomeric repeat unit.
     """
-    telo_unit = telomere_seqs[orientation]
-    searched_telo_array = telo_unit * min_telo_array_size
-    subseq_clip_end = len(searched_telo_array) + len(telo_unit)
-    if orientation is Orientation.forward:
-        end = read.sc_query + subseq_clip_end
-        subseq = read.sequence[read.sc_query : end]
-    else:
-        start = max(read.sc_query + 1 - subseq_clip_end, 0)
-        subseq = read.sequence[start : read.sc_query + 1]
-    result = edlib_align(
-        searched_telo_array, subseq, mode="HW", task="distance", k=max_edit_distance
+    telomere_matcher = _get_telomere_matcher(
+        telomere_seqs[Orientation.forward],
+        telomere_seqs[Orientation.reverse],
+        min_telo_array_size,
+        max_edit_distance,
+    )
+    subseq = get_softclipped_subsequence(
+        read, orientation, telomere_matcher.window_size
+    )
+    return telomere_matcher.has_telo_array(subseq, orientation)
+
+
+#################################
+## Telomere k-mer prefiltering ##
+#################################
+def get_telomere_kmers(telo_unit: str, kmer_size: int) -> Set[str]:
+    """
+    All k-mers occurring in telomere arrays starting with any cyclic shift of `telo_unit`
+    """
+    num_repeats = kmer_size // len(telo_unit) + 1
+    return {(shift * num_repeats)[:kmer_size] for shift in cyclic_shifts(telo_unit)}
+
+
+def get_min_telomere_kmer_hits(
+    telo_array_length: int, kmer_size: int, max_edit_distance: int
+) -> int:
+    """
+    q-gram lemma: a telomere array of length `telo_array_length` has
+    `telo_array_length - kmer_size + 1` k-mers, and each edit destroys at most `kmer_size`
+    of them. A sequence matching the telomere array within `max_edit_distance` edits thus
+    contains at least this many telomeric k-mers.
+    """
+    return telo_array_length - kmer_size + 1 - kmer_size * max_edit_distance
+
+
+def choose_telomere_kmer_size(
+    telo_unit: str, telo_array_length: int, max_edit_distance: int
+) -> int:
+    """
+    Largest k-mer size (up to the telomere unit length) for which the k-mer screen can
+    reject any sequence at all; 0 if there is none.
+    """
+    for kmer_size in range(min(len(telo_unit), MAX_TELOMERE_KMER_SIZE), 1, -1):
+        if (
+            get_min_telomere_kmer_hits(telo_array_length, kmer_size, max_edit_distance)
+            > 0
+        ):
+            return kmer_size
+    return 0
+
+
+def get_telomere_kmer_table(telo_unit: str, kmer_size: int) -> np.ndarray:
+    """
+    Lookup table of telomeric k-mers, indexed by k-mer code (see `encode_kmers`).
+    The last entry is the code of k-mers containing non-ACGT nucleotides, which never match.
+    """
+    result = np.zeros(4**kmer_size + 1, dtype=bool)
+    for kmer in get_telomere_kmers(telo_unit, kmer_size):
+        result[encode_kmer(kmer)] = True
+    return result
+
+
+@dataclass
+class EncodedKmers:
+    codes: np.ndarray
+    sequence_starts: np.ndarray
+    sequence_ends: np.ndarray
+
+
+def encode_kmers(sequences: List[str], kmer_size: int) -> EncodedKmers:
+    """
+    Encodes all k-mers of all `sequences` at once, as integers.
+
+    The sequences are concatenated (separated by an 'N') and 2-bit encoded in vectorized form.
+    K-mers containing non-ACGT nucleotides get code 4**kmer_size. The k-mers of
+    sequence i are codes[sequence_starts[i]:sequence_ends[i]].
+    """
+    kmer_codes = rolling_kmer_codes(encode("N".join(sequences)), kmer_size)
+    num_kmers = len(kmer_codes)
+    sequence_lengths = np.fromiter(map(len, sequences), dtype=np.int64)
+    sequence_starts = np.concatenate(([0], np.cumsum(sequence_lengths + 1)[:-1]))
+    sequence_ends = np.minimum(sequence_starts + sequence_lengths, num_kmers)
+    sequence_starts = np.minimum(sequence_starts, num_kmers)
+    return EncodedKmers(kmer_codes, sequence_starts, sequence_ends)
+
+
+def count_kmer_hits(encoded_kmers: EncodedKmers, kmer_table: np.ndarray) -> np.ndarray:
+    kmer_hits = np.concatenate(([0], np.cumsum(kmer_table[encoded_kmers.codes])))
+    return (
+        kmer_hits[encoded_kmers.sequence_ends]
+        - kmer_hits[encoded_kmers.sequence_starts]
     )
-    found_telo_array = result["editDistance"] != -1
-    return found_telo_array
+
+
+def count_telomere_kmers(
+    sequences: List[str], telo_unit: str, kmer_size: int
+) -> np.ndarray:
+    """
+    Counts the positions in each of `sequences` at which a telomeric k-mer starts,
+    for all sequences at once.
+    """
+    return count_kmer_hits(
+        encode_kmers(sequences, kmer_size),
+        get_telomere_kmer_table(telo_unit, kmer_size),
+    )
+
+
+######################
+## Telomere matcher ##
+######################
+class TelomereMatcher:
+    """
+    Searches for telomere arrays of `min_telo_array_size` telomere units (up to
+    `max_edit_distance` edits, and starting with any cyclic shift of the telomere unit)
+    in forward and/or reverse orientation.
+
+    Everything that does not depend on the searched sequences (telomere arrays, search
+    window, telomeric k-mer tables) is computed once, when the matcher is built.
+    Sequences are searched in batches: they are encoded once, and screened against the
+    telomeric k-mers of each searched orientation (see `get_min_telomere_kmer_hits`);
+    only the sequences passing the screen are aligned to the telomere array using edlib.
+
+    A matcher is also an occurrence finder (see `seq_utils.ExactOccurrenceFinder`), for
+    searching genomes for telomere arrays with the same rules as in reads.
+    """
+
+    def __init__(
+        self,
+        telomere_seqs: Dict[Orientation, str],
+        min_telo_array_size: int,
+        max_edit_distance: int,
+    ):
+        telo_unit_length = len(telomere_seqs[Orientation.forward])
+        self.telo_arrays = {
+            orientation: telomere_seqs[orientation] * min_telo_array_size
+            for orientation in Orientation
+        }
+        self.telo_array_length = telo_unit_length * min_telo_array_size
+        self.window_size = self.telo_array_length + telo_unit_length
+        self.max_edit_distance = max_edit_distance
+        self.query_length = self.telo_array_length
+        self.search_length = self.window_size
+        self.cache_key = (
+            f"{self.telo_arrays[Orientation.forward]}{ID_DELIM}{max_edit_distance}"
+        )
+        self.kmer_size = choose_telomere_kmer_size(
+            telomere_seqs[Orientation.forward],
+            self.telo_array_length,
+            max_edit_distance,
+        )
+        self.min_kmer_hits = get_min_telomere_kmer_hits(
+            self.telo_array_length, self.kmer_size, max_edit_distance
+        )
+        self.kmer_tables = dict()
+        if self.kmer_size > 0:
+            self.kmer_tables = {
+                orientation: get_telomere_kmer_table(
+                    telomere_seqs[orientation], self.kmer_size
+                )
+                for orientation in Orientation
+            }
+
+    @classmethod
+    def from_detection_params(
+        cls,
+        detection_params: BreakpointDetectionParams,
+        min_telo_array_size: Optional[int] = None,
+    ) -> "TelomereMatcher":
+        """
+        Matchers are cached, so that a process builds each of its matchers only once.
+        """
+        if min_telo_array_size is None:
+            min_telo_array_size = detection_params.telo_array_size
+        return _get_telomere_matcher(
+            detection_params.telomere_seqs[Orientation.forward],
+            detection_params.telomere_seqs[Orientation.reverse],
+            min_telo_array_size,
+            detection_params.max_edit_distance,
+        )
+
+    def has_telo_array(self, sequence: str, orientation: Orientation) -> bool:
+        result = edlib_align(
+            self.telo_arrays[orientation],
+            sequence,
+            mode="HW",
+            task="distance",
+            k=self.max_edit_distance,
+        )
+        return result["editDistance"] != -1
+
+    def find_telo_arrays(
+        self,
+        sequences: List[str],
+        orientations: Iterable[Orientation] = tuple(Orientation),
+    ) -> Dict[Orientation, List[bool]]:
+        """
+        For each of `orientations`, whether each of `sequences` contains a telomere array
+        in that orientation.
+        """
+        if self.kmer_size > 0 and len(sequences) > 0:
+            encoded_kmers = encode_kmers(sequences, self.kmer_size)
+        result = dict()
+        for orientation in orientations:
+            if self.kmer_size > 0 and len(sequences) > 0:
+                passes_screen = (
+                    count_kmer_hits(encoded_kmers, self.kmer_tables[orientation])
+                    >= self.min_kmer_hits
+                )
+            else:
+                passes_screen = [True] * len(sequences)
+            result[orientation] = [
+                bool(sequence_passes_screen)
+                and self.has_telo_array(sequence, orientation)
+                for sequence, sequence_passes_screen in zip(sequences, passes_screen)
+            ]
+        return result
+
+    def find_softclipped_telo_arrays(
+        self,
+        reads: List[SoftclippedRead],
+        softclip_orientations: List[Orientation],
+        searched_orientations: Iterable[Orientation] = tuple(Orientation),
+    ) -> Dict[Orientation, List[bool]]:
+        """
+        Searches the softclip of each of `reads`, in the direction of its softclip
+        orientation, for telomere arrays in each of `searched_orientations`.
+        """
+        subseqs = [
+            get_softclipped_subsequence(read, softclip_orientation, self.window_size)
+            for read, softclip_orientation in zip(reads, softclip_orientations)
+        ]
+        return self.find_telo_arrays(subseqs, searched_orientations)
+
+    def find_occurrences(self, sequence: str, orientation: Orientation) -> List[int]:
+        """
+        Positions p of `sequence` such that sequence[p : p + window_size] contains a
+        telomere array in `orientation`, as searched in read softclips (see
+        `find_softclipped_telo_arrays`). Windows get truncated at the end of `sequence`,
+        and must contain at least `telo_array_length` nucleotides.
+
+        The telomeric k-mers of all windows are counted at once, from cumulative k-mer
+        hits along `sequence`. Windows passing the k-mer screen and containing an exact
+        copy of the telomere array need no alignment; only the others are aligned.
+        """
+        num_positions = len(sequence) - self.telo_array_length + 1
+        if num_positions <= 0:
+            return list()
+        window_starts = np.arange(num_positions)
+        window_ends = np.minimum(window_starts + self.window_size, len(sequence))
+        if self.kmer_size > 0:
+            encoded_kmers = encode_kmers([sequence], self.kmer_size)
+            kmer_hits = np.concatenate(
+                ([0], np.cumsum(self.kmer_tables[orientation][encoded_kmers.codes]))
+            )
+            num_window_hits = (
+                kmer_hits[window_ends - self.kmer_size + 1] - kmer_hits[window_starts]
+            )
+            candidates = np.flatnonzero(num_window_hits >= self.min_kmer_hits)
+        else:
+            candidates = window_starts
+        exact_starts = np.array(
+            find_overlapping_occurrences(self.telo_arrays[orientation], sequence),
+            dtype=np.int64,
+        )
+        # A window contains an exact copy if one starts inside it and fits in it
+        next_exact_idx = np.searchsorted(exact_starts, candidates)
+        has_exact_copy = np.zeros(len(candidates), dtype=bool)
+        has_next = next_exact_idx < len(exact_starts)
+        has_exact_copy[has_next] = (
+            exact_starts[next_exact_idx[has_next]]
+            <= window_ends[candidates[has_next]] - self.telo_array_length
+        )
+        result = candidates[has_exact_copy].tolist()
+        for window_start in candidates[~has_exact_copy].tolist():
+            window_sequence = sequence[window_start : window_ends[window_start]]
+            if self.has_telo_array(window_sequence, orientation):
+                result.append(window_start)
+        return sorted(result)
+
+    def get_genome_occurrences(
+        self,
+        genome: Genome,
+        cache_dir: Optional[str] = None,
+        threads: int = 1,
+        approximate: bool = False,
+    ) -> GenomeOccurrences:
+        """
+        `approximate`: whether to search the genome with the same rules as reads
+        (see `find_occurrences`), rather than for exact copies of the telomere array
+        """
+        if approximate:
+            occurrence_finder = self
+        else:
+            occurrence_finder = ExactOccurrenceFinder(
+                self.telo_arrays[Orientation.forward]
+            )
+        return GenomeOccurrences(occurrence_finder, genome, cache_dir, threads)
+
+    def find_in_genome(
+        self, genome_occurrences: GenomeOccurrences, seq_regions: Intervals
+    ) -> Intervals:
+        """
+        Intervals of `seq_regions` containing a telomere array in either orientation
+        (`genome_occurrences`, see `get_genome_occurrences`), extended by the length of
+        the telomere array on each side.
+        """
+        return genome_occurrences.find_intervals(seq_regions, self.telo_array_length)
+
+
+@lru_cache(maxsize=None)
+def _get_telomere_matcher(
+    telo_forward_seq: str,
+    telo_reverse_seq: str,
+    min_telo_array_size: int,
+    max_edit_distance: int,
+) -> TelomereMatcher:
+    telomere_seqs = {
+        Orientation.forward: telo_forward_seq,
+        Orientation.reverse: telo_reverse_seq,
+    }
+    return TelomereMatcher(telomere_seqs, min_telo_array_size, max_edit_distance)
 
 
 def remove_breakpoints_in_telomere_arrays(
-    genome_fname: str,
-    searched_telo_array: str,
-    interval_window_size: int,
+    genome_occurrences: GenomeOccurrences,
+    telomere_matcher: TelomereMatcher,
     putative_breakpoints: PutativeBreakpoints,
 ) -> PutativeBreakpoints:
+    """
+    Removes the breakpoints with a telomere array in either orientation
+    (`genome_occurrences`, see `TelomereMatcher.get_genome_occurrences`) lying fully
+    within `2 * telo_array_length` of the breakpoint.
+
+    The telomere arrays of all the contigs with a breakpoint are found once, and their
+    start positions indexed: a telomere array lies fully within a region iff it starts
+    between the region's start and the region's end minus the telomere array length,
+    so each breakpoint is a single overlap query.
+    """
+    contigs = {
+        putative_breakpoint.focus.contig for putative_breakpoint in putative_breakpoints
+    }
+    genome_occurrences.scan(contigs)
+    telomere_array_starts = IntervalLookup(
+        [
+            Interval(contig, occurrence_start, occurrence_start + 1)
+            for contig in contigs
+            for orientation in Orientation
+            for occurrence_start in genome_occurrences.get_occurrences(
+                contig, orientation
+            ).tolist()
+        ]
+    )
+    genome_occurrences.save()
+    contig_lengths = {
+        contig: genome_occurrences.genome.get_length(contig) for contig in contigs
+    }
     result = list()
-    telo_array_size = len(searched_telo_array)
+    telo_array_length = telomere_matcher.telo_array_length
+    margin = 2 * telo_array_length
     for putative_breakpoint in putative_breakpoints:
-        region_to_search = Interval(
-            putative_breakpoint.focus.contig,
-            max(
-                putative_breakpoint.interval[0]
-                - telo_array_size
-                - interval_window_size,
-                0,
-            ),
-            putative_breakpoint.interval[1] + telo_array_size + interval_window_size,
-        )
-        telomere_arrays_overlapping_breakpoint = find_all_occurrences_in_genome(
-            searched_telo_array, genome_fname, [region_to_search], interval_window_size
+        contig = putative_breakpoint.focus.contig
+        search_start = max(putative_breakpoint.interval[0] - margin, 0)
+        search_end = min(
+            putative_breakpoint.interval[1] + margin, contig_lengths[contig]
         )
-        if len(telomere_arrays_overlapping_breakpoint) == 0:
+        if not telomere_array_starts.overlaps(
+            contig, search_start, search_end - telo_array_length + 1
+        ):
             result.append(putative_breakpoint)
     return result
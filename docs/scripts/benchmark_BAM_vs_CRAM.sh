@@ -0,0 +1,46 @@
+set -e
+
+# Compares delfies' throughput on the same alignments stored as BAM and as CRAM,
+# for several numbers of htslib decompression threads ('--decode_threads').
+
+GENOME_FASTA=$1
+BAM=$2
+NUM_THREADS=$3
+OUTPUT_DIR=$4
+
+usage() {
+    echo "Usage: $0 genome_fasta alignment_bam num_threads output_dir"
+    exit 0
+}
+
+if [[ $# != 4 ]]; then usage; fi
+
+mkdir -p "${OUTPUT_DIR}"
+
+tmp_genome="${OUTPUT_DIR}/genome.fa"
+CRAM="${OUTPUT_DIR}/alignments.cram"
+timings="${OUTPUT_DIR}/timings.tsv"
+
+# CRAM encoding requires a faidx-indexed (uncompressed or bgzipped) reference
+gzip -dcf "${GENOME_FASTA}" > "${tmp_genome}"
+samtools faidx "${tmp_genome}"
+samtools view -@ ${NUM_THREADS} -C -T "${tmp_genome}" -o "${CRAM}" "${BAM}"
+samtools index -@ ${NUM_THREADS} "${CRAM}"
+
+# Builds the genome's caches once, so that they are not timed below
+delfies --threads ${NUM_THREADS} "${GENOME_FASTA}" "${CRAM}" "${OUTPUT_DIR}/warmup" > /dev/null
+
+echo -e "format\tdecode_threads\twall_clock_seconds" > "${timings}"
+for alignments in "${BAM}" "${CRAM}"; do
+    for decode_threads in 1 2 4; do
+        start=$(date +%s.%N)
+        delfies --threads ${NUM_THREADS} --decode_threads ${decode_threads} \
+            "${GENOME_FASTA}" "${alignments}" "${OUTPUT_DIR}/run" > /dev/null
+        end=$(date +%s.%N)
+        echo -e "${alignments##*.}\t${decode_threads}\t$(echo "${end} - ${start}" | bc)" >> "${timings}"
+    done
+done
+column -t "${timings}"
+
+# Remove tmp files
+rm -r "${tmp_genome}"* "${OUTPUT_DIR}/warmup" "${OUTPUT_DIR}/run"
@@ -1,14 +1,16 @@
+from itertools import count
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
-from pyfastx import Fasta
+from delfies.genome_utils import open_genome
 
 
 class ClassWithTempFasta:
     @classmethod
     def setup_class(cls):
         cls.temp_dir = TemporaryDirectory()
-        cls.temp_fasta = Path(cls.temp_dir.name) / "temp.fasta"
+        # Each fasta gets its own file, so that each gets its own genome cache
+        cls.fasta_ids = count()
 
     @classmethod
     def teardown_class(cls):
@@ -16,9 +18,10 @@ class ClassWithTempFasta:
 
     @classmethod
     def make_fasta(self, input_string, as_handle=False):
-        with self.temp_fasta.open("w") as ofstream:
+        temp_fasta = Path(self.temp_dir.name) / f"temp_{next(self.fasta_ids)}.fasta"
+        with temp_fasta.open("w") as ofstream:
             ofstream.write(input_string)
         if as_handle:
-            return Fasta(str(self.temp_fasta), build_index=True)
+            return open_genome(str(temp_fasta))
         else:
-            return str(self.temp_fasta)
+            return str(temp_fasta)
@@ -1,11 +1,24 @@
+from tempfile import TemporaryDirectory
+
 import pytest
-from pysam import CMATCH, CSOFT_CLIP, AlignedSegment
+from pysam import (
+    CDEL,
+    CMATCH,
+    CREF_SKIP,
+    CSOFT_CLIP,
+    AlignedSegment,
+    AlignmentFile,
+    AlignmentHeader,
+)
+from pysam import index as pysam_index
 
 from delfies import Orientation
 from delfies.SAM_utils import (
     FLAGS,
+    ReadCoverage,
     SoftclippedRead,
     find_softclip_at_extremity,
+    has_softclip_of_min_length,
     read_flag_matches,
 )
 
@@ -110,3 +123,77 @@ class TestSoftclipDetection:
             )
             is None
         )
+
+
+class TestSoftclipLengthGate:
+    def test_read_no_softclips_fails_gate(self, pysam_basic_read):
+        assert not has_softclip_of_min_length(pysam_basic_read, 1)
+
+    def test_gate_applies_min_softclip_length(self, pysam_read_with_3prime_softclips):
+        sc_length = len(DEFAULT_SOFTCLIPPED_SEQ)
+        assert has_softclip_of_min_length(pysam_read_with_3prime_softclips, sc_length)
+        assert not has_softclip_of_min_length(
+            pysam_read_with_3prime_softclips, sc_length + 1
+        )
+
+    def test_short_softclips_are_not_returned(self, pysam_read_with_5prime_softclips):
+        sc_length = len(DEFAULT_SOFTCLIPPED_SEQ)
+        assert (
+            find_softclip_at_extremity(
+                pysam_read_with_5prime_softclips, Orientation.reverse, sc_length
+            )
+            is not None
+        )
+        assert (
+            find_softclip_at_extremity(
+                pysam_read_with_5prime_softclips, Orientation.reverse, sc_length + 1
+            )
+            is None
+        )
+
+
+class TestReadCoverage:
+    def test_read_depths_match_pileup(self):
+        header = AlignmentHeader.from_dict(
+            {"HD": {"VN": "1.0"}, "SQ": [{"LN": 1000, "SN": "chr1"}]}
+        )
+        cigars = [
+            [(CMATCH, 30)],
+            [(CSOFT_CLIP, 10), (CMATCH, 20)],
+            [(CMATCH, 10), (CDEL, 5), (CMATCH, 10)],
+            [(CMATCH, 10), (CREF_SKIP, 20), (CMATCH, 10), (CSOFT_CLIP, 5)],
+        ]
+        reads = list()
+        for i, read_start in enumerate(range(100, 180, 4)):
+            read = AlignedSegment(header)
+            read.query_name = f"read_{i}"
+            read.reference_id = 0
+            read.reference_start = read_start
+            read.cigartuples = cigars[i % len(cigars)]
+            read.query_sequence = "A" * read.infer_query_length()
+            read.query_qualities = [2] * read.infer_query_length()
+            reads.append(read)
+        read_coverage = ReadCoverage()
+        for read in reads:
+            read_coverage.add(read)
+        positions = list(range(90, 230))
+        read_depths = dict(zip(positions, read_coverage.get_read_depths(positions)))
+        with TemporaryDirectory() as tmp_dirname:
+            BAM_fname = f"{tmp_dirname}/reads.bam"
+            with AlignmentFile(BAM_fname, "wb", header=header) as ofstream:
+                for read in reads:
+                    ofstream.write(read)
+            pysam_index(BAM_fname)
+            with AlignmentFile(BAM_fname) as ifstream:
+                expected = {
+                    column.reference_pos: column.nsegments
+                    for column in ifstream.pileup("chr1", 90, 230, truncate=True)
+                }
+        assert expected == {
+            position: read_depth
+            for position, read_depth in read_depths.items()
+            if read_depth > 0
+        }
+
+    def test_no_reads_have_no_depth(self):
+        assert list(ReadCoverage().get_read_depths([0, 10])) == [0, 0]
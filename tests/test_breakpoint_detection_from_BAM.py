@@ -1,16 +1,33 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from io import StringIO
 from pathlib import Path
 from random import choice as rand_choice
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 import pytest
 from pysam import AlignedSegment, AlignmentFile
 from pysam import index as pysam_index
 from pysam import qualitystring_to_array
+from pysam import view as pysam_view
 
 from delfies import BreakpointType, Orientation
-from delfies.breakpoint_foci import BreakpointDetectionParams, find_breakpoint_foci
-from delfies.interval_utils import Interval
+from delfies.breakpoint_foci import (
+    BreakpointDetectionParams,
+    RawBreakpointFoci,
+    call_breakpoints_from_foci,
+    filter_foci_by_support,
+    find_breakpoint_foci,
+    find_breakpoint_foci_in_worker,
+    get_foci_shard_fname,
+    get_softclip_cache_dirname,
+    init_breakpoint_detection_worker,
+    merge_foci_shards,
+    scan_breakpoint_foci,
+    write_foci_shards,
+)
+from delfies.foci_table import FOCI_COLUMN_DTYPES, FociTable
+from delfies.genome_utils import Genome
+from delfies.interval_utils import Interval, tile_intervals
 from delfies.SAM_utils import DEFAULT_MIN_MAPQ, DEFAULT_READ_FILTER_FLAG
 from delfies.seq_utils import randomly_substitute, rev_comp
 from delfies.telomere_utils import TELOMERE_SEQS
@@ -129,13 +146,13 @@ def detection_params():
         read_filter_flag=DEFAULT_READ_FILTER_FLAG,
         min_supporting_reads=10,
         keep_telomeric_breakpoints=False,
-        breakpoint_type=BreakpointType.S2G,
+        breakpoint_types=[BreakpointType.S2G],
     )
 
 
 def test_forward_breakpoint_S2G(read_generator, genome_interval, detection_params):
     detection_params.bam_fname = read_generator.write_BAM()
-    foci = find_breakpoint_foci(detection_params, genome_interval)
+    foci = find_breakpoint_foci(detection_params, genome_interval)[BreakpointType.S2G]
     filtered_foci = [
         elem for elem in foci if elem.start == EXPECTED_BREAKPOINT_POSITION
     ]
@@ -149,3 +166,220 @@ def test_forward_breakpoint_S2G(read_generator, genome_interval, detection_param
         breakpoint_focus.num_supporting_reads__forward
         == DEFAULT_NUM_TELO_CONTAINING_READS
     )
+
+
+def test_tiled_breakpoint_detection_matches_untiled(read_generator, detection_params):
+    detection_params.bam_fname = read_generator.write_BAM()
+    detection_params.min_supporting_reads = 1
+    seq_region = Interval(
+        DEFAULT_CHROM,
+        EXPECTED_BREAKPOINT_POSITION - 20,
+        EXPECTED_BREAKPOINT_POSITION + 20,
+    )
+    untiled_foci = find_breakpoint_foci(detection_params, seq_region)[
+        BreakpointType.S2G
+    ]
+    expected_foci = StringIO()
+    untiled_foci.write_tsv(expected_foci, with_header=True)
+    # Breakpoint position falls on a tile boundary, and the read depth recorded
+    # around it spans several tiles for the smallest tile sizes
+    for tile_size in [1, 3, 10]:
+        tiles = tile_intervals([seq_region], tile_size, {})
+        with TemporaryDirectory() as shards_dirname:
+            shard_fnames = list()
+            for tile_idx, tile in enumerate(tiles):
+                tile_foci = find_breakpoint_foci(detection_params, tile)
+                write_foci_shards(tile_foci, shards_dirname, tile_idx)
+                shard_fnames.append(
+                    get_foci_shard_fname(shards_dirname, BreakpointType.S2G, tile_idx)
+                )
+            tiled_foci = StringIO()
+            merge_foci_shards(tiles, shard_fnames, tiled_foci)
+        assert tiled_foci.getvalue() == expected_foci.getvalue()
+
+
+def test_worker_streams_foci_to_shards(
+    read_generator, genome_interval, detection_params
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    expected_foci = find_breakpoint_foci(detection_params, genome_interval)
+    with TemporaryDirectory() as shards_dirname:
+        detection_params.foci_shards_dirname = shards_dirname
+        init_breakpoint_detection_worker([detection_params])
+        for task_idx in range(2):
+            sample_idx, returned_idx, tile_clusters = find_breakpoint_foci_in_worker(
+                (0, task_idx, genome_interval)
+            )
+            assert sample_idx == 0
+            assert returned_idx == task_idx
+            # The breakpoint lies far from the region's edges, so is resolved in the worker
+            putative_breakpoints = tile_clusters[
+                BreakpointType.S2G
+            ].putative_breakpoints
+            assert [e.focus.start for e in putative_breakpoints] == [
+                EXPECTED_BREAKPOINT_POSITION
+            ]
+            shard_fname = get_foci_shard_fname(
+                shards_dirname, BreakpointType.S2G, task_idx
+            )
+            assert list(FociTable.load(shard_fname)) == list(
+                expected_foci[BreakpointType.S2G]
+            )
+
+
+def test_worker_analyses_tiles_of_several_samples(
+    read_generator, genome_interval, detection_params
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    other_read_generator = TeloContainingReadGenerator(num_telo_containing_reads=20)
+    other_detection_params = replace(
+        detection_params, bam_fname=other_read_generator.write_BAM()
+    )
+    with TemporaryDirectory() as shards_dirname:
+        for sample_idx, sample_detection_params in enumerate(
+            [detection_params, other_detection_params]
+        ):
+            sample_detection_params.foci_shards_dirname = (
+                f"{shards_dirname}/{sample_idx}"
+            )
+            Path(sample_detection_params.foci_shards_dirname).mkdir()
+        init_breakpoint_detection_worker([detection_params, other_detection_params])
+        for sample_idx, num_telo_containing_reads in [
+            (1, 20),
+            (0, DEFAULT_NUM_TELO_CONTAINING_READS),
+        ]:
+            returned_sample_idx, _, tile_clusters = find_breakpoint_foci_in_worker(
+                (sample_idx, 0, genome_interval)
+            )
+            assert returned_sample_idx == sample_idx
+            putative_breakpoints = tile_clusters[
+                BreakpointType.S2G
+            ].putative_breakpoints
+            assert [e.max_value for e in putative_breakpoints] == [
+                num_telo_containing_reads
+            ]
+
+
+def test_breakpoint_detection_from_CRAM_matches_BAM(
+    read_generator, genome_interval, detection_params
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    expected_foci = find_breakpoint_foci(detection_params, genome_interval)
+    with TemporaryDirectory() as temp_dirname:
+        genome_fname = Path(temp_dirname) / "genome.fasta"
+        genome_fname.write_text(
+            f">{DEFAULT_CHROM}\n{'A' * int(DEFAULT_CHROM_LENGTH)}\n"
+        )
+        reference_fname = Genome(genome_fname).get_reference_fname()
+        CRAM_fname = str(Path(temp_dirname) / "reads.cram")
+        pysam_view(
+            "-C",
+            "-T",
+            reference_fname,
+            "-o",
+            CRAM_fname,
+            detection_params.bam_fname,
+            catch_stdout=False,
+        )
+        pysam_index(CRAM_fname)
+        detection_params.bam_fname = CRAM_fname
+        detection_params.reference_fname = reference_fname
+        detection_params.decode_threads = 2
+        foci = find_breakpoint_foci(detection_params, genome_interval)
+    assert list(foci[BreakpointType.S2G]) == list(expected_foci[BreakpointType.S2G])
+
+
+class TestRawBreakpointFoci:
+    def test_filtering_raw_foci_matches_detection(
+        self, read_generator, genome_interval, detection_params
+    ):
+        detection_params.bam_fname = read_generator.write_BAM()
+        raw_foci = scan_breakpoint_foci(
+            detection_params, genome_interval, min_supporting_reads=1
+        )
+        with TemporaryDirectory() as temp_dirname:
+            raw_foci_fname = Path(temp_dirname) / "raw_foci.npz"
+            raw_foci.save(raw_foci_fname)
+            loaded_raw_foci = RawBreakpointFoci.load(raw_foci_fname)
+        assert loaded_raw_foci.depth_positions.dtype == FOCI_COLUMN_DTYPES["start"]
+        assert loaded_raw_foci.read_depths.dtype == FOCI_COLUMN_DTYPES["read_depth"]
+        for min_supporting_reads in [1, 10, DEFAULT_NUM_TELO_CONTAINING_READS + 1]:
+            detection_params.min_supporting_reads = min_supporting_reads
+            expected_foci = find_breakpoint_foci(detection_params, genome_interval)
+            filtered_foci = loaded_raw_foci.filter_by_support(min_supporting_reads)
+            assert list(filtered_foci[BreakpointType.S2G]) == list(
+                expected_foci[BreakpointType.S2G]
+            )
+
+    def test_cannot_filter_below_recorded_support(
+        self, read_generator, genome_interval, detection_params
+    ):
+        detection_params.bam_fname = read_generator.write_BAM()
+        raw_foci = scan_breakpoint_foci(detection_params, genome_interval)
+        with pytest.raises(ValueError):
+            raw_foci.filter_by_support(detection_params.min_supporting_reads - 1)
+
+    def test_softclip_cache_ignores_post_scan_parameters(
+        self, read_generator, detection_params
+    ):
+        detection_params.bam_fname = read_generator.write_BAM()
+        tiles = tile_intervals([Interval(DEFAULT_CHROM, 0, 2000)], 1000, {})
+        cache_dirname = get_softclip_cache_dirname("cache", detection_params, tiles)
+        detection_params.min_supporting_reads += 1
+        detection_params.clustering_threshold += 1
+        assert (
+            get_softclip_cache_dirname("cache", detection_params, tiles)
+            == cache_dirname
+        )
+        detection_params.min_mapq += 1
+        assert (
+            get_softclip_cache_dirname("cache", detection_params, tiles)
+            != cache_dirname
+        )
+
+    def test_softclip_cache_depends_on_keeping_telomeric_breakpoints(
+        self, read_generator, detection_params
+    ):
+        detection_params.bam_fname = read_generator.write_BAM()
+        tiles = tile_intervals([Interval(DEFAULT_CHROM, 0, 2000)], 1000, {})
+        cache_dirnames = set()
+        for keep_telomeric_breakpoints in [False, True]:
+            detection_params.keep_telomeric_breakpoints = keep_telomeric_breakpoints
+            cache_dirnames.add(
+                get_softclip_cache_dirname("cache", detection_params, tiles)
+            )
+        assert len(cache_dirnames) == 2
+
+
+class TestReclustering:
+    def test_filtering_foci_by_support_matches_detection(
+        self, read_generator, genome_interval, detection_params
+    ):
+        detection_params.bam_fname = read_generator.write_BAM()
+        detection_params.min_supporting_reads = 1
+        foci = find_breakpoint_foci(detection_params, genome_interval)[
+            BreakpointType.S2G
+        ]
+        for min_supporting_reads in [1, 10, DEFAULT_NUM_TELO_CONTAINING_READS + 1]:
+            detection_params.min_supporting_reads = min_supporting_reads
+            expected_foci = find_breakpoint_foci(detection_params, genome_interval)
+            filtered_foci = filter_foci_by_support(foci, min_supporting_reads)
+            assert list(filtered_foci) == list(expected_foci[BreakpointType.S2G])
+
+    def test_call_breakpoints_from_foci(
+        self, read_generator, genome_interval, detection_params
+    ):
+        detection_params.bam_fname = read_generator.write_BAM()
+        detection_params.min_supporting_reads = 1
+        foci = find_breakpoint_foci(detection_params, genome_interval)[
+            BreakpointType.S2G
+        ]
+        putative_breakpoints = call_breakpoints_from_foci(foci, 10, 1)
+        assert [elem.focus.start for elem in putative_breakpoints] == [
+            EXPECTED_BREAKPOINT_POSITION
+        ]
+        assert putative_breakpoints[0].breakpoint_type == BreakpointType.S2G
+        assert (
+            call_breakpoints_from_foci(foci, DEFAULT_NUM_TELO_CONTAINING_READS + 1, 1)
+            == []
+        )
@@ -1,16 +1,27 @@
 import pytest
 from pysam import AlignedSegment, AlignmentHeader
 
-from delfies import BreakpointDetectionParams, BreakpointType, PutativeBreakpoint
+from delfies import (
+    BreakpointDetectionParams,
+    BreakpointFocus,
+    BreakpointType,
+    PutativeBreakpoint,
+    all_breakpoint_types,
+)
 from delfies.breakpoint_foci import (
     READ_SUPPORTS,
     FociWindow,
     Orientation,
     cluster_breakpoint_foci,
+    cluster_tile_foci,
+    get_foci_in_regions,
+    get_min_softclip_length,
+    get_stitching_regions,
     record_softclips,
-    setup_breakpoint_tents,
+    stitch_tile_clusters,
 )
-from delfies.interval_utils import Interval
+from delfies.foci_table import FociTable, SoftclipPositions
+from delfies.interval_utils import Interval, IntervalLookup, tile_intervals
 from delfies.SAM_utils import DEFAULT_MIN_MAPQ, DEFAULT_READ_FILTER_FLAG
 from delfies.seq_utils import rev_comp
 from delfies.telomere_utils import TELOMERE_SEQS
@@ -18,37 +29,39 @@ from delfies.telomere_utils import TELOMERE_SEQS
 
 @pytest.fixture
 def breakpoint_focus():
-    tents = setup_breakpoint_tents()
-    new_tent = tents.new()
-    new_tent.update(contig="test_contig", start=2, end=200)
-    new_tent[f"{READ_SUPPORTS[0]}"] = 15
-    new_tent[f"{READ_SUPPORTS[1]}"] = 20
-    return new_tent
+    return BreakpointFocus(
+        contig="test_contig",
+        start=2,
+        end=200,
+        num_supporting_reads__forward=15,
+        num_supporting_reads__reverse=20,
+    )
 
 
 @pytest.fixture
 def multiple_breakpoint_foci(breakpoint_focus):
-    tents = setup_breakpoint_tents()
-    tents.add(breakpoint_focus)
-    new_tent = tents.new()
-    new_tent.update(contig="test_contig", start=0, end=202)
-    new_tent[f"{READ_SUPPORTS[0]}"] = 15
-    tents.add(new_tent)
-    new_tent = tents.new()
-    new_tent.update(contig="test_contig", start=2000, end=2005)
-    new_tent[f"{READ_SUPPORTS[0]}"] = 15
-    tents.add(new_tent)
-    return tents
+    return [
+        breakpoint_focus,
+        BreakpointFocus(
+            contig="test_contig", start=0, end=202, num_supporting_reads__forward=15
+        ),
+        BreakpointFocus(
+            contig="test_contig", start=2000, end=2005, num_supporting_reads__forward=15
+        ),
+    ]
 
 
 @pytest.fixture
 def focus_window():
-    tents = setup_breakpoint_tents()
-    new_tent = tents.new()
-    new_tent.update(start=205, end=210)
-    new_tent[f"{READ_SUPPORTS[0]}"] = 2
-    new_tent[f"{READ_SUPPORTS[1]}"] = 200
-    return FociWindow(new_tent)
+    return FociWindow(
+        BreakpointFocus(
+            contig="test_contig",
+            start=205,
+            end=210,
+            num_supporting_reads__forward=2,
+            num_supporting_reads__reverse=200,
+        )
+    )
 
 
 @pytest.fixture
@@ -147,7 +160,7 @@ class TestFociWindow:
         )
 
     def test_find_peak_softclip_focus_forward_max(self, breakpoint_focus, focus_window):
-        breakpoint_focus[f"{READ_SUPPORTS[0]}"] = 400
+        breakpoint_focus.num_supporting_reads__forward = 400
         focus_window.add(breakpoint_focus)
         max_focus = focus_window.find_peak_softclip_focus()
         assert max_focus == PutativeBreakpoint(
@@ -165,8 +178,8 @@ class TestBreakpointClustering:
         self, multiple_breakpoint_foci
     ):
         for focus in multiple_breakpoint_foci:
-            focus[READ_SUPPORTS[0]] = 0
-            focus[READ_SUPPORTS[1]] = 0
+            focus.num_supporting_reads__forward = 0
+            focus.num_supporting_reads__reverse = 0
         result = cluster_breakpoint_foci(multiple_breakpoint_foci, tolerance=10)
         assert len(result) == 0
 
@@ -180,6 +193,96 @@ class TestBreakpointClustering:
         assert result[1].Min == 2000
         assert result[1].Max == 2005
 
+    def test_foci_bridging_windows_merge_them(self):
+        foci = [
+            BreakpointFocus(
+                contig="test_contig",
+                start=start,
+                end=start + 1,
+                num_supporting_reads__forward=1,
+            )
+            for start in [0, 20, 10, 100]
+        ]
+        result = cluster_breakpoint_foci(foci, tolerance=10)
+        assert [(window.Min, window.Max) for window in result] == [(0, 21), (100, 101)]
+        assert [focus.start for focus in result[0].foci] == [0, 10, 20]
+
+    def test_foci_are_clustered_per_contig(self, multiple_breakpoint_foci):
+        multiple_breakpoint_foci[1].contig = "other_contig"
+        result = cluster_breakpoint_foci(multiple_breakpoint_foci, tolerance=10)
+        assert [(window.foci[0].contig, window.Min) for window in result] == [
+            ("test_contig", 2),
+            ("test_contig", 2000),
+            ("other_contig", 0),
+        ]
+
+
+class TestTileClustering:
+    @staticmethod
+    def get_peaks(putative_breakpoints):
+        return [
+            (e.interval, e.focus.start, e.orientation, e.max_value)
+            for e in putative_breakpoints
+        ]
+
+    def test_windows_close_to_tile_edges_are_not_resolved(self):
+        foci = [
+            BreakpointFocus(
+                contig="test_contig",
+                start=start,
+                end=start + 1,
+                num_supporting_reads__forward=1,
+            )
+            for start in [5, 50, 55, 91]
+        ]
+        result = cluster_tile_foci(foci, Interval("test_contig", 0, 100), tolerance=8)
+        assert [e.interval for e in result.putative_breakpoints] == [(50, 56)]
+        assert [focus.start for focus in result.edge_foci] == [5, 91]
+
+    def test_stitched_tile_clusters_match_untiled_clustering(self):
+        # The second region overlaps the first, so records the same foci again
+        regions = [Interval("test_contig", 0, 300), Interval("test_contig", 250, 400)]
+        foci_starts = [2, 29, 31, 45, 60, 88, 120, 150, 151, 260, 265, 299, 330]
+        region_foci = list()
+        for region in regions:
+            starts = [start for start in foci_starts if region.spans(start)]
+            region_foci.append(
+                FociTable(
+                    BreakpointType.S2G,
+                    [region.name],
+                    {
+                        "start": starts,
+                        "num_supporting_reads__forward": range(1, len(starts) + 1),
+                    },
+                )
+            )
+        all_foci = FociTable.concatenate(region_foci)
+        expected = [
+            window.find_peak_softclip_focus()
+            for window in cluster_breakpoint_foci(all_foci, tolerance=10)
+        ]
+        for tile_size in [1, 30, 100, 1000]:
+            tiles = tile_intervals(regions, tile_size, {})
+            tile_clusters = [
+                cluster_tile_foci(
+                    [
+                        focus
+                        for focus in region_foci[tile.region_idx]
+                        if tile.owns(focus.start)
+                    ],
+                    tile,
+                    tolerance=10,
+                )
+                for tile in tiles
+            ]
+            # Stitching only needs the foci around windows resolved in a tile but
+            # close to foci of other tiles
+            stitching_regions = get_stitching_regions(tile_clusters, tolerance=10)
+            stitching_foci = get_foci_in_regions(all_foci, stitching_regions)
+            assert len(stitching_foci) < len(all_foci)
+            result = stitch_tile_clusters(tile_clusters, stitching_foci, tolerance=10)
+            assert self.get_peaks(result) == self.get_peaks(expected)
+
 
 DEFAULT_TELO_SEQ = TELOMERE_SEQS["Nematoda"][Orientation.forward]
 DEFAULT_TELO_ARRAY_SIZE = 3
@@ -238,39 +341,120 @@ def detection_params():
         read_filter_flag=DEFAULT_READ_FILTER_FLAG,
         min_supporting_reads=1,
         keep_telomeric_breakpoints=False,
-        breakpoint_type=BreakpointType.G2S,
+        breakpoint_types=[BreakpointType.G2S],
+        target_regions={
+            BreakpointType.G2S: IntervalLookup([Interval(DEFAULT_CHROM, 1, 100)])
+        },
     )
 
 
+def setup_softclip_positions(detection_params):
+    return {
+        breakpoint_type: SoftclipPositions()
+        for breakpoint_type in detection_params.breakpoint_types
+    }
+
+
 class TestRecordSoftclips:
     def test_G2S_read_with_3prime_forward_telo_softclips_is_rejected(
         self, detection_params, read_telo_seq_forward_3prime, softclipped_aligned_read
     ):
         softclipped_aligned_read.query_sequence = read_telo_seq_forward_3prime[0]
         softclipped_aligned_read.cigar = read_telo_seq_forward_3prime[1]
-        breakpoint_tents = setup_breakpoint_tents()
-        seq_region = Interval(DEFAULT_CHROM, 1, 100)
+        softclip_positions = setup_softclip_positions(detection_params)
         record_softclips(
-            softclipped_aligned_read,
-            breakpoint_tents,
-            dict(),
-            detection_params,
-            seq_region,
+            [softclipped_aligned_read], softclip_positions, detection_params
         )
-        assert len(breakpoint_tents) == 0
+        assert len(softclip_positions[BreakpointType.G2S]) == 0
 
     def test_G2S_read_with_3prime_reverse_telo_softclips_is_rejected(
         self, detection_params, read_telo_seq_reverse_3prime, softclipped_aligned_read
     ):
         softclipped_aligned_read.query_sequence = read_telo_seq_reverse_3prime[0]
         softclipped_aligned_read.cigar = read_telo_seq_reverse_3prime[1]
-        breakpoint_tents = setup_breakpoint_tents()
-        seq_region = Interval(DEFAULT_CHROM, 1, 100)
+        softclip_positions = setup_softclip_positions(detection_params)
         record_softclips(
-            softclipped_aligned_read,
-            breakpoint_tents,
-            dict(),
-            detection_params,
-            seq_region,
+            [softclipped_aligned_read], softclip_positions, detection_params
         )
-        assert len(breakpoint_tents) == 0
+        assert len(softclip_positions[BreakpointType.G2S]) == 0
+
+
+class TestRecordSoftclipsAllBreakpointTypes:
+    def test_telo_softclips_are_recorded_as_S2G_only(
+        self, detection_params, read_telo_seq_forward_3prime, softclipped_aligned_read
+    ):
+        detection_params.breakpoint_types = all_breakpoint_types
+        softclipped_aligned_read.query_sequence = read_telo_seq_forward_3prime[0]
+        softclipped_aligned_read.cigar = read_telo_seq_forward_3prime[1]
+        softclip_positions = setup_softclip_positions(detection_params)
+        record_softclips(
+            [softclipped_aligned_read], softclip_positions, detection_params
+        )
+        assert len(softclip_positions[BreakpointType.G2S]) == 0
+        S2G_foci = list(
+            softclip_positions[BreakpointType.S2G].to_foci_table(
+                BreakpointType.S2G, softclipped_aligned_read.header.references
+            )
+        )
+        assert len(S2G_foci) == 1
+        assert S2G_foci[0].start == softclipped_aligned_read.reference_end
+        assert S2G_foci[0][READ_SUPPORTS[0]] == 1
+
+    def test_non_telo_softclips_are_recorded_as_G2S_inside_target_regions_only(
+        self, detection_params, softclipped_aligned_read
+    ):
+        detection_params.breakpoint_types = all_breakpoint_types
+        non_telo_seq = DEFAULT_NON_TELO_SEQ * 3
+        softclipped_aligned_read.query_sequence = non_telo_seq * 2
+        softclipped_aligned_read.cigar = (
+            (0, len(non_telo_seq)),
+            (4, len(non_telo_seq)),
+        )
+        for target_region, expected_num_foci in [
+            (Interval(DEFAULT_CHROM, 1, 100), 1),
+            (Interval(DEFAULT_CHROM, 200, 300), 0),
+        ]:
+            detection_params.target_regions[BreakpointType.G2S] = IntervalLookup(
+                [target_region]
+            )
+            softclip_positions = setup_softclip_positions(detection_params)
+            record_softclips(
+                [softclipped_aligned_read], softclip_positions, detection_params
+            )
+            assert len(softclip_positions[BreakpointType.S2G]) == 0
+            assert len(softclip_positions[BreakpointType.G2S]) == expected_num_foci
+
+
+class TestMinSoftclipLength:
+    def test_default_min_softclip_lengths(self, detection_params):
+        detection_params.max_edit_distance = 2
+        assert get_min_softclip_length(detection_params, BreakpointType.G2S) == 1
+        assert (
+            get_min_softclip_length(detection_params, BreakpointType.S2G)
+            == len(DEFAULT_TELO_SEQ) * DEFAULT_TELO_ARRAY_SIZE - 2
+        )
+
+    def test_user_min_softclip_length_applies_to_all_breakpoint_types(
+        self, detection_params
+    ):
+        detection_params.min_softclip_length = 5
+        for breakpoint_type in all_breakpoint_types:
+            assert get_min_softclip_length(detection_params, breakpoint_type) == 5
+
+    def test_short_telo_softclips_are_not_recorded(
+        self, detection_params, read_telo_seq_forward_3prime, softclipped_aligned_read
+    ):
+        detection_params.breakpoint_types = [BreakpointType.S2G]
+        softclipped_aligned_read.query_sequence = read_telo_seq_forward_3prime[0]
+        softclipped_aligned_read.cigar = read_telo_seq_forward_3prime[1]
+        sc_length = read_telo_seq_forward_3prime[1][-1][1]
+        for min_softclip_length, expected_num_foci in [
+            (sc_length, 1),
+            (sc_length + 1, 0),
+        ]:
+            detection_params.min_softclip_length = min_softclip_length
+            softclip_positions = setup_softclip_positions(detection_params)
+            record_softclips(
+                [softclipped_aligned_read], softclip_positions, detection_params
+            )
+            assert len(softclip_positions[BreakpointType.S2G]) == expected_num_foci
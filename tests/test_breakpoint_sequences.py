@@ -1,23 +1,30 @@
-from delfies import PutativeBreakpoint
-from delfies.breakpoint_foci import setup_breakpoint_tents
-from delfies.breakpoint_sequences import extract_breakpoint_sequences
+from copy import deepcopy
+from pathlib import Path
+
+from pysam import FastaFile
+
+from delfies import BreakpointFocus, PutativeBreakpoint
+from delfies.breakpoint_sequences import (
+    extract_breakpoint_sequences,
+    write_breakpoint_sequences,
+)
 from delfies.seq_utils import Orientation
 from tests import ClassWithTempFasta
 
 
 class TestExtractBreakpointSequences(ClassWithTempFasta):
     default_reference = ">scaffold_1\nACGTGATACA\n"
-    tents = setup_breakpoint_tents()
     default_breakpoint = PutativeBreakpoint(Orientation.forward, 0, 0, 0, (0, 0), None)
-    breakpoint_location = tents.new()
-    breakpoint_location.update(contig="scaffold_1", start=3)
+    breakpoint_location = BreakpointFocus(contig="scaffold_1", start=3, end=4)
     default_breakpoint.focus = breakpoint_location
 
     def test_extract_breakpoint_within_boundaries_single_nucleotide(self):
         fasta = self.make_fasta(self.default_reference, as_handle=True)
         self.breakpoint_location.start = 3
-        breakpoint_sequences = extract_breakpoint_sequences(
-            [self.default_breakpoint], fasta, seq_window_size=1
+        breakpoint_sequences = list(
+            extract_breakpoint_sequences(
+                [self.default_breakpoint], fasta, seq_window_size=1
+            )
         )
         assert len(breakpoint_sequences) == 1
         assert breakpoint_sequences[0].sequence == "GNT"
@@ -25,8 +32,10 @@ class TestExtractBreakpointSequences(ClassWithTempFasta):
     def test_extract_breakpoint_within_boundaries_multiple_nucleotides(self):
         fasta = self.make_fasta(self.default_reference, as_handle=True)
         self.breakpoint_location.start = 3
-        breakpoint_sequences = extract_breakpoint_sequences(
-            [self.default_breakpoint], fasta, seq_window_size=2
+        breakpoint_sequences = list(
+            extract_breakpoint_sequences(
+                [self.default_breakpoint], fasta, seq_window_size=2
+            )
         )
         assert len(breakpoint_sequences) == 1
         assert breakpoint_sequences[0].sequence == "CGNTG"
@@ -35,8 +44,10 @@ class TestExtractBreakpointSequences(ClassWithTempFasta):
         fasta = self.make_fasta(self.default_reference, as_handle=True)
         for start in [-2, 0]:
             self.breakpoint_location.start = start
-            breakpoint_sequences = extract_breakpoint_sequences(
-                [self.default_breakpoint], fasta, seq_window_size=2
+            breakpoint_sequences = list(
+                extract_breakpoint_sequences(
+                    [self.default_breakpoint], fasta, seq_window_size=2
+                )
             )
             assert len(breakpoint_sequences) == 1
             assert breakpoint_sequences[0].sequence == "NAC"
@@ -44,8 +55,10 @@ class TestExtractBreakpointSequences(ClassWithTempFasta):
     def test_extract_breakpoint_outside_boundaries_end_past_last_nucleotide(self):
         fasta = self.make_fasta(self.default_reference, as_handle=True)
         self.breakpoint_location.start = 9
-        breakpoint_sequences = extract_breakpoint_sequences(
-            [self.default_breakpoint], fasta, seq_window_size=3
+        breakpoint_sequences = list(
+            extract_breakpoint_sequences(
+                [self.default_breakpoint], fasta, seq_window_size=3
+            )
         )
         assert len(breakpoint_sequences) == 1
         assert breakpoint_sequences[0].sequence == "TACNA"
@@ -54,8 +67,68 @@ class TestExtractBreakpointSequences(ClassWithTempFasta):
         fasta = self.make_fasta(self.default_reference, as_handle=True)
         self.breakpoint_location.start = 3
         self.default_breakpoint.orientation = Orientation.reverse
-        breakpoint_sequences = extract_breakpoint_sequences(
-            [self.default_breakpoint], fasta, seq_window_size=2
+        breakpoint_sequences = list(
+            extract_breakpoint_sequences(
+                [self.default_breakpoint], fasta, seq_window_size=2
+            )
         )
         assert len(breakpoint_sequences) == 1
         assert breakpoint_sequences[0].sequence == "CANCG"
+
+    def test_extract_breakpoint_with_window_overflowing_contig_start(self):
+        fasta = self.make_fasta(self.default_reference, as_handle=True)
+        self.breakpoint_location.start = 1
+        self.default_breakpoint.orientation = Orientation.forward
+        breakpoint_sequences = list(
+            extract_breakpoint_sequences(
+                [self.default_breakpoint], fasta, seq_window_size=2
+            )
+        )
+        assert len(breakpoint_sequences) == 1
+        assert breakpoint_sequences[0].sequence == "ANCG"
+
+
+class TestBreakpointSequencesOfSeveralContigs(ClassWithTempFasta):
+    reference = ">scaffold_1\nACGTGATACA\n>scaffold_2\nTTTTGGGG\n"
+
+    def make_breakpoints(self):
+        result = list()
+        for contig, start in [("scaffold_2", 4), ("scaffold_1", 7), ("scaffold_1", 2)]:
+            breakpoint = PutativeBreakpoint(Orientation.forward, 0, 0, 0, (0, 0), None)
+            breakpoint.focus = BreakpointFocus(
+                contig=contig, start=start, end=start + 1
+            )
+            breakpoint.breakpoint_type = "S2G"
+            result.append(deepcopy(breakpoint))
+        return result
+
+    def test_extraction_keeps_breakpoint_order(self):
+        genome = self.make_fasta(self.reference, as_handle=True)
+        breakpoint_sequences = list(
+            extract_breakpoint_sequences(
+                self.make_breakpoints(), genome, seq_window_size=1
+            )
+        )
+        assert [record.sequence for record in breakpoint_sequences] == [
+            "TNG",
+            "TNA",
+            "CNG",
+        ]
+
+    def test_extraction_in_batches_keeps_breakpoint_order(self, monkeypatch):
+        monkeypatch.setattr("delfies.breakpoint_sequences.SEQUENCE_BATCH_SIZE", 2)
+        self.test_extraction_keeps_breakpoint_order()
+
+    def test_write_bgzipped_indexed_sequences(self):
+        genome = self.make_fasta(self.reference, as_handle=True)
+        odirname = Path(self.temp_dir.name)
+        write_breakpoint_sequences(
+            genome, self.make_breakpoints(), odirname, seq_window_size=1, bgzip=True
+        )
+        with FastaFile(str(odirname / "breakpoint_sequences.fasta.gz")) as fasta:
+            assert fasta.references == [
+                "S2G_3prime_scaffold_2_4",
+                "S2G_3prime_scaffold_1_7",
+                "S2G_3prime_scaffold_1_2",
+            ]
+            assert fasta.fetch("S2G_3prime_scaffold_1_2") == "CNG"
@@ -0,0 +1,223 @@
+import filecmp
+from pathlib import Path
+from shutil import copyfile
+
+from click.testing import CliRunner
+from pysam import index as pysam_index
+from pysam import merge as pysam_merge
+
+from delfies.delfies import main
+from tests import ClassWithTempFasta
+from tests.test_breakpoint_detection_from_BAM import (
+    DEFAULT_CHROM,
+    DEFAULT_CHROM_LENGTH,
+    DEFAULT_TELO_SEQ,
+    EXPECTED_BREAKPOINT_POSITION,
+    TeloContainingReadGenerator,
+)
+
+
+def run_delfies(args):
+    result = CliRunner().invoke(main, list(map(str, args)), catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def assert_same_outputs(dirname, other_dirname):
+    fnames = sorted(path.name for path in Path(dirname).iterdir() if path.is_file())
+    assert fnames == sorted(
+        path.name for path in Path(other_dirname).iterdir() if path.is_file()
+    )
+    _, mismatches, errors = filecmp.cmpfiles(
+        dirname, other_dirname, fnames, shallow=False
+    )
+    assert mismatches == errors == []
+
+
+class TestCommandLine(ClassWithTempFasta):
+    @classmethod
+    def setup_class(cls):
+        super().setup_class()
+        cls.genome_fname = cls.make_fasta(
+            f">{DEFAULT_CHROM}\n{'ACGTTGCA' * int(DEFAULT_CHROM_LENGTH // 8)}\n"
+        )
+        # A well-supported breakpoint, and a poorly-supported one close to it: which
+        # breakpoints are called depends on both post-scan parameters
+        cls.read_generators = [
+            TeloContainingReadGenerator(),
+            TeloContainingReadGenerator(
+                num_reads=20,
+                num_telo_containing_reads=15,
+                telo_start_pos_in_genome=EXPECTED_BREAKPOINT_POSITION + 6,
+            ),
+        ]
+        cls.bam_fname = str(Path(cls.temp_dir.name) / "reads.bam")
+        pysam_merge(
+            "-f",
+            cls.bam_fname,
+            *(read_generator.write_BAM() for read_generator in cls.read_generators),
+        )
+        pysam_index(cls.bam_fname)
+
+    def get_dirname(self, name: str) -> Path:
+        return Path(self.temp_dir.name) / name
+
+    def test_arguments_without_command_run_detect(self):
+        default_dirname = self.get_dirname("default_command")
+        detect_dirname = self.get_dirname("detect_command")
+        run_delfies([self.genome_fname, self.bam_fname, default_dirname])
+        run_delfies(["detect", self.genome_fname, self.bam_fname, detect_dirname])
+        assert (default_dirname / "breakpoint_locations.bed").stat().st_size > 0
+        assert_same_outputs(default_dirname, detect_dirname)
+
+    def test_recluster_matches_detect(self):
+        foci_dirname = self.get_dirname("recluster_foci")
+        recluster_dirname = self.get_dirname("recluster")
+        run_delfies(
+            [self.genome_fname, self.bam_fname, foci_dirname]
+            + ["--min_supporting_reads", 1, "--clustering_threshold", 1]
+        )
+        run_delfies(
+            ["recluster", self.genome_fname, foci_dirname, recluster_dirname]
+            + ["--min_supporting_reads", 10, "--min_supporting_reads", 20]
+            + ["--clustering_threshold", 1, "--clustering_threshold", 8]
+        )
+        num_breakpoints = set()
+        for min_reads, threshold in [(10, 1), (10, 8), (20, 1), (20, 8)]:
+            detect_dirname = self.get_dirname(
+                f"recluster_detect_{min_reads}_{threshold}"
+            )
+            run_delfies(
+                [self.genome_fname, self.bam_fname, detect_dirname]
+                + ["--min_supporting_reads", min_reads]
+                + ["--clustering_threshold", threshold]
+            )
+            assert_same_outputs(
+                recluster_dirname
+                / f"min_supporting_reads_{min_reads}__clustering_threshold_{threshold}",
+                detect_dirname,
+            )
+            with (detect_dirname / "breakpoint_locations.bed").open() as fstream:
+                num_breakpoints.add(len(fstream.readlines()))
+        assert num_breakpoints == {1, 2}
+
+    def test_recluster_writes_one_directory_per_combination(self):
+        foci_dirname = self.get_dirname("grid_foci")
+        recluster_dirname = self.get_dirname("grid")
+        run_delfies(
+            [self.genome_fname, self.bam_fname, foci_dirname]
+            + ["--min_supporting_reads", 1]
+        )
+        run_delfies(
+            ["recluster", self.genome_fname, foci_dirname, recluster_dirname]
+            + ["--min_supporting_reads", 10, "--min_supporting_reads", 20]
+            + ["--clustering_threshold", 1, "--clustering_threshold", 50]
+            # Repeated values are only analysed once
+            + ["--clustering_threshold", 1]
+        )
+        assert sorted(path.name for path in recluster_dirname.iterdir()) == [
+            f"min_supporting_reads_{min_reads}__clustering_threshold_{threshold}"
+            for min_reads in [10, 20]
+            for threshold in [1, 50]
+        ]
+        for combination_dirname in recluster_dirname.iterdir():
+            assert (combination_dirname / "breakpoint_locations.bed").exists()
+
+
+class TestSeveralBAMs(ClassWithTempFasta):
+    telomeric_breakpoint_position = 3000
+
+    @classmethod
+    def setup_class(cls):
+        super().setup_class()
+        genome_seq = "ACGTTGCA" * int(DEFAULT_CHROM_LENGTH // 8)
+        # The breakpoint of the second sample lies in a genomic telomere array, so is
+        # discarded
+        telomere_array = DEFAULT_TELO_SEQ * 20
+        genome_seq = (
+            genome_seq[: cls.telomeric_breakpoint_position]
+            + telomere_array
+            + genome_seq[cls.telomeric_breakpoint_position + len(telomere_array) :]
+        )
+        cls.genome_fname = cls.make_fasta(f">{DEFAULT_CHROM}\n{genome_seq}\n")
+        cls.read_generators = [
+            TeloContainingReadGenerator(),
+            TeloContainingReadGenerator(
+                telo_start_pos_in_genome=cls.telomeric_breakpoint_position
+            ),
+        ]
+        cls.bam_fnames = list()
+        for sample_name, read_generator in zip(["s1", "s2"], cls.read_generators):
+            bam_fname = Path(cls.temp_dir.name) / f"{sample_name}.bam"
+            copyfile(read_generator.write_BAM(), bam_fname)
+            pysam_index(str(bam_fname))
+            cls.bam_fnames.append(bam_fname)
+        cls.joint_dirname = Path(cls.temp_dir.name) / "joint"
+        run_delfies([cls.genome_fname, *cls.bam_fnames, cls.joint_dirname])
+
+    def test_samples_match_single_BAM_runs(self):
+        for bam_fname in self.bam_fnames:
+            single_dirname = Path(self.temp_dir.name) / f"single_{bam_fname.stem}"
+            run_delfies([self.genome_fname, bam_fname, single_dirname])
+            assert_same_outputs(self.joint_dirname / bam_fname.stem, single_dirname)
+        breakpoints = [
+            (self.joint_dirname / sample_name / "breakpoint_locations.bed").read_text()
+            for sample_name in ["s1", "s2"]
+        ]
+        assert f"\t{EXPECTED_BREAKPOINT_POSITION}\t" in breakpoints[0]
+        assert breakpoints[1] == ""
+
+    def test_joint_tsv_has_NA_where_a_sample_has_no_record(self):
+        sample_records = list()
+        for sample_name in ["s1", "s2"]:
+            foci_tsv = self.joint_dirname / sample_name / "breakpoint_foci__S2G.tsv"
+            with foci_tsv.open() as fstream:
+                next(fstream)
+                records = dict()
+                for line in fstream:
+                    fields = line.rstrip("\n").split("\t")
+                    records[tuple(fields[:3])] = [fields[3]] + fields[5:]
+            sample_records.append(records)
+        with (self.joint_dirname / "joint_breakpoint_foci__S2G.tsv").open() as fstream:
+            header = next(fstream).rstrip("\n").split("\t")
+            joint_rows = [line.rstrip("\n").split("\t") for line in fstream]
+        assert header[4:7] == [
+            "s1__read_depth",
+            "s1__num_supporting_reads__forward",
+            "s1__num_supporting_reads__reverse",
+        ]
+        assert {tuple(row[:3]) for row in joint_rows} == set(sample_records[0]) | set(
+            sample_records[1]
+        )
+        num_missing = 0
+        for row in joint_rows:
+            for sample_idx, records in enumerate(sample_records):
+                sample_values = row[4 + 3 * sample_idx : 7 + 3 * sample_idx]
+                if tuple(row[:3]) in records:
+                    assert sample_values == records[tuple(row[:3])]
+                else:
+                    assert sample_values == ["NA"] * 3
+                    num_missing += 1
+        assert num_missing > 0
+
+    def test_BAMs_named_alike_are_rejected(self):
+        other_dirname = Path(self.temp_dir.name) / "other"
+        other_dirname.mkdir(exist_ok=True)
+        other_bam_fname = other_dirname / self.bam_fnames[0].name
+        other_bam_fname.symlink_to(self.bam_fnames[0])
+        result = CliRunner().invoke(
+            main,
+            list(
+                map(
+                    str,
+                    [
+                        self.genome_fname,
+                        self.bam_fnames[0],
+                        other_bam_fname,
+                        Path(self.temp_dir.name) / "alike",
+                    ],
+                )
+            ),
+        )
+        assert result.exit_code != 0
+        assert "BAM names must be distinct" in result.output
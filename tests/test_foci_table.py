@@ -0,0 +1,143 @@
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from delfies import BreakpointFocus, BreakpointType, Orientation
+from delfies.foci_table import FOCI_TSV_HEADER, FociTable, SoftclipPositions
+
+DEFAULT_BREAKPOINT_TYPE = BreakpointType.S2G
+
+
+@pytest.fixture
+def foci_table():
+    return FociTable(
+        DEFAULT_BREAKPOINT_TYPE,
+        ["chr1", "chr2"],
+        {
+            "contig_id": [0, 0, 1],
+            "start": [-1, 10, 10],
+            "read_depth": [0, 30, 40],
+            "num_supporting_reads__forward": [2, 0, 0],
+            "num_supporting_reads__reverse": [0, 0, 5],
+        },
+    )
+
+
+class TestSoftclipPositions:
+    def test_softclips_are_counted_per_position_and_orientation(self):
+        softclip_positions = SoftclipPositions()
+        softclip_positions.add(2, 5, Orientation.forward)
+        softclip_positions.add(0, 5, Orientation.reverse)
+        softclip_positions.add(2, 5, Orientation.forward)
+        softclip_positions.add(2, -1, Orientation.reverse)
+        softclip_positions.add(2, 5, Orientation.reverse)
+        assert len(softclip_positions) == 5
+        result = list(
+            softclip_positions.to_foci_table(
+                DEFAULT_BREAKPOINT_TYPE, ["chr1", "chr2", "chr3"]
+            )
+        )
+        assert result == [
+            BreakpointFocus("chr1", 5, 6, 0, "S2G", 0, 1),
+            BreakpointFocus("chr3", -1, 0, 0, "S2G", 0, 1),
+            BreakpointFocus("chr3", 5, 6, 0, "S2G", 2, 1),
+        ]
+
+
+class TestFociTable:
+    def test_filter_by_support(self, foci_table):
+        assert list(foci_table.has_support()) == [True, False, True]
+        assert list(foci_table.has_support(min_supporting_reads=3)) == [
+            False,
+            False,
+            True,
+        ]
+        supported_foci = foci_table.filter(foci_table.has_support(3))
+        assert [(focus.contig, focus.start) for focus in supported_foci] == [
+            ("chr2", 10)
+        ]
+
+    def test_unsupported_foci_have_no_breakpoint_type(self, foci_table):
+        assert [focus.breakpoint_type for focus in foci_table] == ["S2G", "0", "S2G"]
+
+    def test_concatenate_remaps_contigs(self, foci_table):
+        other_table = FociTable(
+            DEFAULT_BREAKPOINT_TYPE,
+            ["chr3", "chr2"],
+            {"contig_id": [1, 0], "start": [1, 2]},
+        )
+        result = FociTable.concatenate([foci_table, other_table])
+        assert result.contigs == ["chr1", "chr2", "chr3"]
+        assert [(focus.contig, focus.start) for focus in result][3:] == [
+            ("chr2", 1),
+            ("chr3", 2),
+        ]
+
+    def test_deduplicate_positions_prefers_supported_foci(self, foci_table):
+        depth_only_table = FociTable(
+            DEFAULT_BREAKPOINT_TYPE,
+            ["chr2"],
+            {"contig_id": [0, 0], "start": [10, 8], "read_depth": [40, 38]},
+        )
+        result = FociTable.concatenate(
+            [depth_only_table, foci_table]
+        ).deduplicate_positions()
+        assert [
+            (focus.contig, focus.start, focus.num_supporting_reads__reverse)
+            for focus in result
+        ] == [("chr2", 8, 0), ("chr2", 10, 5), ("chr1", -1, 0), ("chr1", 10, 0)]
+
+    def test_tsv_round_trip(self, foci_table):
+        ofstream = StringIO()
+        foci_table.write_tsv(ofstream, with_header=True)
+        tsv_lines = ofstream.getvalue().splitlines()
+        assert tsv_lines[0].split("\t") == FOCI_TSV_HEADER
+        assert tsv_lines[1] == "chr1\t-1\t0\t0\tS2G\t2\t0"
+        with TemporaryDirectory() as tmp_dirname:
+            foci_tsv = f"{tmp_dirname}/foci.tsv"
+            with open(foci_tsv, "w") as ofstream:
+                foci_table.write_tsv(ofstream, with_header=True)
+            result = FociTable.from_tsv(foci_tsv, DEFAULT_BREAKPOINT_TYPE)
+        assert list(result) == list(foci_table)
+
+    def test_binary_round_trip(self, foci_table):
+        with TemporaryDirectory() as tmp_dirname:
+            fname = f"{tmp_dirname}/foci.npz"
+            foci_table.save(fname)
+            result = FociTable.load(fname)
+        assert result.breakpoint_type is DEFAULT_BREAKPOINT_TYPE
+        assert list(result) == list(foci_table)
+        empty_table = FociTable(BreakpointType.G2S)
+        with TemporaryDirectory() as tmp_dirname:
+            fname = f"{tmp_dirname}/foci.npz"
+            empty_table.save(fname)
+            assert len(FociTable.load(fname)) == 0
+
+    def test_joint_tsv_has_one_row_per_position(self, foci_table):
+        other_sample_table = FociTable(
+            DEFAULT_BREAKPOINT_TYPE,
+            ["chr2", "chr1"],
+            {
+                "contig_id": [1, 0],
+                "start": [10, 12],
+                "read_depth": [20, 25],
+                "num_supporting_reads__forward": [3, 0],
+            },
+        )
+        ofstream = StringIO()
+        FociTable.write_joint_tsv_header(["s1", "s2"], ofstream)
+        FociTable.write_joint_tsv([foci_table, other_sample_table], ofstream)
+        tsv_lines = ofstream.getvalue().splitlines()
+        assert tsv_lines[0].split("\t")[3:7] == [
+            "breakpoint_type",
+            "s1__read_depth",
+            "s1__num_supporting_reads__forward",
+            "s1__num_supporting_reads__reverse",
+        ]
+        assert tsv_lines[1:] == [
+            "chr1\t-1\t0\tS2G\t0\t2\t0\tNA\tNA\tNA",
+            "chr1\t10\t11\tS2G\t30\t0\t0\t20\t3\t0",
+            "chr2\t10\t11\tS2G\t40\t0\t5\tNA\tNA\tNA",
+            "chr2\t12\t13\t0\tNA\tNA\tNA\t25\t0\t0",
+        ]
@@ -0,0 +1,118 @@
+import gzip
+import pickle
+from pathlib import Path
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+import pytest
+from pysam import FastaFile
+
+from delfies.genome_utils import Genome, get_genome_cache_fnames, open_genome
+from tests import ClassWithTempFasta
+
+
+def make_directory_read_only(monkeypatch, dirname: Path) -> None:
+    """
+    Tests run as root can write to read-only directories: writing to `dirname` is
+    made to fail instead
+    """
+
+    def read_only_dir(*args, dir, **kwargs):
+        if Path(dir) == dirname:
+            raise PermissionError("Read-only file system")
+        return NamedTemporaryFile(*args, dir=dir, **kwargs)
+
+    monkeypatch.setattr("delfies.genome_utils.NamedTemporaryFile", read_only_dir)
+
+
+class TestGenome(ClassWithTempFasta):
+    genome_record = ">chr1 some description\nACGTac\ngtAC\n>chr2\nTTTT\n>chr3\n\n"
+
+    def test_fetch(self):
+        genome = self.make_fasta(self.genome_record, as_handle=True)
+        assert genome.contigs == ["chr1", "chr2", "chr3"]
+        assert genome.get_length("chr1") == 10
+        assert genome.fetch("chr1") == "ACGTacgtAC"
+        assert genome.fetch("chr1", 3, 6) == "Tac"
+        assert genome.fetch("chr1", 3, 6, uppercase=True) == "TAC"
+        assert genome.fetch("chr2") == "TTTT"
+        assert genome.fetch("chr3") == ""
+
+    def test_fetch_is_clipped_to_contig(self):
+        genome = self.make_fasta(self.genome_record, as_handle=True)
+        assert genome.fetch("chr1", -2, 2) == "AC"
+        assert genome.fetch("chr1", 8, 20) == "AC"
+        assert genome.fetch("chr1", 12, 20) == ""
+        assert genome.fetch("chr1", 5, 2) == ""
+        with pytest.raises(KeyError):
+            genome.fetch("chr4")
+
+    def test_reference_for_htslib(self):
+        genome = self.make_fasta(self.genome_record, as_handle=True)
+        with FastaFile(genome.get_reference_fname()) as reference:
+            assert reference.references == ["chr1", "chr2", "chr3"]
+            assert reference.fetch("chr1", 3, 6) == "Tac"
+            assert reference.fetch("chr2") == "TTTT"
+            assert reference.fetch("chr3") == ""
+
+    def test_genome_is_opened_once_per_process(self):
+        fasta = self.make_fasta(self.genome_record)
+        assert open_genome(fasta) is open_genome(fasta)
+
+    def test_cache_in_index_dir_is_reused(self, monkeypatch):
+        fasta = self.make_fasta(self.genome_record)
+        with TemporaryDirectory() as index_dir:
+            genome = Genome(fasta, index_dir)
+            seq_fname, index_fname = get_genome_cache_fnames(fasta, index_dir)
+            assert seq_fname.parent == Path(index_dir)
+            assert index_fname.exists()
+
+            def fail_to_parse(*args, **kwargs):
+                raise AssertionError("The genome should not be parsed again")
+
+            monkeypatch.setattr("delfies.genome_utils.Fastx", fail_to_parse)
+            assert Genome(fasta, index_dir).fetch("chr2") == "TTTT"
+            # Pickled genomes (e.g. sent to pool workers) map the same cache
+            assert pickle.loads(pickle.dumps(genome)).fetch("chr2") == "TTTT"
+
+    def test_read_only_genome_directory_falls_back(self, monkeypatch):
+        fasta = self.make_fasta(self.genome_record)
+
+        make_directory_read_only(monkeypatch, Path(fasta).parent)
+        with TemporaryDirectory() as fallback_dir:
+            monkeypatch.setattr(
+                "delfies.genome_utils.FALLBACK_INDEX_DIR", Path(fallback_dir)
+            )
+            genome = Genome(fasta)
+            assert genome.index_dir == fallback_dir
+            assert genome.fetch("chr2") == "TTTT"
+            assert not get_genome_cache_fnames(fasta)[0].exists()
+            assert get_genome_cache_fnames(fasta, fallback_dir)[0].exists()
+            assert Path(genome.get_reference_fname()).parent == Path(fallback_dir)
+
+    def test_cache_in_read_only_directory_is_indexed_elsewhere(self, monkeypatch):
+        fasta = self.make_fasta(self.genome_record)
+        genome = Genome(fasta)
+
+        make_directory_read_only(monkeypatch, Path(fasta).parent)
+        with TemporaryDirectory() as fallback_dir:
+            monkeypatch.setattr(
+                "delfies.genome_utils.FALLBACK_INDEX_DIR", Path(fallback_dir)
+            )
+            with FastaFile(genome.get_reference_fname()) as reference:
+                assert reference.fetch("chr2") == "TTTT"
+
+    def test_modified_genome_gets_a_new_cache(self):
+        fasta = self.make_fasta(self.genome_record)
+        seq_fname, _ = get_genome_cache_fnames(fasta)
+        Genome(fasta)
+        with open(fasta, "a") as ofstream:
+            ofstream.write(">chr4\nGG\n")
+        assert get_genome_cache_fnames(fasta)[0] != seq_fname
+        assert Genome(fasta).contigs == ["chr1", "chr2", "chr3", "chr4"]
+
+    def test_gzipped_genome(self):
+        fasta = self.make_fasta(self.genome_record)
+        gzipped_fasta = f"{fasta}.gz"
+        with open(fasta, "rb") as ifstream, gzip.open(gzipped_fasta, "wb") as ofstream:
+            ofstream.write(ifstream.read())
+        assert Genome(gzipped_fasta).fetch("chr1") == "ACGTacgtAC"
@@ -1,7 +1,20 @@
 import pytest
 from pybedtools import Interval as pybedtools_Interval
 
-from delfies.interval_utils import Interval, get_contiguous_ranges, parse_region_string
+from delfies.interval_utils import (
+    Interval,
+    IntervalLookup,
+    Tile,
+    complement_intervals,
+    extend_to_overlapping,
+    get_contiguous_ranges,
+    intersect_intervals,
+    merge_intervals,
+    parse_region_string,
+    slop_intervals,
+    sort_intervals,
+    tile_intervals,
+)
 
 EXAMPLE_INVALID_REGION_STRING = "chr1:2--200"
 EXAMPLE_VALID_REGION_STRING = "chr1:2-200"
@@ -85,3 +98,143 @@ class TestIntervalCoordinates:
         assert test_interval.spans(test_interval.end)
         assert not test_interval.spans(test_interval.start - 1)
         assert not test_interval.spans(test_interval.end + 1)
+
+
+class TestIntervalLookup:
+    lookup = IntervalLookup(
+        [
+            Interval("chr1", 50, 60),
+            Interval("chr1", 10, 20),
+            Interval("chr1", 15, 30),
+            Interval("chr2"),
+        ]
+    )
+
+    def test_overlapping_intervals_are_merged(self):
+        assert self.lookup.find_overlapping(Interval("chr1")) == [
+            Interval("chr1", 10, 30),
+            Interval("chr1", 50, 60),
+        ]
+
+    def test_spans(self):
+        assert self.lookup.spans("chr1", 10)
+        assert self.lookup.spans("chr1", 30)
+        assert not self.lookup.spans("chr1", 9)
+        assert not self.lookup.spans("chr1", 31)
+        assert not self.lookup.spans("chr3", 10)
+        assert self.lookup.spans("chr2", 1000)
+
+    def test_overlaps(self):
+        assert self.lookup.overlaps("chr1", 0, 11)
+        assert not self.lookup.overlaps("chr1", 0, 10)
+        assert not self.lookup.overlaps("chr1", 30, 50)
+        assert self.lookup.overlaps("chr1", 35, 100)
+        assert self.lookup.overlaps("chr2", 0, 1)
+
+    def test_extend_to_overlapping(self):
+        assert extend_to_overlapping(Interval("chr1", 25, 55), self.lookup) == Interval(
+            "chr1", 10, 60
+        )
+        assert extend_to_overlapping(Interval("chr1", 35, 45), self.lookup) == Interval(
+            "chr1", 35, 45
+        )
+        assert extend_to_overlapping(Interval("chr2", 5, 10), self.lookup) == Interval(
+            "chr2"
+        )
+
+
+class TestTiling:
+    contig_lengths = {"chr1": 25, "chr2": 10}
+
+    def test_tile_intervals(self):
+        result = tile_intervals(
+            [Interval("chr1"), Interval("chr2", 2, 8)], 10, self.contig_lengths
+        )
+        assert result == [
+            Tile("chr1", 0, 10, region_idx=0, first=True, last=False),
+            Tile("chr1", 10, 20, region_idx=0, first=False, last=False),
+            Tile("chr1", 20, 25, region_idx=0, first=False, last=True),
+            Tile("chr2", 2, 8, region_idx=1, first=True, last=True),
+        ]
+
+    def test_tiles_partition_breakpoint_positions(self):
+        tiles = tile_intervals([Interval("chr1", 5, 25)], 5, self.contig_lengths)
+        for query_pos in range(-1, 30):
+            assert sum(tile.owns(query_pos) for tile in tiles) == 1
+
+    def test_fetch_interval_has_margin_at_inner_tile_boundaries(self):
+        first_tile, last_tile = tile_intervals(
+            [Interval("chr1", 5, 25)], 10, self.contig_lengths
+        )
+        assert first_tile.to_fetch_interval() == Interval("chr1", 5, 16)
+        assert last_tile.to_fetch_interval() == Interval("chr1", 14, 25)
+
+
+class TestIntervalAlgebra:
+    contig_lengths = {"chr2": 100, "chr1": 50}
+    intervals = [
+        Interval("chr2", 40, 60),
+        Interval("chr1", 10, 20),
+        Interval("chr2", 10, 30),
+        Interval("chr2", 20, 40),
+        Interval("chr2", 80, 90),
+    ]
+
+    def test_sort_keeps_contig_order(self):
+        assert sort_intervals(self.intervals) == [
+            Interval("chr2", 10, 30),
+            Interval("chr2", 20, 40),
+            Interval("chr2", 40, 60),
+            Interval("chr2", 80, 90),
+            Interval("chr1", 10, 20),
+        ]
+
+    def test_merge_overlapping_and_bookended(self):
+        assert merge_intervals(self.intervals) == [
+            Interval("chr2", 10, 60),
+            Interval("chr2", 80, 90),
+            Interval("chr1", 10, 20),
+        ]
+
+    def test_merge_with_whole_contig(self):
+        intervals = [Interval("chr1", 10, 20), Interval("chr1")]
+        assert merge_intervals(intervals) == [Interval("chr1")]
+        assert merge_intervals(intervals, self.contig_lengths) == [
+            Interval("chr1", 0, 50)
+        ]
+
+    def test_intersect(self):
+        other_intervals = [
+            Interval("chr2", 0, 15),
+            Interval("chr2", 55, 85),
+            Interval("chr2", 90, 95),
+            Interval("chr3", 0, 10),
+        ]
+        assert intersect_intervals(self.intervals, other_intervals) == [
+            Interval("chr2", 10, 15),
+            Interval("chr2", 55, 60),
+            Interval("chr2", 80, 85),
+        ]
+
+    def test_intersect_with_whole_contig(self):
+        assert intersect_intervals(self.intervals, [Interval("chr1")]) == [
+            Interval("chr1", 10, 20)
+        ]
+
+    def test_complement(self):
+        assert complement_intervals(self.intervals, self.contig_lengths) == [
+            Interval("chr2", 0, 10),
+            Interval("chr2", 60, 80),
+            Interval("chr2", 90, 100),
+            Interval("chr1", 0, 10),
+            Interval("chr1", 20, 50),
+        ]
+
+    def test_slop_is_clipped_to_contigs(self):
+        assert slop_intervals(self.intervals, 12, self.contig_lengths) == [
+            Interval("chr2", 0, 100),
+            Interval("chr1", 0, 32),
+        ]
+        assert slop_intervals([Interval("chr1", 45, 48)], 8, self.contig_lengths) == [
+            Interval("chr1", 37, 50)
+        ]
@@ -0,0 +1,43 @@
+from delfies.interval_utils import Interval, tile_intervals
+from delfies.parallel_utils import estimate_tile_loads, plan_parallelism
+
+CONTIG_LENGTHS = {"chr1": 1000, "chr2": 100}
+MAPPED_READ_COUNTS = {"chr1": 500, "chr2": 200}
+
+
+class TestParallelismPlanning:
+    def test_tile_loads_from_read_counts(self):
+        tiles = tile_intervals(
+            [Interval("chr1", 0, 300), Interval("chr2")], 200, CONTIG_LENGTHS
+        )
+        assert estimate_tile_loads(
+            tiles, CONTIG_LENGTHS, MAPPED_READ_COUNTS
+        ).tolist() == [100, 50, 200]
+
+    def test_tile_loads_without_read_counts(self):
+        tiles = tile_intervals([Interval("chr1", 0, 300)], 200, CONTIG_LENGTHS)
+        assert estimate_tile_loads(tiles, CONTIG_LENGTHS, dict()).tolist() == [200, 100]
+
+    def test_few_tiles_get_decode_threads(self):
+        tiles = tile_intervals([Interval("chr2", 10, 20)], 200, CONTIG_LENGTHS)
+        plan = plan_parallelism(tiles, CONTIG_LENGTHS, MAPPED_READ_COUNTS, num_cores=8)
+        assert plan.num_workers == 1
+        assert plan.decode_threads == 8
+        assert plan.worker_loads == [20]
+
+    def test_many_tiles_get_one_worker_per_core(self):
+        tiles = tile_intervals([Interval("chr1")], 100, CONTIG_LENGTHS)
+        plan = plan_parallelism(tiles, CONTIG_LENGTHS, MAPPED_READ_COUNTS, num_cores=4)
+        assert plan.num_workers == 4
+        assert plan.decode_threads == 1
+        assert sorted(plan.worker_tiles) == [2, 2, 3, 3]
+        assert sum(plan.worker_loads) == 500
+
+    def test_tiles_without_reads_get_no_worker(self):
+        tiles = tile_intervals(
+            [Interval("chr1"), Interval("chr2")], 1000, CONTIG_LENGTHS
+        )
+        plan = plan_parallelism(tiles, CONTIG_LENGTHS, {"chr1": 10}, num_cores=4)
+        assert plan.num_workers == 1
+        assert plan.decode_threads == 4
+        assert "worker 1: 2 tile(s), ~10 reads" in plan.describe()
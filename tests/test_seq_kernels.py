@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from delfies.seq_kernels import (
+    INVALID_NUCLEOTIDE_CODE,
+    batch_rev_comp,
+    decode,
+    encode,
+    encode_kmer,
+    rev_comp,
+    rev_comp_bytes,
+    rolling_kmer_codes,
+)
+
+
+class TestReverseComplement:
+    def test_rev_comp_bytes_like(self):
+        sequence = b"AAcGTn"
+        expected = b"NACGTT"
+        assert rev_comp_bytes(sequence).tobytes() == expected
+        assert rev_comp_bytes(memoryview(sequence)).tobytes() == expected
+        assert rev_comp_bytes(sequence.decode()).tobytes() == expected
+
+    def test_batch_rev_comp(self):
+        sequences = ["AAC", "", "GGTA", "acgt"]
+        assert batch_rev_comp(sequences) == list(map(rev_comp, sequences))
+
+    def test_batch_rev_comp_no_sequences(self):
+        assert batch_rev_comp([]) == []
+
+
+class TestEncoding:
+    def test_encode_decode_round_trip(self):
+        sequence = "ACGTNacgtRN"
+        codes = encode(sequence)
+        assert codes.tolist()[:9] == [0, 1, 2, 3, INVALID_NUCLEOTIDE_CODE, 0, 1, 2, 3]
+        assert decode(codes) == "ACGTNACGTNN"
+
+    def test_encode_memory_mapped_bytes(self):
+        sequence = np.frombuffer(b"GATTACA", dtype=np.uint8)
+        assert decode(encode(sequence)) == "GATTACA"
+
+    @pytest.mark.parametrize("kmer_size", [1, 3, 5])
+    def test_rolling_kmer_codes(self, kmer_size):
+        sequence = "ACGTTGCANACGTAC"
+        expected = [
+            (
+                encode_kmer(sequence[i : i + kmer_size])
+                if "N" not in sequence[i : i + kmer_size]
+                else 4**kmer_size
+            )
+            for i in range(len(sequence) - kmer_size + 1)
+        ]
+        assert rolling_kmer_codes(encode(sequence), kmer_size).tolist() == expected
+
+    def test_rolling_kmer_codes_of_sequence_shorter_than_kmer(self):
+        assert len(rolling_kmer_codes(encode("AC"), 3)) == 0
@@ -1,7 +1,15 @@
+import re
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
 import pytest
 
+from delfies import Orientation
+from delfies.genome_utils import get_genome_identity
 from delfies.interval_utils import Interval
 from delfies.seq_utils import (
+    ExactOccurrenceFinder,
+    GenomeOccurrences,
     cyclic_shifts,
     find_all_occurrences_in_genome,
     randomly_substitute,
@@ -16,6 +24,10 @@ def test_rev_comp():
     assert rev_comp(seq1) == expected_seq1
 
 
+def test_rev_comp_lowercase_and_ambiguous_nucleotides():
+    assert rev_comp("acgRYn") == "NRYCGT"
+
+
 class TestSequenceMutations:
     def test_not_a_nucleotide_fails(self):
         seq_to_mutate = "PPDD"
@@ -63,7 +75,7 @@ class TestFindOccurrencesInGenomePerfectTeloArrays(ClassWithTempFasta):
     targeted_region = [Interval(chrom_name, 0, len(default_query_array))]
 
     def test_find_all_occs_no_hits(self):
-        fasta = self.make_fasta(self.telo_array_record)
+        fasta = self.make_fasta(self.telo_array_record, as_handle=True)
         result = find_all_occurrences_in_genome(
             "AATTTTTTAAA", fasta, self.search_region, interval_window_size=0
         )
@@ -74,19 +86,22 @@ class TestFindOccurrencesInGenomePerfectTeloArrays(ClassWithTempFasta):
         Tests both lowercase and uppercase genomic nucleotides
         """
         all_fastas = [
-            self.make_fasta(self.telo_array_record),
-            self.make_fasta(f">{self.chrom_name}\n{self.telo_array.lower()}"),
+            self.make_fasta(self.telo_array_record, as_handle=True),
+            self.make_fasta(
+                f">{self.chrom_name}\n{self.telo_array.lower()}", as_handle=True
+            ),
         ]
 
+        # Hits in both orientations are sorted by position
         expected = [
+            # Reverse hit
+            Interval(self.chrom_name, 0, len(self.default_query_array) - 1),
             # Forward hit
             Interval(
                 self.chrom_name,
                 len(self.default_query_array) + 2,
                 len(self.telo_array) - 1,
             ),
-            # Reverse hit
-            Interval(self.chrom_name, 0, len(self.default_query_array) - 1),
         ]
 
         for fasta in all_fastas:
@@ -99,7 +114,7 @@ class TestFindOccurrencesInGenomePerfectTeloArrays(ClassWithTempFasta):
             assert result == expected
 
     def test_find_all_occs_hits_in_region(self):
-        fasta = self.make_fasta(self.telo_array_record)
+        fasta = self.make_fasta(self.telo_array_record, as_handle=True)
         result = find_all_occurrences_in_genome(
             self.default_query_array,
             fasta,
@@ -116,7 +131,7 @@ class TestFindOccurrencesInGenomePerfectTeloArrays(ClassWithTempFasta):
         assert result == expected
 
     def test_find_all_occs_hits_with_window(self):
-        fasta = self.make_fasta(self.telo_array_record)
+        fasta = self.make_fasta(self.telo_array_record, as_handle=True)
         overflowing_window_size = 400
         result = find_all_occurrences_in_genome(
             self.default_query_array,
@@ -138,7 +153,7 @@ class TestFindOccurrencesInGenomeImperfectTeloArrays(ClassWithTempFasta):
     search_region = [Interval(chrom_name)]
 
     def test_contiguous_units_are_clustered(self):
-        fasta = self.make_fasta(self.telo_array_record)
+        fasta = self.make_fasta(self.telo_array_record, as_handle=True)
 
         result = find_all_occurrences_in_genome(
             self.telo_unit,
@@ -155,7 +170,7 @@ class TestFindOccurrencesInGenomeImperfectTeloArrays(ClassWithTempFasta):
         assert result == expected
 
     def test_find_separate_arrays(self):
-        fasta = self.make_fasta(self.telo_array_record)
+        fasta = self.make_fasta(self.telo_array_record, as_handle=True)
 
         result = find_all_occurrences_in_genome(
             self.telo_unit * 3,
@@ -173,7 +188,7 @@ class TestFindOccurrencesInGenomeImperfectTeloArrays(ClassWithTempFasta):
         assert result == expected
 
     def test_cluster_arrays_within_window_size(self):
-        fasta = self.make_fasta(self.telo_array_record)
+        fasta = self.make_fasta(self.telo_array_record, as_handle=True)
 
         result = find_all_occurrences_in_genome(
             self.telo_unit * 3,
@@ -186,3 +201,81 @@ class TestFindOccurrencesInGenomeImperfectTeloArrays(ClassWithTempFasta):
             Interval(self.chrom_name, 0, len(self.telo_unit) * 8 - 1),
         ]
         assert result == expected
+
+
+class TestGenomeOccurrences(ClassWithTempFasta):
+    chrom_name = "chr1"
+    telo_unit = "TTAGGC"
+    genome_seq = (
+        f"ACGT{telo_unit * 7}AAACCCGGGT{rev_comp(telo_unit) * 5}CCG{telo_unit * 2}"
+    )
+    genome_record = f">{chrom_name}\n{genome_seq}\n"
+
+    def test_matches_equal_regex_scan_of_region(self):
+        fasta = self.make_fasta(self.genome_record, as_handle=True)
+        genome_occurrences = GenomeOccurrences(
+            ExactOccurrenceFinder(self.telo_unit * 2), fasta
+        )
+        for start in range(0, len(self.genome_seq), 5):
+            for end in range(start, len(self.genome_seq) + 10, 7):
+                seq_region = Interval(self.chrom_name, start, end)
+                for orientation, pattern in [
+                    (Orientation.forward, self.telo_unit * 2),
+                    (Orientation.reverse, rev_comp(self.telo_unit * 2)),
+                ]:
+                    expected = [
+                        (match.start() + start, match.end() + start)
+                        for match in re.finditer(pattern, self.genome_seq[start:end])
+                    ]
+                    result = genome_occurrences.find_matches(seq_region, orientation)
+                    assert result == expected
+
+    def test_chunked_parallel_scan_matches_serial_scan(self):
+        fasta = self.make_fasta(self.genome_record, as_handle=True)
+        query_sequence = self.telo_unit * 2
+        serial_scan = GenomeOccurrences(ExactOccurrenceFinder(query_sequence), fasta)
+        for chunk_size in [1, 5, 12, 13, 1000]:
+            for threads in [1, 2]:
+                chunked_scan = GenomeOccurrences(
+                    ExactOccurrenceFinder(query_sequence),
+                    fasta,
+                    threads=threads,
+                    chunk_size=chunk_size,
+                )
+                for orientation in Orientation:
+                    assert (
+                        chunked_scan.get_occurrences(self.chrom_name, orientation)
+                        == serial_scan.get_occurrences(self.chrom_name, orientation)
+                    ).all()
+
+    def test_cached_occurrences_are_reused(self):
+        fasta = self.make_fasta(self.genome_record, as_handle=True)
+        search_region = [Interval(self.chrom_name)]
+        expected = find_all_occurrences_in_genome(
+            self.telo_unit * 3, fasta, search_region, interval_window_size=2
+        )
+        with TemporaryDirectory() as cache_dir:
+            result = find_all_occurrences_in_genome(
+                self.telo_unit * 3,
+                fasta,
+                search_region,
+                interval_window_size=2,
+                cache_dir=cache_dir,
+            )
+            assert result == expected
+            cache_fnames = list(Path(cache_dir).glob("*.npz"))
+            assert len(cache_fnames) == 1
+            # Keyed by the genome's path, size and mtime, as the genome's own cache
+            assert cache_fnames[0].name.startswith(
+                get_genome_identity(fasta.genome_fname)
+            )
+            genome_occurrences = GenomeOccurrences(
+                ExactOccurrenceFinder(self.telo_unit * 3), fasta, cache_dir
+            )
+            assert genome_occurrences.contigs == [self.chrom_name]
+            assert genome_occurrences.find_intervals(search_region, 2) == expected
+            # The cache is keyed by the query sequence
+            genome_occurrences = GenomeOccurrences(
+                ExactOccurrenceFinder(self.telo_unit * 2), fasta, cache_dir
+            )
+            assert genome_occurrences.contigs == []
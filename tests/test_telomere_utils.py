@@ -1,9 +1,27 @@
+from random import choice as random_choice
+from random import randint, seed
+
 import pytest
 
-from delfies import Orientation
+from delfies import (
+    BreakpointDetectionParams,
+    BreakpointFocus,
+    Orientation,
+    PutativeBreakpoint,
+)
+from delfies.interval_utils import Interval
 from delfies.SAM_utils import SoftclippedRead
 from delfies.seq_utils import cyclic_shifts, randomly_substitute, rev_comp
-from delfies.telomere_utils import TELOMERE_SEQS, has_softclipped_telo_array
+from delfies.telomere_utils import (
+    TELOMERE_SEQS,
+    TelomereMatcher,
+    choose_telomere_kmer_size,
+    count_telomere_kmers,
+    get_telomere_kmers,
+    has_softclipped_telo_array,
+    remove_breakpoints_in_telomere_arrays,
+)
+from tests import ClassWithTempFasta
 
 DEFAULT_ALIGNED_SEQ = "ATGCAAAAAAAAATTTGGA"
 DEFAULT_TELO_DICT = TELOMERE_SEQS["Nematoda"]
@@ -164,3 +182,252 @@ class TestFindSoftClippedTeloArraysInReads:
                 DEFAULT_MIN_TELO_ARRAY_SIZE,
                 max_edit_distance=1,
             )
+
+
+class TestTelomereKmerScreen:
+    def test_telomere_kmers_cover_all_cyclic_shifts(self):
+        assert get_telomere_kmers(DEFAULT_FORWARD_TELO, 6) == set(
+            cyclic_shifts(DEFAULT_FORWARD_TELO)
+        )
+        assert get_telomere_kmers("TTAGGC", 8) == {
+            "TTAGGCTT",
+            "TAGGCTTA",
+            "AGGCTTAG",
+            "GGCTTAGG",
+            "GCTTAGGC",
+            "CTTAGGCT",
+        }
+
+    def test_kmer_size_choice(self):
+        assert choose_telomere_kmer_size(DEFAULT_FORWARD_TELO, 60, 3) == 6
+        assert choose_telomere_kmer_size(DEFAULT_FORWARD_TELO, 18, 3) == 4
+        assert choose_telomere_kmer_size(DEFAULT_FORWARD_TELO, 6, 3) == 0
+
+    def test_count_telomere_kmers(self):
+        sequences = [
+            DEFAULT_FORWARD_TELO_ARRAY,
+            DEFAULT_NON_TELO_UNIT_FORWARD * 3,
+            "",
+            "TTA",
+            "TTAGNCTTAGGC",
+            DEFAULT_FORWARD_TELO_ARRAY.lower(),
+        ]
+        result = count_telomere_kmers(sequences, DEFAULT_FORWARD_TELO, 4)
+        assert list(result) == [15, 0, 0, 0, 5, 15]
+
+    def test_batched_search_matches_edlib_search(self, softclipped_read):
+        """
+        The k-mer screen must never reject a softclip that edlib finds a telomere array in
+        """
+        seed(42)
+        max_edit_distance = 3
+        reads = list()
+        for i in range(300):
+            softclip = DEFAULT_FORWARD_TELO * (DEFAULT_MIN_TELO_ARRAY_SIZE + 1)
+            if i % 2 == 0:
+                softclip = "".join(random_choice("ACGT") for _ in softclip)
+            for _ in range(randint(0, 3 * max_edit_distance)):
+                pos = randint(0, len(softclip) - 1)
+                mutation = random_choice(["sub", "ins", "del"])
+                nucleotide = random_choice("ACGT")
+                if mutation == "sub":
+                    softclip = softclip[:pos] + nucleotide + softclip[pos + 1 :]
+                elif mutation == "ins":
+                    softclip = softclip[:pos] + nucleotide + softclip[pos:]
+                else:
+                    softclip = softclip[:pos] + softclip[pos + 1 :]
+            reads.append(
+                SoftclippedRead(
+                    sequence=DEFAULT_ALIGNED_SEQ + softclip,
+                    name="test_softclipped_read",
+                    sc_ref=200,
+                    sc_query=len(DEFAULT_ALIGNED_SEQ),
+                    sc_length=len(softclip),
+                )
+            )
+        expected = [
+            has_softclipped_telo_array(
+                read,
+                Orientation.forward,
+                DEFAULT_TELO_DICT,
+                DEFAULT_MIN_TELO_ARRAY_SIZE,
+                max_edit_distance,
+            )
+            for read in reads
+        ]
+        assert any(expected) and not all(expected)
+        telomere_matcher = TelomereMatcher(
+            DEFAULT_TELO_DICT, DEFAULT_MIN_TELO_ARRAY_SIZE, max_edit_distance
+        )
+        result = telomere_matcher.find_softclipped_telo_arrays(
+            reads, [Orientation.forward] * len(reads)
+        )
+        assert result[Orientation.forward] == expected
+
+
+class TestTelomereMatcher:
+    def test_finds_telo_arrays_in_both_orientations_of_one_softclip(
+        self, softclipped_read
+    ):
+        telomere_matcher = TelomereMatcher(
+            DEFAULT_TELO_DICT, DEFAULT_MIN_TELO_ARRAY_SIZE, max_edit_distance=0
+        )
+        sequences = [
+            DEFAULT_FORWARD_TELO_ARRAY,
+            DEFAULT_REVERSE_TELO_ARRAY,
+            DEFAULT_NON_TELO_UNIT_FORWARD * DEFAULT_MIN_TELO_ARRAY_SIZE,
+        ]
+        reads = list()
+        for sequence in sequences:
+            reads.append(
+                SoftclippedRead(
+                    sequence=softclipped_read.sequence + sequence,
+                    name=softclipped_read.name,
+                    sc_ref=softclipped_read.sc_ref,
+                    sc_query=softclipped_read.sc_query,
+                    sc_length=len(sequence),
+                )
+            )
+        result = telomere_matcher.find_softclipped_telo_arrays(
+            reads, [Orientation.forward] * len(reads)
+        )
+        assert result == {
+            Orientation.forward: [True, False, False],
+            Orientation.reverse: [False, True, False],
+        }
+
+    def test_matchers_built_from_detection_params_are_shared(self):
+        detection_params = BreakpointDetectionParams(
+            bam_fname="NA",
+            telomere_seqs=DEFAULT_TELO_DICT,
+            telo_array_size=DEFAULT_MIN_TELO_ARRAY_SIZE,
+            max_edit_distance=1,
+            clustering_threshold=5,
+            min_mapq=0,
+            read_filter_flag=0,
+            min_supporting_reads=1,
+            keep_telomeric_breakpoints=False,
+        )
+        telomere_matcher = TelomereMatcher.from_detection_params(detection_params)
+        assert TelomereMatcher.from_detection_params(detection_params) is (
+            telomere_matcher
+        )
+        assert telomere_matcher.telo_arrays == {
+            Orientation.forward: DEFAULT_FORWARD_TELO_ARRAY,
+            Orientation.reverse: DEFAULT_REVERSE_TELO_ARRAY,
+        }
+        assert TelomereMatcher.from_detection_params(
+            detection_params, min_telo_array_size=5
+        ).telo_array_length == 5 * len(DEFAULT_FORWARD_TELO)
+
+
+class TestApproximateTelomereArraySearch(ClassWithTempFasta):
+    chrom_name = "chr1"
+
+    def test_occurrences_match_search_of_each_window(self):
+        seed(42)
+        for max_edit_distance in range(3):
+            telomere_matcher = TelomereMatcher(
+                DEFAULT_TELO_DICT, DEFAULT_MIN_TELO_ARRAY_SIZE + 2, max_edit_distance
+            )
+            for _ in range(10):
+                sequence = "".join(
+                    random_choice("ACGT") * randint(1, 3) for _ in range(10)
+                )
+                for telo_unit in DEFAULT_TELO_DICT.values():
+                    telo_array = random_choice(cyclic_shifts(telo_unit)) * randint(3, 8)
+                    sequence += randomly_substitute(telo_array, randint(0, 2))
+                    sequence += "".join(random_choice("ACGT") for _ in range(5))
+                for orientation in Orientation:
+                    expected = [
+                        position
+                        for position in range(
+                            len(sequence) - telomere_matcher.telo_array_length + 1
+                        )
+                        if telomere_matcher.has_telo_array(
+                            sequence[
+                                position : position + telomere_matcher.window_size
+                            ],
+                            orientation,
+                        )
+                    ]
+                    assert (
+                        telomere_matcher.find_occurrences(sequence, orientation)
+                        == expected
+                    )
+
+    def test_degenerate_genome_telomere_arrays_are_found(self):
+        degenerate_telo_array = (
+            DEFAULT_FORWARD_TELO * 2 + "TTTGGC" + DEFAULT_FORWARD_TELO * 2
+        )
+        fasta = self.make_fasta(
+            f">{self.chrom_name}\n{'ACGTACGTAA' * 3}{degenerate_telo_array}{'ACGTACGTAA' * 3}\n",
+            as_handle=True,
+        )
+        telomere_matcher = TelomereMatcher(DEFAULT_TELO_DICT, 5, max_edit_distance=1)
+        search_region = [Interval(self.chrom_name)]
+        assert (
+            telomere_matcher.find_in_genome(
+                telomere_matcher.get_genome_occurrences(fasta), search_region
+            )
+            == []
+        )
+        result = telomere_matcher.find_in_genome(
+            telomere_matcher.get_genome_occurrences(fasta, approximate=True),
+            search_region,
+        )
+        assert len(result) == 1
+        assert result[0].start <= 30
+        assert result[0].end >= 30 + len(degenerate_telo_array) - 1
+
+
+class TestRemoveBreakpointsInTelomereArrays(ClassWithTempFasta):
+    chrom_name = "chr1"
+    genome_seq = (
+        "ACGTACGTAA" * 5
+        + DEFAULT_FORWARD_TELO * 4
+        + "ACGTACGTAA" * 8
+        + DEFAULT_TELO_DICT[Orientation.reverse] * 3
+        + "ACGTACGTAA" * 3
+    )
+
+    def test_breakpoints_removed_iff_telomere_array_in_search_region(self):
+        fasta = self.make_fasta(
+            f">{self.chrom_name}\n{self.genome_seq}\n", as_handle=True
+        )
+        telomere_matcher = TelomereMatcher(
+            DEFAULT_TELO_DICT, DEFAULT_MIN_TELO_ARRAY_SIZE, max_edit_distance=0
+        )
+        putative_breakpoints = [
+            PutativeBreakpoint(
+                Orientation.forward,
+                1,
+                0,
+                0,
+                (position, position + 2),
+                BreakpointFocus(self.chrom_name, position, position + 1),
+            )
+            for position in range(0, len(self.genome_seq), 3)
+        ]
+        genome_occurrences = telomere_matcher.get_genome_occurrences(fasta)
+        margin = 2 * telomere_matcher.telo_array_length
+        expected = [
+            putative_breakpoint
+            for putative_breakpoint in putative_breakpoints
+            if telomere_matcher.find_in_genome(
+                genome_occurrences,
+                [
+                    Interval(
+                        self.chrom_name,
+                        max(putative_breakpoint.interval[0] - margin, 0),
+                        putative_breakpoint.interval[1] + margin,
+                    )
+                ],
+            )
+            == []
+        ]
+        result = remove_breakpoints_in_telomere_arrays(
+            genome_occurrences, telomere_matcher, putative_breakpoints
+        )
+        assert 0 < len(result) < len(putative_breakpoints)
+        assert result == expected